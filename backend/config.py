@@ -11,12 +11,24 @@ class Config:
     NAS_PASSWORD: Optional[str] = os.getenv("NAS_PASSWORD")
     NAS_SSH_KEY_PATH: Optional[str] = os.getenv("NAS_SSH_KEY_PATH")
     NAS_SSH_KEY_PASSPHRASE: Optional[str] = os.getenv("NAS_SSH_KEY_PASSPHRASE")
+    SSH_POOL_SIZE: int = int(os.getenv("SSH_POOL_SIZE", "3"))
+    SSH_CHANNELS_PER_CONNECTION: int = int(os.getenv("SSH_CHANNELS_PER_CONNECTION", "8"))
+    SSH_KEEPALIVE_SECONDS: int = int(os.getenv("SSH_KEEPALIVE_SECONDS", "30"))
     NAS_REPORTS_ROOT: Optional[str] = os.getenv("NAS_REPORTS_ROOT")
     BACKUP_ROOT: Optional[str] = os.getenv("BACKUP_ROOT")
     SORTED_ROOT: Optional[str] = os.getenv("SORTED_ROOT")
     LOCAL_STATE_DIR: str = os.getenv("LOCAL_STATE_DIR", "./state")
     RECYCLE_DIR_NAME: Optional[str] = os.getenv("RECYCLE_DIR_NAME")
     THUMB_MAX_SIZE: int = int(os.getenv("THUMB_MAX_SIZE", "512"))
+    THUMB_WEBP: bool = os.getenv("THUMB_WEBP", "false").lower() in ("1", "true", "yes")
+    THUMB_ENGINE: str = os.getenv("THUMB_ENGINE", "remote").lower()
+    THUMB_NAS_MAX_LOAD: float = float(os.getenv("THUMB_NAS_MAX_LOAD", "1.0"))
+    THUMB_CACHE_MAX_MB: int = int(os.getenv("THUMB_CACHE_MAX_MB", "2048"))
+    THUMB_MEMORY_CACHE_MB: int = int(os.getenv("THUMB_MEMORY_CACHE_MB", "64"))
+    THUMB_PREFETCH_COUNT: int = int(os.getenv("THUMB_PREFETCH_COUNT", "20"))
+    HASH_SAMPLE_KB: int = int(os.getenv("HASH_SAMPLE_KB", "64"))
+    PHASH_MAX_DISTANCE: int = int(os.getenv("PHASH_MAX_DISTANCE", "6"))
+    DB_SLOW_QUERY_MS: float = float(os.getenv("DB_SLOW_QUERY_MS", "50"))
 
     @classmethod
     def get_status(cls) -> dict:
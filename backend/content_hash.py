@@ -0,0 +1,308 @@
+import os
+import sqlite3
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from backend.config import Config
+from backend.db import connect
+from backend.ssh_client import SSHClient, encode_remote
+from backend.scan_progress import ScanProgress
+from backend.duplicate_scanner import (
+    ROLE_BACKUP, ROLE_SORTED, MATCH_IDENTICAL, MATCH_SAME_SIZE, MATCH_DIFFERENT, MATCH_UNVERIFIED
+)
+
+logger = logging.getLogger(__name__)
+
+HASH_KIND_FULL = 'sha1'
+
+# Groups verified per chunk, so memory stays bounded on large sessions
+VERIFY_CHUNK_GROUPS = 1000
+
+# Best outcome first; a backup member's status is the best over its sorted partners
+_STATUS_RANK = [MATCH_IDENTICAL, MATCH_SAME_SIZE, MATCH_DIFFERENT, MATCH_UNVERIFIED]
+
+# Paths passed to one remote stat command
+STAT_BATCH_SIZE = 2000
+
+# Limits for one remote hashing command
+HASH_BATCH_FILES = 256
+HASH_BATCH_BYTES = 4 * 1024 * 1024 * 1024
+
+# Bound parameters per SQLite IN (...) lookup
+SQL_LOOKUP_BATCH = 500
+
+def _encode_paths(paths: Iterable[str]) -> bytes:
+    """Null-delimited path list for `xargs -0`."""
+    return b''.join(encode_remote(path) + b'\0' for path in paths)
+
+def stat_remote_files(paths: List[str]) -> Dict[str, Tuple[int, float]]:
+    """
+    Get (size, mtime) for many remote files, a few thousand per SSH round trip.
+    Files that no longer exist are missing from the result.
+    """
+    stats: Dict[str, Tuple[int, float]] = {}
+    for start in range(0, len(paths), STAT_BATCH_SIZE):
+        batch = paths[start:start + STAT_BATCH_SIZE]
+        command = "xargs -0 stat --printf '%s %Y %n\\0' 2>/dev/null"
+        for record in SSHClient.stream_command(command, delimiter=b'\0', stdin_data=_encode_paths(batch), check=False):
+            parts = record.split(' ', 2)
+            if len(parts) != 3:
+                continue
+            try:
+                stats[parts[2]] = (int(parts[0]), float(parts[1]))
+            except ValueError:
+                continue
+    return stats
+
+def _hash_batches(paths: List[str], stats: Dict[str, Tuple[int, float]]) -> Iterable[List[str]]:
+    batch: List[str] = []
+    batch_bytes = 0
+    for path in paths:
+        size = stats[path][0]
+        if batch and (len(batch) >= HASH_BATCH_FILES or batch_bytes + size > HASH_BATCH_BYTES):
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append(path)
+        batch_bytes += size
+    if batch:
+        yield batch
+
+def hash_remote_files(paths: List[str]) -> Dict[str, str]:
+    """Compute SHA-1 hashes on the NAS with a single `xargs sha1sum` command for the given paths."""
+    hashes: Dict[str, str] = {}
+    command = "xargs -0 sha1sum 2>/dev/null"
+    for line in SSHClient.stream_command(command, stdin_data=_encode_paths(paths), check=False):
+        # sha1sum escapes unusual filenames and marks the line with a leading backslash
+        if line.startswith('\\') or len(line) < 43:
+            continue
+        hashes[line[42:]] = line[:40]
+    return hashes
+
+def hash_remote_samples(paths: List[str], sample_size: int) -> Dict[str, str]:
+    """
+    Compute SHA-1 hashes of the first and last `sample_size` bytes of each file on the NAS,
+    with a single remote command for the given paths.
+    """
+    hashes: Dict[str, str] = {}
+    command = (
+        "xargs -0 sh -c 'for f; do "
+        f"h=$({{ head -c {sample_size} \"$f\"; tail -c {sample_size} \"$f\"; }} 2>/dev/null | sha1sum); "
+        "printf \"%s %s\\000\" \"${h%% *}\" \"$f\"; "
+        "done' _"
+    )
+    for record in SSHClient.stream_command(command, delimiter=b'\0', stdin_data=_encode_paths(paths), check=False):
+        if len(record) < 42:
+            continue
+        hashes[record[41:]] = record[:40]
+    return hashes
+
+def get_cached_hashes(conn: sqlite3.Connection, kind: str, stats: Dict[str, Tuple[int, float]]) -> Dict[str, str]:
+    """Look up cached hashes that are still valid for the given (size, mtime) stats."""
+    cached: Dict[str, str] = {}
+    paths = list(stats)
+    for start in range(0, len(paths), SQL_LOOKUP_BATCH):
+        batch = paths[start:start + SQL_LOOKUP_BATCH]
+        placeholders = ','.join('?' * len(batch))
+        rows = conn.execute(f"""
+            SELECT path, size, mtime, hash FROM file_hashes
+            WHERE kind = ? AND path IN ({placeholders})
+        """, (kind, *batch)).fetchall()
+        for path, size, mtime, file_hash in rows:
+            if stats[path] == (size, mtime):
+                cached[path] = file_hash
+    return cached
+
+def store_hashes(conn: sqlite3.Connection, kind: str, hashes: Dict[str, str], stats: Dict[str, Tuple[int, float]]):
+    timestamp = datetime.now().isoformat()
+    conn.executemany("""
+        INSERT OR REPLACE INTO file_hashes (path, kind, size, mtime, hash, hashed_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, [(path, kind, *stats[path], file_hash, timestamp) for path, file_hash in hashes.items()])
+    conn.commit()
+
+def move_hashes(conn: sqlite3.Connection, old_path: str, new_path: str):
+    """Carry a file's cached hashes over to where it was moved; a move keeps size and mtime."""
+    conn.execute("UPDATE OR REPLACE file_hashes SET path = ? WHERE path = ?", (new_path, old_path))
+
+def new_io_report() -> Dict:
+    """Bytes read on the NAS per hashing tier, overall and per file extension."""
+    return {'sample': {'files': 0, 'bytes': 0}, 'full': {'files': 0, 'bytes': 0}, 'bytes_avoided': 0, 'by_extension': {}}
+
+def _record_io(io: Dict, tier: str, path: str, nbytes: int):
+    io[tier]['files'] += 1
+    io[tier]['bytes'] += nbytes
+    ext = os.path.splitext(path.lower())[1] or '(none)'
+    by_ext = io['by_extension'].setdefault(ext, {'sample_bytes': 0, 'full_bytes': 0, 'bytes_avoided': 0})
+    by_ext[f'{tier}_bytes'] += nbytes
+
+def _merge_io(total: Dict, io: Dict):
+    for tier in ('sample', 'full'):
+        total[tier]['files'] += io[tier]['files']
+        total[tier]['bytes'] += io[tier]['bytes']
+    total['bytes_avoided'] += io['bytes_avoided']
+    for ext, counts in io['by_extension'].items():
+        by_ext = total['by_extension'].setdefault(ext, {'sample_bytes': 0, 'full_bytes': 0, 'bytes_avoided': 0})
+        for key, value in counts.items():
+            by_ext[key] += value
+
+def get_hashes(conn: sqlite3.Connection, kind: str, stats: Dict[str, Tuple[int, float]],
+               progress: Optional[ScanProgress] = None, io: Optional[Dict] = None) -> Dict[str, str]:
+    """
+    Get hashes of the given kind for files with known stats, hashing on the NAS only
+    those files whose cached hash is missing or out of date.
+    """
+    sample_size = Config.HASH_SAMPLE_KB * 1024
+    tier = 'full' if kind == HASH_KIND_FULL else 'sample'
+
+    hashes = get_cached_hashes(conn, kind, stats)
+    missing = sorted(path for path in stats if path not in hashes)
+    if missing:
+        logger.info(f"Computing {tier} hashes for {len(missing)} files on NAS ({len(hashes)} cached)")
+    for batch in _hash_batches(missing, stats):
+        if progress:
+            progress.check_cancelled()
+        if tier == 'full':
+            computed = hash_remote_files(batch)
+        else:
+            computed = hash_remote_samples(batch, sample_size)
+        store_hashes(conn, kind, computed, stats)
+        hashes.update(computed)
+        if io is not None:
+            for path in computed:
+                size = stats[path][0]
+                _record_io(io, tier, path, size if tier == 'full' else 2 * min(size, sample_size))
+    return hashes
+
+def get_content_hashes(conn: sqlite3.Connection, stats: Dict[str, Tuple[int, float]],
+                       progress: Optional[ScanProgress] = None, io: Optional[Dict] = None) -> Dict[str, str]:
+    """Get full-content hashes, computing only those missing from the cache."""
+    return get_hashes(conn, HASH_KIND_FULL, stats, progress, io)
+
+def hash_candidates(conn: sqlite3.Connection, files: List[Tuple[object, str, str, Tuple[int, float]]],
+                     progress: Optional[ScanProgress] = None, io: Optional[Dict] = None) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """
+    Hash the (key, role, path, (size, mtime)) files that could have an identical counterpart,
+    i.e. those sharing a key and size with a file of the other role, cheapest check first:
+    a hash of the first and last HASH_SAMPLE_KB of each file, and a full hash only while
+    the key, size and sample are still shared. Files no bigger than two samples are hashed
+    in full straight away, since that reads no more than sampling.
+    Returns (sample_hashes, full_hashes) by path.
+    """
+    sample_size = Config.HASH_SAMPLE_KB * 1024
+    sample_kind = f'sample:{sample_size}'
+
+    roles_by_size: Dict[tuple, set] = {}
+    for key, role, path, stat in files:
+        roles_by_size.setdefault((key, stat[0]), set()).add(role)
+    candidates = {path: stat for key, role, path, stat in files if len(roles_by_size[(key, stat[0])]) > 1}
+    small = {path: stat for path, stat in candidates.items() if stat[0] <= 2 * sample_size}
+    large = {path: stat for path, stat in candidates.items() if stat[0] > 2 * sample_size}
+
+    # What a full-hash-only approach would have read, to report the savings against
+    naive_by_ext: Dict[str, int] = {}
+    for path in set(candidates) - set(get_cached_hashes(conn, HASH_KIND_FULL, candidates)):
+        ext = os.path.splitext(path.lower())[1] or '(none)'
+        naive_by_ext[ext] = naive_by_ext.get(ext, 0) + candidates[path][0]
+
+    pass_io = new_io_report()
+    samples = get_hashes(conn, sample_kind, large, progress, pass_io)
+
+    roles_by_sample: Dict[tuple, set] = {}
+    for key, role, path, stat in files:
+        if path in large and path in samples:
+            roles_by_sample.setdefault((key, stat[0], samples[path]), set()).add(role)
+    still_tied = {path: stat for key, role, path, stat in files
+                  if path in large and path in samples and len(roles_by_sample[(key, stat[0], samples[path])]) > 1}
+    hashes = get_content_hashes(conn, {**small, **still_tied}, progress, pass_io)
+
+    for ext, naive in naive_by_ext.items():
+        by_ext = pass_io['by_extension'].setdefault(ext, {'sample_bytes': 0, 'full_bytes': 0, 'bytes_avoided': 0})
+        by_ext['bytes_avoided'] = naive - by_ext['sample_bytes'] - by_ext['full_bytes']
+        pass_io['bytes_avoided'] += by_ext['bytes_avoided']
+    if io is not None:
+        _merge_io(io, pass_io)
+    return samples, hashes
+
+def _pair_status(backup: Tuple, kept: Tuple) -> str:
+    """Classify a pair from its members' (size, sample_hash, content_hash)."""
+    if backup[0] is None or kept[0] is None:
+        return MATCH_UNVERIFIED
+    if backup[0] != kept[0]:
+        return MATCH_DIFFERENT
+    if backup[2] and kept[2]:
+        return MATCH_IDENTICAL if backup[2] == kept[2] else MATCH_SAME_SIZE
+    if backup[1] and kept[1] and backup[1] != kept[1]:
+        return MATCH_SAME_SIZE
+    return MATCH_UNVERIFIED
+
+def verify_session(scan_session_id: str, progress: Optional[ScanProgress] = None) -> Dict[str, int]:
+    """
+    Verify every group of a scan session that has unverified backup members. Each member's
+    size and hashes are recorded, so any pair's status can be derived from its two members,
+    and each backup member gets the best status over its sorted partners.
+    Returns counts of backup members per match status plus bytes read on the NAS by each hashing tier.
+    """
+    summary = {MATCH_IDENTICAL: 0, MATCH_SAME_SIZE: 0, MATCH_DIFFERENT: 0, MATCH_UNVERIFIED: 0}
+    io = new_io_report()
+    conn = connect()
+    try:
+        last_group = 0
+        while True:
+            if progress:
+                progress.check_cancelled()
+            group_ids = [row[0] for row in conn.execute("""
+                SELECT g.id FROM duplicate_groups g
+                WHERE g.scan_session_id = ? AND g.id > ?
+                  AND EXISTS (
+                      SELECT 1 FROM group_members m
+                      WHERE m.group_id = g.id AND m.role = ? AND m.match_status IS NULL
+                  )
+                ORDER BY g.id
+                LIMIT ?
+            """, (scan_session_id, last_group, ROLE_BACKUP, VERIFY_CHUNK_GROUPS))]
+            if not group_ids:
+                break
+            last_group = group_ids[-1]
+
+            members = conn.execute(f"""
+                SELECT id, group_id, role, path FROM group_members
+                WHERE group_id IN ({','.join('?' * len(group_ids))})
+            """, group_ids).fetchall()
+
+            stats = stat_remote_files(sorted({path for _, _, _, path in members}))
+            samples, hashes = hash_candidates(conn, [
+                (group_id, role, path, stats[path]) for _, group_id, role, path in members if path in stats
+            ], progress, io)
+
+            facts = {}
+            for member_id, _, _, path in members:
+                facts[member_id] = (stats[path][0] if path in stats else None, samples.get(path), hashes.get(path))
+
+            sorted_by_group: Dict[int, List[int]] = {}
+            for member_id, group_id, role, _ in members:
+                if role == ROLE_SORTED:
+                    sorted_by_group.setdefault(group_id, []).append(member_id)
+
+            updates = []
+            for member_id, group_id, role, _ in members:
+                status = None
+                if role == ROLE_BACKUP:
+                    status = min((_pair_status(facts[member_id], facts[kept_id]) for kept_id in sorted_by_group.get(group_id, [])),
+                                 key=_STATUS_RANK.index, default=MATCH_UNVERIFIED)
+                    summary[status] += 1
+                updates.append((*facts[member_id], status, member_id))
+            conn.executemany("""
+                UPDATE group_members
+                SET size = ?, sample_hash = ?, content_hash = ?, match_status = COALESCE(?, match_status)
+                WHERE id = ?
+            """, updates)
+            conn.commit()
+
+            if progress:
+                progress.add_pairs_verified(sum(1 for _, _, role, _ in members if role == ROLE_BACKUP))
+    finally:
+        conn.close()
+
+    logger.info(f"Verified session {scan_session_id}: {summary}; read {io['sample']['bytes']} sample bytes, "
+                f"{io['full']['bytes']} full-hash bytes, avoided {io['bytes_avoided']} bytes")
+    return {**summary, 'io': io}
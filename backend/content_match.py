@@ -0,0 +1,136 @@
+import sqlite3
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from backend.db import connect
+from backend.scan_progress import ScanProgress
+from backend.content_hash import hash_candidates, new_io_report
+from backend.duplicate_scanner import ROLE_BACKUP, ROLE_SORTED, MATCH_IDENTICAL, apply_ignored_pairs, refresh_session_counts
+
+logger = logging.getLogger(__name__)
+
+MATCH_TYPE_CONTENT = 'content'
+
+# Distinct file sizes handled per chunk. A size group is never split across chunks,
+# so the per-chunk tiering sees every file that could share its content.
+SIZE_CHUNK = 2000
+
+def _hash_chunk(conn: sqlite3.Connection, rows: List[Tuple[int, str, int, float]],
+                progress: Optional[ScanProgress], io: Dict) -> List[Tuple[int, str, int, str]]:
+    """Content-hash one chunk of (side, path, size, mtime) rows. Returns (side, path, size, hash) rows."""
+    # stat's %Y is whole seconds; truncating keeps cache entries shared with group verification
+    files = [(None, side, path, (size, float(int(mtime)))) for side, path, size, mtime in rows]
+    _, hashes = hash_candidates(conn, files, progress, io)
+    return [(side, path, size, hashes[path]) for side, path, size, _ in rows if path in hashes]
+
+def add_content_pairs(scan_session_id: str, backup_root: str, sorted_root: str,
+                      progress: Optional[ScanProgress] = None) -> Dict:
+    """
+    Add groups of identical files to a scan session regardless of their names, by joining
+    the indexed backup and sorted files on (size, content hash).
+
+    Only sizes present under both roots are hashed, a chunk of sizes at a time, and hashes
+    come from the file_hashes cache where still valid. The hashed files are collected in a
+    temporary table and grouped with indexed queries in SQLite, so memory stays bounded
+    by the chunk size rather than the size of either tree. Backup files already grouped in
+    the session (e.g. by filename) are left out; previously ignored pairs stay ignored.
+    Returns counts of candidate files, groups and pairs added, and bytes read on the NAS.
+    """
+    if progress:
+        progress.set_phase('hashing_content')
+
+    io = new_io_report()
+    conn = connect()
+    try:
+        conn.execute("CREATE TEMP TABLE shared_sizes (size INTEGER PRIMARY KEY)")
+        conn.execute("""
+            INSERT INTO shared_sizes
+            SELECT size FROM remote_files WHERE root = ? AND size > 0
+            INTERSECT
+            SELECT size FROM remote_files WHERE root = ? AND size > 0
+        """, (backup_root, sorted_root))
+
+        conn.execute("""
+            CREATE TEMP TABLE content_keys (
+                side INTEGER NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                hash TEXT NOT NULL
+            )
+        """)
+
+        candidates = 0
+        last_size = 0
+        while True:
+            if progress:
+                progress.check_cancelled()
+            sizes = [row[0] for row in conn.execute(
+                "SELECT size FROM shared_sizes WHERE size > ? ORDER BY size LIMIT ?",
+                (last_size, SIZE_CHUNK)
+            )]
+            if not sizes:
+                break
+            last_size = sizes[-1]
+
+            rows = conn.execute(f"""
+                SELECT CASE WHEN f.root = ? THEN 0 ELSE 1 END, f.path, f.size, f.mtime
+                FROM remote_files f
+                WHERE f.root IN (?, ?) AND f.size IN ({','.join('?' * len(sizes))})
+            """, (backup_root, backup_root, sorted_root, *sizes)).fetchall()
+            candidates += len(rows)
+
+            conn.executemany("INSERT INTO content_keys VALUES (?, ?, ?, ?)",
+                             _hash_chunk(conn, rows, progress, io))
+
+        conn.execute("CREATE INDEX temp.idx_content_keys ON content_keys(hash, side)")
+
+        if progress:
+            progress.set_phase('matching_content')
+
+        # Each backup file is reviewed once per session, in the group it was first found in
+        conn.execute("""
+            DELETE FROM content_keys
+            WHERE side = 0 AND path IN (
+                SELECT path FROM group_members WHERE scan_session_id = ? AND role = ?
+            )
+        """, (scan_session_id, ROLE_BACKUP))
+
+        first_new_group = conn.execute("SELECT COALESCE(MAX(id), 0) FROM duplicate_groups").fetchone()[0]
+        groups = conn.execute("""
+            INSERT INTO duplicate_groups (scan_session_id, group_key, match_type, created_at)
+            SELECT ?, 'content:' || hash, ?, ?
+            FROM content_keys
+            GROUP BY hash
+            HAVING MIN(side) = 0 AND MAX(side) = 1
+            ORDER BY MIN(path)
+        """, (scan_session_id, MATCH_TYPE_CONTENT, datetime.now().isoformat())).rowcount
+        # Members are identical by construction, so they are stored verified
+        conn.execute("""
+            INSERT INTO group_members (group_id, scan_session_id, role, path, size, content_hash, match_status)
+            SELECT g.id, g.scan_session_id,
+                   CASE ck.side WHEN 0 THEN ? ELSE ? END,
+                   ck.path, ck.size, ck.hash,
+                   CASE ck.side WHEN 0 THEN ? END
+            FROM duplicate_groups g
+            JOIN content_keys ck ON ck.hash = substr(g.group_key, 9)
+            WHERE g.scan_session_id = ? AND g.id > ?
+            ORDER BY g.id, ck.side, ck.path
+        """, (ROLE_BACKUP, ROLE_SORTED, MATCH_IDENTICAL, scan_session_id, first_new_group))
+        added = conn.execute("""
+            SELECT COALESCE(SUM(
+                (SELECT COUNT(*) FROM group_members m WHERE m.group_id = g.id AND m.role = ?) *
+                (SELECT COUNT(*) FROM group_members m WHERE m.group_id = g.id AND m.role = ?)
+            ), 0)
+            FROM duplicate_groups g
+            WHERE g.scan_session_id = ? AND g.id > ?
+        """, (ROLE_BACKUP, ROLE_SORTED, scan_session_id, first_new_group)).fetchone()[0]
+
+        apply_ignored_pairs(conn, scan_session_id)
+        refresh_session_counts(conn, scan_session_id)
+        conn.commit()
+    finally:
+        conn.close()
+
+    logger.info(f"Added {groups} content-matched groups ({added} pairs) to session {scan_session_id} "
+                f"({candidates} candidate files, read {io['sample']['bytes'] + io['full']['bytes']} bytes)")
+    return {'content_candidates': candidates, 'content_groups': groups, 'content_pairs': added, 'content_io': io}
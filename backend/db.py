@@ -1,15 +1,157 @@
 import sqlite3
 import os
-from pathlib import Path
+import time
+import threading
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
 from backend.config import Config
 
-def init_db():
-    os.makedirs(Config.LOCAL_STATE_DIR, exist_ok=True)
-    db_path = os.path.join(Config.LOCAL_STATE_DIR, "state.db")
-    
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+logger = logging.getLogger(__name__)
+
+# Prepared statements kept per connection; review actions reuse a handful of them constantly
+STATEMENT_CACHE_SIZE = 512
+
+# Applied to every connection. WAL itself is persistent and set once in init_db.
+_PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -32768",
+    "PRAGMA busy_timeout = 30000",
+)
+
+# Called with (sql, seconds) after every statement
+_query_hooks: List[Callable[[str, float], None]] = []
+
+def add_query_hook(hook: Callable[[str, float], None]):
+    """Register a callback that receives (sql, seconds) for every executed statement."""
+    _query_hooks.append(hook)
+
+def remove_query_hook(hook: Callable[[str, float], None]):
+    if hook in _query_hooks:
+        _query_hooks.remove(hook)
+
+def _log_slow_query(sql: str, seconds: float):
+    if seconds * 1000 >= Config.DB_SLOW_QUERY_MS:
+        logger.warning(f"Slow query ({seconds * 1000:.1f} ms): {' '.join(sql.split())[:200]}")
+
+add_query_hook(_log_slow_query)
+
+def _report(sql: str, started: float, statements: int = 1):
+    elapsed = (time.perf_counter() - started) / max(statements, 1)
+    for hook in _query_hooks:
+        hook(sql, elapsed)
+
+class TimedCursor(sqlite3.Cursor):
+    """
+    Cursor that reports each statement's execution time to the query hooks.
+    For SELECTs this covers executing up to the first row; fetching the rest is not included.
+    executemany reports the average time per parameter set, so bulk inserts aren't flagged as slow.
+    """
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _report(sql, started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _report(sql, started, self.rowcount)
+
+class TimedConnection(sqlite3.Connection):
+    """Connection whose cursors, including those behind Connection.execute, are TimedCursors."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+def get_db_path() -> str:
+    return os.path.join(Config.LOCAL_STATE_DIR, "state.db")
+
+def connect(isolation_level: Optional[str] = "", timeout: float = 30) -> sqlite3.Connection:
+    """
+    Open a new tuned connection to the state database. Used for long-running work
+    (scans, hashing, bulk ingest) that wants its own connection; the caller closes it.
+    """
+    conn = sqlite3.connect(
+        get_db_path(),
+        timeout=timeout,
+        isolation_level=isolation_level,
+        factory=TimedConnection,
+        cached_statements=STATEMENT_CACHE_SIZE
+    )
+    for pragma in _PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+_local = threading.local()
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Get this thread's shared connection to the state database, opening it on first use.
+    Short request-path queries use it so they skip connection setup and hit the prepared
+    statement cache. Don't close it; commit or roll back before returning.
+    """
+    conn = getattr(_local, 'conn', None)
+    path = get_db_path()
+    if conn is None or getattr(_local, 'path', None) != path:
+        if conn is not None:
+            conn.close()
+        conn = connect()
+        _local.conn = conn
+        _local.path = path
+    return conn
+
+def close_thread_connection():
+    """Close this thread's shared connection, if it has one."""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+def _add_missing_columns(cursor: sqlite3.Cursor, table: str, columns: Dict[str, str]):
+    """Add any of the given columns (name -> SQL type) that an existing table is missing."""
+    cursor.execute(f"PRAGMA table_info({table})")
+    existing = {row[1] for row in cursor.fetchall()}
+    for name, column_type in columns.items():
+        if name not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+
+def _migrate_review_queue(cursor: sqlite3.Cursor):
+    """Convert pair rows from review_queue into groups, once, so existing sessions stay reviewable."""
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM duplicate_groups), EXISTS (SELECT 1 FROM review_queue)")
+    has_groups, has_pairs = cursor.fetchone()
+    if has_groups or not has_pairs:
+        return
     
+    cursor.execute("""
+        INSERT INTO duplicate_groups (scan_session_id, group_key, match_type, created_at)
+        SELECT scan_session_id, group_id, COALESCE(MAX(match_type), 'filename'), MIN(created_at)
+        FROM review_queue
+        WHERE scan_session_id IS NOT NULL
+        GROUP BY scan_session_id, group_id
+    """)
+    cursor.execute("""
+        INSERT INTO group_members (group_id, scan_session_id, role, path, reviewed, action)
+        SELECT g.id, g.scan_session_id, 'backup', rq.backup_path,
+               MIN(rq.reviewed), CASE WHEN MIN(rq.reviewed) = 1 THEN MAX(rq.action) END
+        FROM review_queue rq
+        JOIN duplicate_groups g ON g.scan_session_id = rq.scan_session_id AND g.group_key = rq.group_id
+        GROUP BY g.id, rq.backup_path
+    """)
+    cursor.execute("""
+        INSERT INTO group_members (group_id, scan_session_id, role, path, match_distance)
+        SELECT g.id, g.scan_session_id, 'sorted', rq.kept_path, MIN(rq.match_distance)
+        FROM review_queue rq
+        JOIN duplicate_groups g ON g.scan_session_id = rq.scan_session_id AND g.group_key = rq.group_id
+        GROUP BY g.id, rq.kept_path
+    """)
+
+def _migration_1_baseline(cursor: sqlite3.Cursor):
+    """Tables as they existed before schema versioning; safe to run on databases that have them."""
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS jobs (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -18,9 +160,18 @@ def init_db():
             src_path TEXT,
             dst_path TEXT,
             status TEXT NOT NULL,
-            error TEXT
+            error TEXT,
+            progress TEXT,
+            result TEXT,
+            updated_at TEXT
         )
     """)
+    # Databases created before jobs were used for background scans lack these columns
+    _add_missing_columns(cursor, "jobs", {
+        "progress": "TEXT",
+        "result": "TEXT",
+        "updated_at": "TEXT",
+    })
     
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS review_queue (
@@ -31,9 +182,17 @@ def init_db():
             reviewed INTEGER DEFAULT 0,
             action TEXT,
             scan_session_id TEXT,
-            created_at TEXT NOT NULL
+            created_at TEXT NOT NULL,
+            match_status TEXT,
+            match_type TEXT,
+            match_distance INTEGER
         )
     """)
+    _add_missing_columns(cursor, "review_queue", {
+        "match_status": "TEXT",
+        "match_type": "TEXT",
+        "match_distance": "INTEGER",
+    })
     
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS scan_sessions (
@@ -45,6 +204,40 @@ def init_db():
         )
     """)
     
+    # Duplicates are stored as groups of backup and sorted members; pairs are derived when read.
+    # Review state lives on the members, since actions apply to individual files.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS duplicate_groups (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            scan_session_id TEXT NOT NULL,
+            group_key TEXT NOT NULL,
+            match_type TEXT NOT NULL DEFAULT 'filename',
+            created_at TEXT NOT NULL
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_duplicate_groups_session ON duplicate_groups(scan_session_id)")
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS group_members (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            group_id INTEGER NOT NULL,
+            scan_session_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            path TEXT NOT NULL,
+            reviewed INTEGER DEFAULT 0,
+            action TEXT,
+            match_status TEXT,
+            match_distance INTEGER,
+            size INTEGER,
+            sample_hash TEXT,
+            content_hash TEXT
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_group_members_group ON group_members(group_id, role)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_group_members_session ON group_members(scan_session_id, role, path)")
+    
+    _migrate_review_queue(cursor)
+    
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS cache_metadata (
             path TEXT PRIMARY KEY,
@@ -55,7 +248,7 @@ def init_db():
         )
     """)
     
-    # Create undo stack table for session-based undo
+    # Create undo stack table for session-based undo; review_id is the group_members row acted on
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS undo_stack (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -81,8 +274,194 @@ def init_db():
         )
     """)
     
-    conn.commit()
-    conn.close()
+    # Persistent index of remote image files, refreshed incrementally on rescans
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS remote_files (
+            root TEXT NOT NULL,
+            path TEXT NOT NULL,
+            dir TEXT NOT NULL,
+            name TEXT NOT NULL,
+            name_key TEXT NOT NULL,
+            size INTEGER,
+            mtime REAL,
+            inode INTEGER,
+            indexed_at TEXT NOT NULL,
+            PRIMARY KEY (root, path)
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_remote_files_name_key ON remote_files(root, name_key)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_remote_files_dir ON remote_files(root, dir)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_remote_files_indexed_at ON remote_files(root, indexed_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_remote_files_size ON remote_files(root, size)")
+    
+    # Directory mtimes let a rescan skip directories whose entries haven't changed
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS remote_dirs (
+            root TEXT NOT NULL,
+            path TEXT NOT NULL,
+            mtime REAL,
+            indexed_at TEXT NOT NULL,
+            PRIMARY KEY (root, path)
+        )
+    """)
     
-    return db_path
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS remote_roots (
+            root TEXT PRIMARY KEY,
+            exclude_path TEXT NOT NULL DEFAULT '',
+            refreshed_at TEXT NOT NULL
+        )
+    """)
+    
+    # Content hashes computed on the NAS, valid while a file's size and mtime are unchanged
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS file_hashes (
+            path TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            hash TEXT NOT NULL,
+            hashed_at TEXT NOT NULL,
+            PRIMARY KEY (path, kind)
+        )
+    """)
+    
+    # 64-bit dHash per image, split into four 16-bit bands for multi-index Hamming search
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS perceptual_hashes (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            dhash INTEGER NOT NULL,
+            band0 INTEGER NOT NULL,
+            band1 INTEGER NOT NULL,
+            band2 INTEGER NOT NULL,
+            band3 INTEGER NOT NULL,
+            computed_at TEXT NOT NULL
+        )
+    """)
+    for band in range(4):
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_perceptual_hashes_band{band} ON perceptual_hashes(band{band})")
 
+def _migration_2_indexes(cursor: sqlite3.Cursor):
+    """Indexes for the lookups review actions, session listing and jobs do on every request."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_group_members_review ON group_members(scan_session_id, role, reviewed)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_scan_sessions_roots ON scan_sessions(backup_path, sorted_path, created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_scan_sessions_created ON scan_sessions(created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_undo_stack_session ON undo_stack(session_id, timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_type ON jobs(type, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_review_queue_session ON review_queue(scan_session_id, reviewed, action)")
+
+def _migration_3_pagination(cursor: sqlite3.Cursor):
+    """Keyset pagination of a session's backup members by id, with or without reviewed ones."""
+    # Lets the unreviewed listing use reviewed = 0 alone, which walks idx_group_members_review in id order
+    cursor.execute("UPDATE group_members SET reviewed = 0 WHERE reviewed IS NULL")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_group_members_page ON group_members(scan_session_id, role, id)")
+
+def _migration_4_review_stats(cursor: sqlite3.Cursor):
+    """Per-session review counters, so stats are read in O(1) instead of counted per request."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS review_stats (
+            scan_session_id TEXT PRIMARY KEY,
+            total INTEGER NOT NULL DEFAULT 0,
+            reviewed INTEGER NOT NULL DEFAULT 0,
+            deleted INTEGER NOT NULL DEFAULT 0,
+            ignored INTEGER NOT NULL DEFAULT 0,
+            reclaimable_bytes INTEGER NOT NULL DEFAULT 0,
+            reclaimed_bytes INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    # Review actions, ignore propagation and verification update backup members one at a
+    # time; the trigger applies each change as a delta. Bulk inserts recount the session instead.
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_review_stats_update
+        AFTER UPDATE OF reviewed, action, size ON group_members
+        WHEN NEW.role = 'backup'
+        BEGIN
+            UPDATE review_stats SET
+                reviewed = reviewed + (NEW.reviewed IS 1) - (OLD.reviewed IS 1),
+                deleted = deleted + (NEW.action IS 'deleted') - (OLD.action IS 'deleted'),
+                ignored = ignored + (NEW.action IS 'ignored') - (OLD.action IS 'ignored'),
+                reclaimable_bytes = reclaimable_bytes
+                    + CASE WHEN NEW.reviewed IS 1 THEN 0 ELSE IFNULL(NEW.size, 0) END
+                    - CASE WHEN OLD.reviewed IS 1 THEN 0 ELSE IFNULL(OLD.size, 0) END,
+                reclaimed_bytes = reclaimed_bytes
+                    + CASE WHEN NEW.action IS 'deleted' THEN IFNULL(NEW.size, 0) ELSE 0 END
+                    - CASE WHEN OLD.action IS 'deleted' THEN IFNULL(OLD.size, 0) ELSE 0 END
+            WHERE scan_session_id = NEW.scan_session_id;
+        END
+    """)
+    cursor.execute("""
+        INSERT OR REPLACE INTO review_stats
+        SELECT scan_session_id, COUNT(*), SUM(reviewed IS 1), SUM(action IS 'deleted'), SUM(action IS 'ignored'),
+               SUM(CASE WHEN reviewed IS 1 THEN 0 ELSE IFNULL(size, 0) END),
+               SUM(CASE WHEN action IS 'deleted' THEN IFNULL(size, 0) ELSE 0 END)
+        FROM group_members
+        WHERE role = 'backup'
+        GROUP BY scan_session_id
+    """)
+
+def _migration_5_thumbnail_cache(cursor: sqlite3.Cursor):
+    """One row per cached thumbnail file, for the size budget and LRU eviction."""
+    # The old table was keyed by source path and never written to
+    cursor.execute("DROP TABLE IF EXISTS cache_metadata")
+    cursor.execute("""
+        CREATE TABLE cache_metadata (
+            hash_key TEXT PRIMARY KEY,
+            path TEXT,
+            mtime REAL,
+            size INTEGER,
+            bytes INTEGER NOT NULL,
+            cached_at TEXT NOT NULL,
+            last_access REAL NOT NULL
+        )
+    """)
+    cursor.execute("CREATE INDEX idx_cache_metadata_access ON cache_metadata(last_access)")
+    cursor.execute("CREATE INDEX idx_cache_metadata_path ON cache_metadata(path)")
+
+def _migration_6_content_addressed_thumbnails(cursor: sqlite3.Cursor):
+    """Thumbnails keyed by content hash are shared by every file with that content."""
+    _add_missing_columns(cursor, "cache_metadata", {"content_hash": "TEXT"})
+
+def _migration_7_thumbnail_variants(cursor: sqlite3.Cursor):
+    """cache_metadata rows are per rendition file now, keyed by file name."""
+    cursor.execute("UPDATE cache_metadata SET hash_key = hash_key || '.jpg'")
+
+# (version, migration) in order. Each runs once, in its own transaction, and the database's
+# user_version records the last one applied. Append new migrations; never edit applied ones.
+MIGRATIONS: List[Tuple[int, Callable[[sqlite3.Cursor], None]]] = [
+    (1, _migration_1_baseline),
+    (2, _migration_2_indexes),
+    (3, _migration_3_pagination),
+    (4, _migration_4_review_stats),
+    (5, _migration_5_thumbnail_cache),
+    (6, _migration_6_content_addressed_thumbnails),
+    (7, _migration_7_thumbnail_variants),
+]
+
+def init_db():
+    os.makedirs(Config.LOCAL_STATE_DIR, exist_ok=True)
+    
+    conn = connect(isolation_level=None)
+    try:
+        # Readers (API requests) don't block the scan writer and vice versa; persists in the file
+        conn.execute("PRAGMA journal_mode=WAL")
+        
+        current = conn.execute("PRAGMA user_version").fetchone()[0]
+        for version, migration in MIGRATIONS:
+            if version <= current:
+                continue
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                migration(conn.cursor())
+                conn.execute(f"PRAGMA user_version = {version}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            logger.info(f"Applied database migration {version}: {migration.__name__}")
+    finally:
+        conn.close()
+    
+    return get_db_path()
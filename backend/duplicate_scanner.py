@@ -1,11 +1,16 @@
 import os
 import sqlite3
+import threading
+import time
 import uuid
-from typing import List, Dict, Optional, Set
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from typing import Iterator, List, Dict, Optional, Set, Tuple
 from datetime import datetime
-from backend.ssh_client import SSHClient
-from backend.config import Config
+from backend.ssh_client import SSHClient, is_valid_utf8
+from backend.db import connect, get_connection
 from backend.path_utils import is_subpath
+from backend.scan_progress import ScanProgress, ScanCancelled
 import logging
 
 logger = logging.getLogger(__name__)
@@ -13,53 +18,67 @@ logger = logging.getLogger(__name__)
 # Common image file extensions
 IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.tif', '.webp', '.heic', '.heif', '.raw', '.cr2', '.nef', '.orf', '.sr2'}
 
+# How many walked files to accumulate before reporting progress / checking for cancellation
+PROGRESS_REPORT_INTERVAL = 1000
+
+# Member roles within a duplicate group
+ROLE_BACKUP = 'backup'
+ROLE_SORTED = 'sorted'
+
+MATCH_TYPE_FILENAME = 'filename'
+
+# Content verification outcomes, recorded on backup members and derived per pair
+MATCH_IDENTICAL = 'identical'
+MATCH_SAME_SIZE = 'same_size_different_content'
+MATCH_DIFFERENT = 'different'
+MATCH_UNVERIFIED = 'unverified'
+
+# Group member rows buffered before each executemany when saving a scan
+INGEST_BATCH_SIZE = 50000
+
+# Bound on paths buffered between concurrent walkers and the merging thread
+WALK_QUEUE_SIZE = 10000
+
+# Pairs per page when listing duplicates; also the batch size when streaming them
+DUPLICATES_PAGE_SIZE = 500
+MAX_DUPLICATES_PAGE_SIZE = 5000
+
 def is_image_file(filename: str) -> bool:
     """Check if a file has an image extension."""
     ext = os.path.splitext(filename.lower())[1]
     return ext in IMAGE_EXTENSIONS
 
-def scan_folder_for_images(folder_path: str, exclude_path: Optional[str] = None) -> Dict[str, List[str]]:
+def iter_image_files(folder_path: str, exclude_path: Optional[str] = None, progress: Optional[ScanProgress] = None) -> Iterator[str]:
     """
-    Scan a folder recursively for image files via SSH.
-    Returns a dictionary mapping filename -> list of full paths with that filename.
+    Walk a folder recursively via SSH and yield image file paths as `find` reports them.
+    Output is streamed null-delimited over the SSH channel, so paths are classified while
+    the remote walk is still running and nothing is buffered in full.
     
     Args:
         folder_path: Path to scan
-        exclude_path: Optional path to exclude (if folder_path is a subfolder of exclude_path)
+        exclude_path: Optional path whose files should be skipped
+        progress: Optional progress tracker to report into; also checked for cancellation
     """
-    if not SSHClient.is_connected():
-        logger.error("SSH not connected. Cannot scan folder.")
-        return {}
-    
-    # Build find command with exclusion if needed
-    if exclude_path and is_subpath(folder_path, exclude_path):
-        # If folder_path is a subfolder of exclude_path, we shouldn't scan it
-        logger.warning(f"Skipping scan of {folder_path} as it is a subfolder of {exclude_path}")
-        return {}
-    
-    # Use find command to recursively list all files, then filter for images
+    # Use find command to recursively list all files, null-delimited so any filename is safe
     # Exclude Synology system folders (starting with @) and handle subpath exclusion
     # -path "*/@*" -prune excludes any directory starting with @
-    command = f'find "{folder_path}" -path "*/@*" -prune -o -type f -print 2>/dev/null'
-    
-    success, output, error = SSHClient.run_command(command)
-    
-    if not success:
-        logger.error(f"Failed to scan folder {folder_path}: {error}")
-        return {}
+    command = f'find "{folder_path}" -path "*/@*" -prune -o -type f -print0 2>/dev/null'
     
-    # Group files by filename (case-insensitive)
-    files_by_name: Dict[str, List[str]] = {}
-    skipped_count = 0
     total_files = 0
+    skipped_count = 0
+    image_count = 0
+    reported_files = 0
+    reported_images = 0
+    started = time.monotonic()
     
-    for line in output.strip().split('\n'):
-        if not line.strip():
-            continue
-        
-        file_path = line.strip()
+    for file_path in SSHClient.stream_command(command, delimiter=b'\0'):
         total_files += 1
         
+        if progress and total_files - reported_files >= PROGRESS_REPORT_INTERVAL:
+            progress.add_files(total_files - reported_files, image_count - reported_images)
+            reported_files, reported_images = total_files, image_count
+            progress.check_cancelled()
+        
         # Additional check: skip if path contains /@
         if '/@' in file_path:
             skipped_count += 1
@@ -72,24 +91,153 @@ def scan_folder_for_images(folder_path: str, exclude_path: Optional[str] = None)
             logger.debug(f"Skipping excluded path file: {file_path}")
             continue
         
-        filename = os.path.basename(file_path)
+        if not is_valid_utf8(file_path):
+            skipped_count += 1
+            logger.warning(f"Skipping file whose name isn't UTF-8: {file_path!r}")
+            continue
         
-        if is_image_file(filename):
+        if is_image_file(os.path.basename(file_path)):
+            image_count += 1
+            yield file_path
+    
+    elapsed = time.monotonic() - started
+    if progress:
+        progress.add_files(total_files - reported_files, image_count - reported_images)
+        progress.record_root(folder_path, elapsed, total_files, image_count)
+    
+    logger.info(f"Walked {folder_path} in {elapsed:.1f}s: {image_count} images ({total_files} total files, {skipped_count} skipped)")
+
+def scan_folder_for_images(folder_path: str, exclude_path: Optional[str] = None, progress: Optional[ScanProgress] = None) -> Dict[str, List[str]]:
+    """
+    Scan a folder recursively for image files via SSH.
+    Returns a dictionary mapping filename -> list of full paths with that filename.
+    
+    Args:
+        folder_path: Path to scan
+        exclude_path: Optional path to exclude (if folder_path is a subfolder of exclude_path)
+        progress: Optional progress tracker; a cancelled scan raises ScanCancelled
+    """
+    if not SSHClient.is_connected():
+        logger.error("SSH not connected. Cannot scan folder.")
+        return {}
+    
+    # Build find command with exclusion if needed
+    if exclude_path and is_subpath(folder_path, exclude_path):
+        # If folder_path is a subfolder of exclude_path, we shouldn't scan it
+        logger.warning(f"Skipping scan of {folder_path} as it is a subfolder of {exclude_path}")
+        return {}
+    
+    # Group files by filename (case-insensitive) while the walk is still streaming
+    files_by_name: Dict[str, List[str]] = {}
+    
+    image_files = iter_image_files(folder_path, exclude_path, progress)
+    try:
+        for file_path in image_files:
             # Use lowercase filename as key for case-insensitive matching
-            key = filename.lower()
+            key = os.path.basename(file_path).lower()
             if key not in files_by_name:
                 files_by_name[key] = []
             files_by_name[key].append(file_path)
+    except ScanCancelled:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to scan folder {folder_path}: {e}")
+        return {}
+    finally:
+        # Closes the SSH channel straight away if we stopped early
+        image_files.close()
     
-    logger.info(f"Scanned {folder_path}: found {len(files_by_name)} unique image filenames ({total_files} total files, {skipped_count} skipped)")
+    logger.info(f"Scanned {folder_path}: found {len(files_by_name)} unique image filenames")
     return files_by_name
 
-def find_duplicates(backup_path: str, sorted_path: str) -> List[Dict]:
+def scan_roots_concurrently(roots: List[Tuple[str, Optional[str]]], progress: Optional[ScanProgress] = None) -> List[Dict[str, List[str]]]:
+    """
+    Walk several folders at the same time, each over its own SSH channel on the shared transport.
+    Paths from all walks are merged into per-root filename groups as they stream in.
+    Returns one filename -> paths dictionary per root, in the order the roots were given.
+    If a walk fails, the others are stopped and its error is raised, so a scan never reports
+    success on a partial walk.
+    
+    Args:
+        roots: List of (folder_path, exclude_path) tuples
+        progress: Optional progress tracker; a cancelled scan raises ScanCancelled
+    """
+    results: List[Dict[str, List[str]]] = [{} for _ in roots]
+    
+    if not SSHClient.is_connected():
+        logger.error("SSH not connected. Cannot scan folders.")
+        return results
+    
+    queue: Queue = Queue(maxsize=WALK_QUEUE_SIZE)
+    stop = threading.Event()
+    
+    def walk(index: int, folder_path: str, exclude_path: Optional[str]):
+        error = None
+        image_files = iter_image_files(folder_path, exclude_path, progress)
+        try:
+            for file_path in image_files:
+                if stop.is_set():
+                    break
+                queue.put(('path', index, file_path))
+        except Exception as e:
+            error = e
+        finally:
+            # Closes the SSH channel straight away if we stopped early
+            image_files.close()
+            queue.put(('done', index, error))
+    
+    walk_roots = []
+    for index, (folder_path, exclude_path) in enumerate(roots):
+        if exclude_path and is_subpath(folder_path, exclude_path):
+            logger.warning(f"Skipping scan of {folder_path} as it is a subfolder of {exclude_path}")
+            continue
+        walk_roots.append((index, folder_path, exclude_path))
+    
+    cancelled = None
+    failure = None
+    
+    with ThreadPoolExecutor(max_workers=max(len(walk_roots), 1), thread_name_prefix='scan-walk') as executor:
+        for index, folder_path, exclude_path in walk_roots:
+            executor.submit(walk, index, folder_path, exclude_path)
+        
+        # Merge results as they arrive until every walker has reported done
+        remaining = len(walk_roots)
+        while remaining:
+            kind, index, payload = queue.get()
+            if kind == 'done':
+                remaining -= 1
+                if isinstance(payload, ScanCancelled):
+                    cancelled = payload
+                    stop.set()
+                elif payload is not None:
+                    logger.error(f"Failed to scan folder {roots[index][0]}: {payload}")
+                    failure = failure or payload
+                    stop.set()
+                continue
+            
+            # Use lowercase filename as key for case-insensitive matching
+            key = os.path.basename(payload).lower()
+            files_by_name = results[index]
+            if key not in files_by_name:
+                files_by_name[key] = []
+            files_by_name[key].append(payload)
+    
+    if cancelled:
+        raise cancelled
+    if failure:
+        raise failure
+    
+    return results
+
+def find_duplicates(backup_path: str, sorted_path: str, progress: Optional[ScanProgress] = None) -> List[Dict]:
     """
     Find duplicate image files between backup and sorted folders.
-    Returns a list of duplicate pairs.
+    Returns one group per filename found in both folders, holding every backup and
+    sorted path with that name, rather than every backup x sorted combination.
     
     If backup_path is a subfolder of sorted_path, it will be excluded from sorted scan.
+    If a progress tracker is given, phases and counters are reported into it and
+    ScanCancelled is raised as soon as cancellation is requested.
     """
     logger.info(f"Starting duplicate scan: backup={backup_path}, sorted={sorted_path}")
     
@@ -99,147 +247,273 @@ def find_duplicates(backup_path: str, sorted_path: str) -> List[Dict]:
         logger.info(f"Backup path is a subfolder of sorted path. Excluding backup from sorted scan.")
         exclude_from_sorted = backup_path
     
-    # Scan both folders
-    backup_files = scan_folder_for_images(backup_path)
-    sorted_files = scan_folder_for_images(sorted_path, exclude_path=exclude_from_sorted)
+    # Scan both folders at once; they usually live on different volumes
+    if progress:
+        progress.set_phase('walking')
+    backup_files, sorted_files = scan_roots_concurrently(
+        [(backup_path, None), (sorted_path, exclude_from_sorted)],
+        progress=progress
+    )
+    
+    if progress:
+        progress.check_cancelled()
+        progress.set_phase('matching')
     
     # Find filenames that exist in both folders
-    duplicate_pairs = []
+    groups = []
+    pair_count = 0
     
     for filename_lower, backup_paths in backup_files.items():
         if filename_lower in sorted_files:
             sorted_paths = sorted_files[filename_lower]
-            
-            # For each backup file with this name, pair it with sorted files
-            # Typically we'll have one backup and one sorted, but handle multiple
-            for backup_file in backup_paths:
-                for sorted_file in sorted_paths:
-                    duplicate_pairs.append({
-                        'backup_path': backup_file,
-                        'sorted_path': sorted_file,
-                        'filename': os.path.basename(backup_file)
-                    })
+            groups.append({
+                'group_key': filename_lower,
+                'backup_paths': backup_paths,
+                'sorted_paths': sorted_paths
+            })
+            pair_count += len(backup_paths) * len(sorted_paths)
     
-    logger.info(f"Found {len(duplicate_pairs)} duplicate pairs")
-    return duplicate_pairs
+    if progress:
+        progress.set_pairs_found(pair_count)
+    
+    logger.info(f"Found {len(groups)} duplicate groups ({pair_count} pairs)")
+    return groups
+
+def apply_ignored_pairs(conn: sqlite3.Connection, scan_session_id: str) -> int:
+    """
+    Mark unreviewed backup members of a session as ignored when every pair they form
+    is in ignored_pairs. A member that gained a new partner since it was ignored stays
+    up for review. Returns the number of members marked.
+    """
+    # Nothing to match against; skips a pass over every member of the session
+    if not conn.execute("SELECT EXISTS (SELECT 1 FROM ignored_pairs)").fetchone()[0]:
+        return 0
+    return conn.execute("""
+        UPDATE group_members
+        SET reviewed = 1, action = 'ignored'
+        WHERE scan_session_id = ? AND role = ? AND action IS NULL
+          AND NOT EXISTS (
+              SELECT 1 FROM group_members s
+              WHERE s.group_id = group_members.group_id AND s.role = ?
+                AND NOT EXISTS (
+                    SELECT 1 FROM ignored_pairs ip
+                    WHERE ip.backup_path = group_members.path AND ip.sorted_path = s.path
+                )
+          )
+    """, (scan_session_id, ROLE_BACKUP, ROLE_SORTED)).rowcount
+
+def count_pairs(conn: sqlite3.Connection, scan_session_id: str) -> int:
+    """Number of backup x sorted pairs a session's groups expand to, excluding ignored members."""
+    return conn.execute("""
+        SELECT COALESCE(SUM(s.members), 0)
+        FROM group_members b
+        JOIN (
+            SELECT group_id, COUNT(*) AS members FROM group_members
+            WHERE scan_session_id = ? AND role = ?
+            GROUP BY group_id
+        ) s ON s.group_id = b.group_id
+        WHERE b.scan_session_id = ? AND b.role = ? AND (b.action IS NULL OR b.action != 'ignored')
+    """, (scan_session_id, ROLE_SORTED, scan_session_id, ROLE_BACKUP)).fetchone()[0]
+
+def _write_group_batch(cursor: sqlite3.Cursor, group_rows: List[tuple], member_rows: List[tuple]) -> int:
+    """Insert buffered group and member rows and clear the buffers. Returns rows written."""
+    cursor.executemany("""
+        INSERT INTO duplicate_groups (id, scan_session_id, group_key, match_type, created_at)
+        VALUES (?, ?, ?, ?, ?)
+    """, group_rows)
+    cursor.executemany("""
+        INSERT INTO group_members (group_id, scan_session_id, role, path)
+        VALUES (?, ?, ?, ?)
+    """, member_rows)
+    written = len(group_rows) + len(member_rows)
+    group_rows.clear()
+    member_rows.clear()
+    return written
+
+# Review counters of backup members per session, as stored in review_stats. Sizes are known
+# once a member has been verified or content-matched; members without one count as 0 bytes.
+REVIEW_STATS_SQL = f"""
+    SELECT scan_session_id, COUNT(*), SUM(reviewed IS 1), SUM(action IS 'deleted'), SUM(action IS 'ignored'),
+           SUM(CASE WHEN reviewed IS 1 THEN 0 ELSE IFNULL(size, 0) END),
+           SUM(CASE WHEN action IS 'deleted' THEN IFNULL(size, 0) ELSE 0 END)
+    FROM group_members
+    WHERE role = '{ROLE_BACKUP}'
+"""
+
+def refresh_session_counts(conn: sqlite3.Connection, scan_session_id: str) -> int:
+    """
+    Recount a session's pairs and review counters after members were written in bulk.
+    From then on the review_stats trigger keeps the counters current as members change.
+    Returns the pair count.
+    """
+    pair_count = count_pairs(conn, scan_session_id)
+    conn.execute("UPDATE scan_sessions SET pair_count = ? WHERE id = ?", (pair_count, scan_session_id))
+    conn.execute("DELETE FROM review_stats WHERE scan_session_id = ?", (scan_session_id,))
+    conn.execute(f"""
+        INSERT INTO review_stats
+        {REVIEW_STATS_SQL} AND scan_session_id = ?
+        GROUP BY scan_session_id
+    """, (scan_session_id,))
+    return pair_count
 
-def save_duplicates_to_db(duplicate_pairs: List[Dict], backup_path: str = '', sorted_path: str = '', scan_session_id: Optional[str] = None) -> str:
+def save_duplicates_to_db(groups: List[Dict], backup_path: str = '', sorted_path: str = '', scan_session_id: Optional[str] = None) -> Tuple[str, Dict]:
     """
-    Save duplicate pairs to the database.
-    Checks against ignored_pairs table and automatically marks previously ignored pairs.
-    Returns the scan_session_id.
+    Save duplicate groups and their members to the database in bulk.
+    Group ids are allocated up front so groups and members are written with batched
+    executemany calls in a single transaction. Backup members whose pairs were all ignored
+    before are then marked ignored with one indexed join against ignored_pairs.
+    Returns (scan_session_id, ingest_stats), or ("", {}) on failure.
     """
-    db_path = os.path.join(Config.LOCAL_STATE_DIR, "state.db")
-    conn = sqlite3.connect(db_path)
+    conn = connect(isolation_level=None)
     cursor = conn.cursor()
+    # A bigger page cache keeps index pages resident while millions of members go in
+    cursor.execute("PRAGMA cache_size = -65536")
     
     try:
-        # Get all previously ignored pairs
-        cursor.execute("""
-            SELECT backup_path, sorted_path FROM ignored_pairs
-        """)
-        ignored_set = set((row[0], row[1]) for row in cursor.fetchall())
-        logger.info(f"Found {len(ignored_set)} previously ignored pairs")
+        started = time.monotonic()
+        cursor.execute("BEGIN IMMEDIATE")
         
         # Create a new scan session
         if not scan_session_id:
             scan_session_id = str(uuid.uuid4())
         timestamp = datetime.now().isoformat()
         
-        # Count pairs that are NOT already ignored
-        new_pair_count = sum(1 for pair in duplicate_pairs 
-                            if (pair['backup_path'], pair['sorted_path']) not in ignored_set)
-        
-        # Extract root paths from params or first pair
+        # Extract root paths from params or first group
         backup_root = backup_path
         sorted_root = sorted_path
-        if not backup_root and duplicate_pairs:
-            backup_root = os.path.dirname(duplicate_pairs[0]['backup_path'])
-        if not sorted_root and duplicate_pairs:
-            sorted_root = os.path.dirname(duplicate_pairs[0]['sorted_path'])
+        if not backup_root and groups:
+            backup_root = os.path.dirname(groups[0]['backup_paths'][0])
+        if not sorted_root and groups:
+            sorted_root = os.path.dirname(groups[0]['sorted_paths'][0])
         
         cursor.execute("""
             INSERT INTO scan_sessions (id, backup_path, sorted_path, created_at, pair_count)
-            VALUES (?, ?, ?, ?, ?)
-        """, (scan_session_id, backup_root, sorted_root, timestamp, new_pair_count))
+            VALUES (?, ?, ?, ?, 0)
+        """, (scan_session_id, backup_root, sorted_root, timestamp))
         
-        # Insert all duplicate pairs into review_queue
-        # Mark as ignored if they were previously ignored
-        for pair in duplicate_pairs:
-            is_ignored = (pair['backup_path'], pair['sorted_path']) in ignored_set
-            
-            # Generate group_id if not present (use filename as group identifier)
-            group_id = pair.get('group_id', pair.get('filename', str(uuid.uuid4())))
+        # The write lock is held from here on, so these ids can't be taken by anyone else
+        next_group_id = cursor.execute("SELECT COALESCE(MAX(id), 0) FROM duplicate_groups").fetchone()[0] + 1
+        group_rows: List[tuple] = []
+        member_rows: List[tuple] = []
+        rows_written = 0
+        
+        for group in groups:
+            group_id = next_group_id
+            next_group_id += 1
+            group_rows.append((group_id, scan_session_id, group['group_key'], group.get('match_type', MATCH_TYPE_FILENAME), timestamp))
+            member_rows.extend((group_id, scan_session_id, ROLE_BACKUP, path) for path in group['backup_paths'])
+            member_rows.extend((group_id, scan_session_id, ROLE_SORTED, path) for path in group['sorted_paths'])
             
-            cursor.execute("""
-                INSERT INTO review_queue (
-                    group_id, backup_path, kept_path, reviewed, action, scan_session_id, created_at
-                )
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (
-                group_id,
-                pair['backup_path'],
-                pair['sorted_path'],
-                1 if is_ignored else 0,  # Mark as reviewed if ignored
-                'ignored' if is_ignored else None,  # Set action to 'ignored'
-                scan_session_id,
-                timestamp
-            ))
+            if len(member_rows) >= INGEST_BATCH_SIZE:
+                rows_written += _write_group_batch(cursor, group_rows, member_rows)
+        rows_written += _write_group_batch(cursor, group_rows, member_rows)
         
-        conn.commit()
-        logger.info(f"Saved {len(duplicate_pairs)} duplicate pairs to database for session {scan_session_id}")
-        logger.info(f"{new_pair_count} new pairs, {len(duplicate_pairs) - new_pair_count} previously ignored")
-        return scan_session_id
+        ignored = apply_ignored_pairs(conn, scan_session_id)
+        pair_count = refresh_session_counts(conn, scan_session_id)
+        
+        cursor.execute("COMMIT")
+        seconds = time.monotonic() - started
+        ingest = {
+            'rows': rows_written,
+            'seconds': round(seconds, 3),
+            'rows_per_second': round(rows_written / seconds) if seconds > 0 else rows_written
+        }
+        logger.info(f"Saved {len(groups)} duplicate groups to database for session {scan_session_id} "
+                    f"({rows_written} rows in {seconds:.2f}s, {ingest['rows_per_second']} rows/s)")
+        logger.info(f"{pair_count} pairs to review, {ignored} backup files previously ignored")
+        return scan_session_id, ingest
         
     except Exception as e:
         logger.error(f"Error saving duplicates to database: {e}")
-        conn.rollback()
-        return ""
+        if conn.in_transaction:
+            conn.rollback()
+        return "", {}
     finally:
         conn.close()
 
-def get_duplicates_from_db(scan_session_id: Optional[str] = None, limit: Optional[int] = None, offset: int = 0, include_reviewed: bool = False) -> List[Dict]:
+# Status of a derived pair from what verification recorded on its two members
+_PAIR_STATUS_SQL = f"""
+    CASE
+        WHEN b.match_status IS NULL THEN NULL
+        WHEN b.size IS NULL OR s.size IS NULL THEN '{MATCH_UNVERIFIED}'
+        WHEN b.size != s.size THEN '{MATCH_DIFFERENT}'
+        WHEN b.content_hash IS NOT NULL AND s.content_hash IS NOT NULL THEN
+            CASE WHEN b.content_hash = s.content_hash THEN '{MATCH_IDENTICAL}' ELSE '{MATCH_SAME_SIZE}' END
+        WHEN b.sample_hash IS NOT NULL AND s.sample_hash IS NOT NULL AND b.sample_hash != s.sample_hash THEN '{MATCH_SAME_SIZE}'
+        ELSE '{MATCH_UNVERIFIED}'
+    END
+"""
+
+def parse_pair_cursor(cursor: Optional[str]) -> Tuple[int, int]:
     """
-    Retrieve duplicate pairs from the database.
+    Parse a pagination cursor of the form '<backup member id>:<sorted member id>'.
+    Raises ValueError for malformed cursors.
+    """
+    if not cursor:
+        return 0, 0
+    backup_id, _, sorted_id = cursor.partition(':')
+    return int(backup_id), int(sorted_id or 0)
+
+def _latest_session_id(cursor: sqlite3.Cursor) -> Optional[str]:
+    cursor.execute("""
+        SELECT id FROM scan_sessions 
+        ORDER BY created_at DESC 
+        LIMIT 1
+    """)
+    result = cursor.fetchone()
+    return result[0] if result else None
+
+def get_duplicates_from_db(scan_session_id: Optional[str] = None, limit: int = DUPLICATES_PAGE_SIZE,
+                           after: Optional[str] = None, include_reviewed: bool = False,
+                           action: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Retrieve one page of duplicate pairs from the database, expanding each group's backup
+    and sorted members into pairs as they are read. A pair's id is its backup member's id,
+    which is what review actions apply to.
+    Pages are keyed on (backup member id, sorted member id): pass the returned cursor as
+    `after` to get the next page. The cursor is None once the last page has been read.
     If scan_session_id is None, returns pairs from the most recent session.
-    By default, excludes reviewed/ignored/deleted pairs (include_reviewed=False).
+    By default, excludes reviewed/ignored/deleted members (include_reviewed=False);
+    with action, only members with that review action are returned.
+    Returns (pairs, next_cursor)
     """
-    db_path = os.path.join(Config.LOCAL_STATE_DIR, "state.db")
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    cursor = get_connection().cursor()
+    limit = max(1, min(limit, MAX_DUPLICATES_PAGE_SIZE))
+    after_backup, after_sorted = parse_pair_cursor(after)
     
     try:
         # If no session ID, get the most recent one
         if not scan_session_id:
-            cursor.execute("""
-                SELECT id FROM scan_sessions 
-                ORDER BY created_at DESC 
-                LIMIT 1
-            """)
-            result = cursor.fetchone()
-            if result:
-                scan_session_id = result[0]
-            else:
-                return []
-        
-        # Get pairs for this session
-        # By default, exclude reviewed items (ignored or deleted)
-        query = """
-            SELECT id, backup_path, kept_path, reviewed, action
-            FROM review_queue
-            WHERE scan_session_id = ?
-        """
+            scan_session_id = _latest_session_id(cursor)
+            if not scan_session_id:
+                return [], None
         
+        filters = ""
+        params: List = [scan_session_id, ROLE_BACKUP, after_backup]
         if not include_reviewed:
-            # Exclude pairs that have been reviewed (ignored or deleted)
-            query += " AND (reviewed = 0 OR reviewed IS NULL)"
-        
-        query += " ORDER BY id"
+            # Exclude members that have been reviewed (ignored or deleted)
+            filters += " AND reviewed = 0"
+        if action:
+            filters += " AND action = ?"
+            params.append(action)
         
-        if limit:
-            query += f" LIMIT {limit} OFFSET {offset}"
-        
-        cursor.execute(query, (scan_session_id,))
+        # Every backup member has at least one sorted partner, so the cursor's own member
+        # plus `limit` more always cover a full page of pairs
+        cursor.execute(f"""
+            SELECT b.id, b.path, s.id, s.path, b.reviewed, b.action, {_PAIR_STATUS_SQL},
+                   g.match_type, s.match_distance, g.id
+            FROM (
+                SELECT * FROM group_members
+                WHERE scan_session_id = ? AND role = ? AND id >= ?{filters}
+                ORDER BY id
+                LIMIT ?
+            ) b
+            JOIN duplicate_groups g ON g.id = b.group_id
+            JOIN group_members s ON s.group_id = b.group_id AND s.role = ?
+            WHERE b.id > ? OR s.id > ?
+            ORDER BY b.id, s.id
+            LIMIT ?
+        """, (*params, limit + 1, ROLE_SORTED, after_backup, after_sorted, limit))
         rows = cursor.fetchall()
         
         pairs = []
@@ -247,24 +521,44 @@ def get_duplicates_from_db(scan_session_id: Optional[str] = None, limit: Optiona
             pairs.append({
                 'id': row[0],
                 'backup_path': row[1],
-                'sorted_path': row[2],
-                'reviewed': bool(row[3]),
-                'action': row[4]
+                'sorted_path': row[3],
+                'reviewed': bool(row[4]),
+                'action': row[5],
+                'match_status': row[6],
+                'match_type': row[7],
+                'match_distance': row[8],
+                'group_id': row[9]
             })
         
-        return pairs
+        next_cursor = f"{rows[-1][0]}:{rows[-1][2]}" if len(rows) == limit else None
+        return pairs, next_cursor
         
     except Exception as e:
         logger.error(f"Error retrieving duplicates from database: {e}")
-        return []
-    finally:
-        conn.close()
+        return [], None
+
+def iter_duplicate_pages(scan_session_id: Optional[str] = None, include_reviewed: bool = False,
+                         action: Optional[str] = None, page_size: int = DUPLICATES_PAGE_SIZE) -> Iterator[List[Dict]]:
+    """
+    Yield every duplicate pair of a session a keyset page at a time, so memory stays
+    bounded by the page size however large the session is.
+    """
+    if not scan_session_id:
+        scan_session_id = _latest_session_id(get_connection().cursor())
+        if not scan_session_id:
+            return
+    
+    after = None
+    while True:
+        pairs, after = get_duplicates_from_db(scan_session_id, page_size, after, include_reviewed, action)
+        if pairs:
+            yield pairs
+        if not after:
+            return
 
 def get_scan_sessions() -> List[Dict]:
     """Get all scan sessions from the database."""
-    db_path = os.path.join(Config.LOCAL_STATE_DIR, "state.db")
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    cursor = get_connection().cursor()
     
     try:
         cursor.execute("""
@@ -289,6 +583,4 @@ def get_scan_sessions() -> List[Dict]:
     except Exception as e:
         logger.error(f"Error retrieving scan sessions: {e}")
         return []
-    finally:
-        conn.close()
 
@@ -0,0 +1,241 @@
+import io
+import os
+import struct
+import threading
+import logging
+from typing import Dict, List, Optional, Tuple
+from PIL import Image
+from backend.original_service import open_original, read_range
+
+logger = logging.getLogger(__name__)
+
+# RAW formats that are TIFF containers with a ready-made JPEG preview. ffmpeg on the NAS
+# decodes these slowly or not at all, so their previews are always preferred.
+RAW_PREVIEW_EXTENSIONS = {'.cr2', '.nef', '.orf', '.sr2', '.raw', '.rw2', '.arw', '.dng', '.pef'}
+
+# Regular JPEGs whose EXIF thumbnail is used when it is large enough for what is asked.
+# EXIF thumbnails are usually 160x120, so they are only tried for renditions up to this size.
+EXIF_THUMBNAIL_EXTENSIONS = {'.jpg', '.jpeg'}
+EXIF_THUMBNAIL_MAX_SIDE = 160
+
+# Read in one go at the start of the file; IFDs and EXIF headers nearly always lie within it
+HEADER_READ_BYTES = 64 * 1024
+
+# Embedded JPEGs larger than this aren't worth fetching; ffmpeg is used instead
+PREVIEW_MAX_BYTES = 8 * 1024 * 1024
+
+# Bounds for walking a possibly corrupt IFD structure
+MAX_IFDS = 32
+MAX_IFD_ENTRIES = 1000
+
+_TIFF_MAGICS = {
+    42,      # TIFF, CR2, NEF, SR2, ARW, DNG, PEF
+    0x4F52,  # Olympus ORF ("RO")
+    0x5352,  # Olympus ORF ("RS")
+    0x55,    # Panasonic RAW/RW2
+}
+_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4}
+
+_TAG_COMPRESSION = 0x103
+_TAG_STRIP_OFFSETS = 0x111
+_TAG_ORIENTATION = 0x112
+_TAG_STRIP_BYTE_COUNTS = 0x117
+_TAG_SUB_IFDS = 0x14A
+_TAG_JPEG_OFFSET = 0x201
+_TAG_JPEG_LENGTH = 0x202
+_TAG_PANASONIC_JPEG = 0x2E
+
+# Orientation tag value -> transpose that makes the image upright
+_ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+_stats = {'extracted': 0, 'fallbacks': 0, 'bytes_read': 0, 'source_bytes': 0}
+_stats_lock = threading.Lock()
+
+def _record(extracted: bool, bytes_read: int, source_bytes: int):
+    with _stats_lock:
+        _stats['extracted' if extracted else 'fallbacks'] += 1
+        _stats['bytes_read'] += bytes_read
+        _stats['source_bytes'] += source_bytes
+
+def get_preview_stats() -> Dict:
+    """Files thumbnailed from embedded previews, and bytes read for them against their full size."""
+    with _stats_lock:
+        return dict(_stats)
+
+def _extension(remote_path: str) -> str:
+    return os.path.splitext(remote_path)[1].lower()
+
+def wants_embedded_preview(remote_path: str, largest_side: int) -> bool:
+    """Whether to try a file's embedded JPEG before ffmpeg for renditions up to largest_side."""
+    extension = _extension(remote_path)
+    if extension in RAW_PREVIEW_EXTENSIONS:
+        return True
+    return extension in EXIF_THUMBNAIL_EXTENSIONS and largest_side <= EXIF_THUMBNAIL_MAX_SIDE
+
+class _RemoteReader:
+    """Random access to a remote file, serving reads within the header block from memory."""
+
+    def __init__(self, remote_file, size: int):
+        self.remote_file = remote_file
+        self.size = size
+        self.header = read_range(remote_file, 0, min(HEADER_READ_BYTES, size))
+        self.bytes_read = len(self.header)
+
+    def read(self, offset: int, length: int) -> bytes:
+        length = max(0, min(length, self.size - offset))
+        if offset + length <= len(self.header):
+            return self.header[offset:offset + length]
+        data = read_range(self.remote_file, offset, length)
+        self.bytes_read += len(data)
+        return data
+
+def _tiff_jpegs(reader: _RemoteReader, base: int) -> Tuple[List[Tuple[int, int]], Optional[int]]:
+    """
+    (offset, length) of every JPEG referenced from the IFDs of a TIFF structure starting at
+    `base`, and the orientation of the first IFD. Walks the IFD chain and SubIFDs.
+    """
+    header = reader.read(base, 8)
+    if len(header) < 8 or header[:2] not in (b'II', b'MM'):
+        return [], None
+    order = '<' if header[:2] == b'II' else '>'
+    magic, first_ifd = struct.unpack(order + 'HI', header[2:8])
+    if magic not in _TIFF_MAGICS:
+        return [], None
+
+    jpegs: List[Tuple[int, int]] = []
+    orientation = None
+    pending = [first_ifd]
+    visited = set()
+    while pending and len(visited) < MAX_IFDS:
+        ifd = pending.pop(0)
+        if not ifd or ifd in visited:
+            continue
+        visited.add(ifd)
+        count_data = reader.read(base + ifd, 2)
+        if len(count_data) < 2:
+            continue
+        count = min(struct.unpack(order + 'H', count_data)[0], MAX_IFD_ENTRIES)
+        table = reader.read(base + ifd + 2, count * 12 + 4)
+        tags: Dict[int, Tuple[int, int, bytes]] = {}
+        for i in range(min(count, len(table) // 12)):
+            tag, value_type, value_count = struct.unpack(order + 'HHI', table[i * 12:i * 12 + 8])
+            tags[tag] = (value_type, value_count, table[i * 12 + 8:i * 12 + 12])
+        if len(table) >= count * 12 + 4:
+            pending.append(struct.unpack(order + 'I', table[count * 12:count * 12 + 4])[0])
+
+        def values(tag: int) -> List[int]:
+            value_type, value_count, raw = tags[tag]
+            size = _TYPE_SIZES.get(value_type, 1)
+            if value_type not in (3, 4, 13) or value_count > 64:
+                return []
+            data = raw if size * value_count <= 4 else reader.read(base + struct.unpack(order + 'I', raw)[0], size * value_count)
+            code = 'H' if value_type == 3 else 'I'
+            return list(struct.unpack(order + code * (len(data) // size), data[:len(data) // size * size]))[:value_count]
+
+        if orientation is None and _TAG_ORIENTATION in tags:
+            orientation = (values(_TAG_ORIENTATION) or [None])[0]
+        if _TAG_JPEG_OFFSET in tags and _TAG_JPEG_LENGTH in tags:
+            offsets, lengths = values(_TAG_JPEG_OFFSET), values(_TAG_JPEG_LENGTH)
+            if offsets and lengths:
+                jpegs.append((base + offsets[0], lengths[0]))
+        if _TAG_STRIP_OFFSETS in tags and _TAG_STRIP_BYTE_COUNTS in tags and _TAG_COMPRESSION in tags:
+            # A single JPEG-compressed strip is a complete JPEG (e.g. the full-size CR2/NEF preview)
+            offsets, lengths = values(_TAG_STRIP_OFFSETS), values(_TAG_STRIP_BYTE_COUNTS)
+            if values(_TAG_COMPRESSION)[:1] in ([6], [7]) and len(offsets) == len(lengths) == 1:
+                jpegs.append((base + offsets[0], lengths[0]))
+        if _TAG_PANASONIC_JPEG in tags:
+            value_type, value_count, raw = tags[_TAG_PANASONIC_JPEG]
+            jpegs.append((base + struct.unpack(order + 'I', raw)[0], value_count))
+        if _TAG_SUB_IFDS in tags:
+            pending.extend(values(_TAG_SUB_IFDS))
+    return jpegs, orientation
+
+def _exif_tiff_base(reader: _RemoteReader) -> Optional[int]:
+    """Offset of the TIFF structure inside a JPEG's APP1 EXIF segment."""
+    header = reader.header
+    if header[:2] != b'\xff\xd8':
+        return None
+    position = 2
+    while position + 4 <= len(header) and header[position] == 0xFF:
+        marker = header[position + 1]
+        length = struct.unpack('>H', header[position + 2:position + 4])[0]
+        if marker == 0xE1 and header[position + 4:position + 10] == b'Exif\x00\x00':
+            return position + 10
+        if marker == 0xDA:
+            break
+        position += 2 + length
+    return None
+
+def read_embedded_preview(remote_path: str) -> Tuple[Optional[Image.Image], int, int]:
+    """
+    Find the largest usable embedded JPEG of a RAW file, or the EXIF thumbnail of a JPEG,
+    reading only the header, the IFDs and the preview itself over SFTP.
+    Returns (decoded preview or None, bytes read, file size).
+    """
+    remote_file, size, _ = open_original(remote_path)
+    try:
+        reader = _RemoteReader(remote_file, size)
+        if _extension(remote_path) in EXIF_THUMBNAIL_EXTENSIONS:
+            base = _exif_tiff_base(reader)
+            jpegs, orientation = _tiff_jpegs(reader, base) if base is not None else ([], None)
+        else:
+            jpegs, orientation = _tiff_jpegs(reader, 0)
+        jpegs = [(offset, length) for offset, length in jpegs
+                 if 0 < length <= PREVIEW_MAX_BYTES and offset + length <= size]
+        for offset, length in sorted(jpegs, key=lambda jpeg: jpeg[1], reverse=True):
+            data = reader.read(offset, length)
+            if data[:2] != b'\xff\xd8':
+                continue
+            try:
+                image = Image.open(io.BytesIO(data))
+                image.load()
+            except Exception:
+                continue
+            transpose = _ORIENTATION_TRANSPOSE.get(orientation)
+            if transpose is not None:
+                image = image.transpose(transpose)
+            return image, reader.bytes_read, size
+        return None, reader.bytes_read, size
+    finally:
+        remote_file.close()
+
+def render_preview(image: Image.Image, sides: List[int], fmts: List[str]) -> List[bytes]:
+    """Encode a preview at each (longest side, format), never upscaling."""
+    rendered = []
+    rgb = image.convert('RGB')
+    for side, fmt in zip(sides, fmts):
+        resized = rgb.copy()
+        resized.thumbnail((side, side), Image.Resampling.LANCZOS)
+        output = io.BytesIO()
+        if fmt == 'webp':
+            resized.save(output, 'WEBP', quality=75)
+        else:
+            resized.save(output, 'JPEG', quality=85)
+        rendered.append(output.getvalue())
+    return rendered
+
+def extract_renditions(remote_path: str, sides: List[int], fmts: List[str]) -> Optional[List[bytes]]:
+    """
+    Thumbnails of one file at each (longest side, format), made locally from its embedded
+    preview. RAW previews are used whatever their size; a JPEG's EXIF thumbnail only if it
+    is at least as large as every side asked for. Returns None if ffmpeg is needed.
+    """
+    try:
+        image, bytes_read, size = read_embedded_preview(remote_path)
+    except Exception as e:
+        logger.debug(f"Could not read embedded preview of {remote_path}: {e}")
+        image, bytes_read, size = None, 0, 0
+    if image is not None and _extension(remote_path) in EXIF_THUMBNAIL_EXTENSIONS and max(image.size) < max(sides):
+        image = None
+    _record(image is not None, bytes_read, size)
+    if image is None:
+        return None
+    return render_preview(image, sides, fmts)
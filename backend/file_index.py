@@ -0,0 +1,418 @@
+import os
+import shlex
+import sqlite3
+import time
+import uuid
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+from backend.db import connect
+from backend.ssh_client import SSHClient, is_valid_utf8
+from backend.path_utils import is_subpath
+from backend.scan_progress import ScanProgress
+from backend.duplicate_scanner import (
+    is_image_file, PROGRESS_REPORT_INTERVAL, ROLE_BACKUP, ROLE_SORTED, MATCH_TYPE_FILENAME,
+    apply_ignored_pairs, refresh_session_counts
+)
+
+logger = logging.getLogger(__name__)
+
+# Rows buffered in Python before they are flushed into the staging tables
+INSERT_BATCH_SIZE = 5000
+
+# Directories listed per remote find command when only changed directories are re-read
+DIR_LIST_BATCH_SIZE = 200
+
+# find -printf format: type, size, mtime (epoch), inode, path
+_PRINTF_FORMAT = r"'%y %s %T@ %i %p\0'"
+
+def _connect_db() -> sqlite3.Connection:
+    # Concurrent root refreshes each write through their own connection. Autocommit keeps the
+    # long staging phase from holding locks; the apply step opens its own transaction.
+    return connect(isolation_level=None)
+
+def _parse_record(record: str) -> Optional[Tuple[str, int, float, int, str]]:
+    """Parse one `%y %s %T@ %i %p` record into (type, size, mtime, inode, path)."""
+    parts = record.split(' ', 4)
+    if len(parts) != 5:
+        return None
+    try:
+        return parts[0], int(parts[1]), float(parts[2]), int(parts[3]), parts[4]
+    except ValueError:
+        return None
+
+def _iter_entries(command: str, exclude_path: Optional[str], progress: Optional[ScanProgress], counts: Dict[str, int]) -> Iterator[Tuple[str, int, float, int, str]]:
+    """
+    Stream parsed find records for directories and image files, skipping Synology system
+    folders and the excluded subtree. Walked/matched file counts are added to `counts`.
+    """
+    reported_files = counts['files_walked']
+    reported_images = counts['images_matched']
+    for record in SSHClient.stream_command(command, delimiter=b'\0'):
+        entry = _parse_record(record)
+        if not entry:
+            logger.debug(f"Skipping unparseable find record: {record!r}")
+            continue
+        entry_type, _, _, _, path = entry
+
+        if '/@' in path or (exclude_path and is_subpath(path, exclude_path)):
+            continue
+        if not is_valid_utf8(path):
+            # The index stores paths as text; a file it can't name exactly is left out
+            logger.warning(f"Skipping path that isn't UTF-8: {path!r}")
+            continue
+
+        if entry_type == 'f':
+            counts['files_walked'] += 1
+            if progress and counts['files_walked'] - reported_files >= PROGRESS_REPORT_INTERVAL:
+                progress.add_files(counts['files_walked'] - reported_files, counts['images_matched'] - reported_images)
+                reported_files, reported_images = counts['files_walked'], counts['images_matched']
+                progress.check_cancelled()
+            if not is_image_file(os.path.basename(path)):
+                continue
+            counts['images_matched'] += 1
+        yield entry
+
+    if progress:
+        progress.add_files(counts['files_walked'] - reported_files, counts['images_matched'] - reported_images)
+        progress.check_cancelled()
+
+def _flush(conn: sqlite3.Connection, sql: str, rows: List[tuple]):
+    if rows:
+        conn.executemany(sql, rows)
+        rows.clear()
+
+_INSERT_WALK_DIR = "INSERT OR REPLACE INTO walk_dirs (path, mtime) VALUES (?, ?)"
+_INSERT_WALK_FILE = """
+    INSERT OR REPLACE INTO walk_files (path, dir, name, name_key, size, mtime, inode)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+def _file_row(size: int, mtime: float, inode: int, path: str) -> tuple:
+    name = os.path.basename(path)
+    return (path, os.path.dirname(path), name, name.lower(), size, mtime, inode)
+
+def _stage_full_walk(conn: sqlite3.Connection, root: str, exclude_path: Optional[str], progress: Optional[ScanProgress], counts: Dict[str, int]):
+    """Walk the whole tree in one find, staging every directory and image file."""
+    command = (f'find {shlex.quote(root)} -path "*/@*" -prune -o '
+               f'\\( -type d -o -type f \\) -printf {_PRINTF_FORMAT}')
+    dir_rows: List[tuple] = []
+    file_rows: List[tuple] = []
+    for entry_type, size, mtime, inode, path in _iter_entries(command, exclude_path, progress, counts):
+        if entry_type == 'd':
+            dir_rows.append((path, mtime))
+        elif entry_type == 'f':
+            file_rows.append(_file_row(size, mtime, inode, path))
+        if len(dir_rows) >= INSERT_BATCH_SIZE:
+            _flush(conn, _INSERT_WALK_DIR, dir_rows)
+        if len(file_rows) >= INSERT_BATCH_SIZE:
+            _flush(conn, _INSERT_WALK_FILE, file_rows)
+    _flush(conn, _INSERT_WALK_DIR, dir_rows)
+    _flush(conn, _INSERT_WALK_FILE, file_rows)
+
+    # Every directory's contents were listed
+    conn.execute("INSERT INTO listed_dirs (path) SELECT path FROM walk_dirs")
+
+def _stage_changed_dirs(conn: sqlite3.Connection, root: str, exclude_path: Optional[str], progress: Optional[ScanProgress], counts: Dict[str, int]):
+    """
+    Walk directories only, then list files just in directories that are new or whose mtime changed.
+    Adding, removing or renaming a file always bumps its directory's mtime, so unchanged
+    directories can be trusted to hold the files already in the index.
+    """
+    command = (f'find {shlex.quote(root)} -path "*/@*" -prune -o '
+               f'-type d -printf {_PRINTF_FORMAT}')
+    dir_rows: List[tuple] = []
+    for _, _, mtime, _, path in _iter_entries(command, exclude_path, progress, counts):
+        dir_rows.append((path, mtime))
+        if len(dir_rows) >= INSERT_BATCH_SIZE:
+            _flush(conn, _INSERT_WALK_DIR, dir_rows)
+    _flush(conn, _INSERT_WALK_DIR, dir_rows)
+
+    conn.execute("""
+        INSERT INTO listed_dirs (path)
+        SELECT w.path FROM walk_dirs w
+        LEFT JOIN remote_dirs d ON d.root = ? AND d.path = w.path
+        WHERE d.path IS NULL OR d.mtime != w.mtime
+    """, (root,))
+    changed_dirs = [row[0] for row in conn.execute("SELECT path FROM listed_dirs ORDER BY path")]
+
+    file_rows: List[tuple] = []
+    for start in range(0, len(changed_dirs), DIR_LIST_BATCH_SIZE):
+        batch = changed_dirs[start:start + DIR_LIST_BATCH_SIZE]
+        command = (f'find {" ".join(shlex.quote(d) for d in batch)} -maxdepth 1 '
+                   f'-type f -printf {_PRINTF_FORMAT}')
+        for entry_type, size, mtime, inode, path in _iter_entries(command, exclude_path, progress, counts):
+            if entry_type == 'f':
+                file_rows.append(_file_row(size, mtime, inode, path))
+            if len(file_rows) >= INSERT_BATCH_SIZE:
+                _flush(conn, _INSERT_WALK_FILE, file_rows)
+    _flush(conn, _INSERT_WALK_FILE, file_rows)
+
+def refresh_root(root: str, exclude_path: Optional[str] = None, progress: Optional[ScanProgress] = None, full: bool = False) -> Dict:
+    """
+    Bring the persistent index for one root up to date with the NAS.
+    The first refresh (or a change of exclude_path, or full=True) walks every file; later
+    refreshes only re-list directories whose mtime changed. Files that were added or changed
+    get a new indexed_at timestamp, which is what incremental pair updates key off.
+    If a walk fails or is cut short, the error is raised and the index is left as it was.
+    Returns a summary of what changed.
+    """
+    started = time.monotonic()
+    conn = _connect_db()
+    try:
+        conn.execute("CREATE TEMP TABLE walk_dirs (path TEXT PRIMARY KEY, mtime REAL)")
+        conn.execute("""
+            CREATE TEMP TABLE walk_files (
+                path TEXT PRIMARY KEY, dir TEXT, name TEXT, name_key TEXT,
+                size INTEGER, mtime REAL, inode INTEGER
+            )
+        """)
+        conn.execute("CREATE TEMP TABLE listed_dirs (path TEXT PRIMARY KEY)")
+
+        row = conn.execute("SELECT exclude_path FROM remote_roots WHERE root = ?", (root,)).fetchone()
+        if row is None or row[0] != (exclude_path or ''):
+            full = True
+
+        counts = {'files_walked': 0, 'images_matched': 0}
+        if full:
+            _stage_full_walk(conn, root, exclude_path, progress, counts)
+        else:
+            _stage_changed_dirs(conn, root, exclude_path, progress, counts)
+
+        if progress:
+            progress.check_cancelled()
+
+        conn.execute("BEGIN IMMEDIATE")
+        timestamp = datetime.now().isoformat()
+
+        # Files gone from listed directories, or whose directory no longer exists
+        removed = conn.execute("""
+            DELETE FROM remote_files
+            WHERE root = ?
+              AND (dir IN (SELECT path FROM listed_dirs) OR dir NOT IN (SELECT path FROM walk_dirs))
+              AND path NOT IN (SELECT path FROM walk_files)
+        """, (root,)).rowcount
+
+        added = conn.execute("""
+            SELECT COUNT(*) FROM walk_files w
+            LEFT JOIN remote_files r ON r.root = ? AND r.path = w.path
+            WHERE r.path IS NULL
+        """, (root,)).fetchone()[0]
+
+        changed = conn.execute("""
+            INSERT INTO remote_files (root, path, dir, name, name_key, size, mtime, inode, indexed_at)
+            SELECT ?, w.path, w.dir, w.name, w.name_key, w.size, w.mtime, w.inode, ?
+            FROM walk_files w
+            LEFT JOIN remote_files r ON r.root = ? AND r.path = w.path
+            WHERE r.path IS NULL OR r.size != w.size OR r.mtime != w.mtime OR r.inode != w.inode
+            ON CONFLICT (root, path) DO UPDATE SET
+                size = excluded.size,
+                mtime = excluded.mtime,
+                inode = excluded.inode,
+                indexed_at = excluded.indexed_at
+        """, (root, timestamp, root)).rowcount - added
+
+        conn.execute("""
+            DELETE FROM remote_dirs
+            WHERE root = ? AND path NOT IN (SELECT path FROM walk_dirs)
+        """, (root,))
+        conn.execute("""
+            INSERT OR REPLACE INTO remote_dirs (root, path, mtime, indexed_at)
+            SELECT ?, w.path, w.mtime, ? FROM walk_dirs w
+            WHERE w.path IN (SELECT path FROM listed_dirs)
+        """, (root, timestamp))
+        conn.execute("""
+            INSERT OR REPLACE INTO remote_roots (root, exclude_path, refreshed_at)
+            VALUES (?, ?, ?)
+        """, (root, exclude_path or '', timestamp))
+
+        dirs_walked = conn.execute("SELECT COUNT(*) FROM walk_dirs").fetchone()[0]
+        dirs_listed = conn.execute("SELECT COUNT(*) FROM listed_dirs").fetchone()[0]
+        conn.commit()
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    elapsed = time.monotonic() - started
+    if progress:
+        progress.record_root(root, elapsed, counts['files_walked'], counts['images_matched'])
+
+    logger.info(f"Refreshed index for {root} in {elapsed:.1f}s ({'full' if full else 'incremental'}): "
+                f"{added} added, {changed} changed, {removed} removed; {dirs_listed}/{dirs_walked} directories listed")
+    return {
+        'root': root,
+        'full': full,
+        'added': added,
+        'changed': changed,
+        'removed': removed,
+        'dirs_walked': dirs_walked,
+        'dirs_listed': dirs_listed,
+        'seconds': round(elapsed, 3)
+    }
+
+def refresh_roots(roots: List[Tuple[str, Optional[str]]], progress: Optional[ScanProgress] = None, full: bool = False) -> List[Dict]:
+    """
+    Refresh several roots at the same time, each walking over its own SSH channel.
+    
+    Args:
+        roots: List of (root, exclude_path) tuples
+        progress: Optional progress tracker; a cancelled scan raises ScanCancelled
+        full: Re-walk every file instead of only changed directories
+    """
+    with ThreadPoolExecutor(max_workers=max(len(roots), 1), thread_name_prefix='index-refresh') as executor:
+        futures = [executor.submit(refresh_root, root, exclude_path, progress, full) for root, exclude_path in roots]
+        return [future.result() for future in futures]
+
+def incremental_scan(backup_path: str, sorted_path: str, progress: Optional[ScanProgress] = None, full: bool = False) -> Tuple[str, Dict]:
+    """
+    Refresh the index for both roots and build a new scan session from it.
+    Groups from the previous session for the same roots whose members are all unchanged are
+    carried forward along with their review state; filename groups are rebuilt only for names
+    with a file added, changed or removed since then. Previously ignored pairs stay ignored.
+    Returns (scan_session_id, summary)
+    """
+    exclude_from_sorted = backup_path if is_subpath(backup_path, sorted_path) else None
+    
+    if progress:
+        progress.set_phase('indexing')
+    root_stats = refresh_roots([(backup_path, None), (sorted_path, exclude_from_sorted)], progress, full)
+    
+    if progress:
+        progress.check_cancelled()
+        progress.set_phase('matching')
+    
+    conn = _connect_db()
+    try:
+        started = time.monotonic()
+        conn.execute("BEGIN IMMEDIATE")
+        
+        previous = conn.execute("""
+            SELECT id, created_at FROM scan_sessions
+            WHERE backup_path = ? AND sorted_path = ?
+            ORDER BY created_at DESC
+            LIMIT 1
+        """, (backup_path, sorted_path)).fetchone()
+        
+        # Taken after the refresh, so every file indexed so far is at or before it
+        scan_session_id = str(uuid.uuid4())
+        timestamp = datetime.now().isoformat()
+        
+        conn.execute("""
+            INSERT INTO scan_sessions (id, backup_path, sorted_path, created_at, pair_count)
+            VALUES (?, ?, ?, ?, 0)
+        """, (scan_session_id, backup_path, sorted_path, timestamp))
+        
+        previous_id, changed_since = previous if previous else (None, '')
+        
+        # Names with a file added or changed since the previous session
+        conn.execute("CREATE TEMP TABLE changed_keys (name_key TEXT PRIMARY KEY)")
+        conn.execute("""
+            INSERT OR IGNORE INTO changed_keys
+            SELECT name_key FROM remote_files
+            WHERE root IN (?, ?) AND indexed_at > ?
+        """, (backup_path, sorted_path, changed_since))
+        
+        carried_forward = 0
+        members_written = 0
+        if previous_id:
+            # Previous groups with a member that was removed or changed since
+            conn.execute("CREATE TEMP TABLE stale_groups (id INTEGER PRIMARY KEY)")
+            conn.execute("""
+                INSERT OR IGNORE INTO stale_groups
+                SELECT m.group_id FROM group_members m
+                WHERE m.scan_session_id = ? AND NOT EXISTS (
+                    SELECT 1 FROM remote_files f
+                    WHERE f.root = CASE m.role WHEN ? THEN ? ELSE ? END
+                      AND f.path = m.path AND f.indexed_at <= ?
+                )
+            """, (previous_id, ROLE_BACKUP, backup_path, sorted_path, changed_since))
+            conn.execute("""
+                INSERT OR IGNORE INTO changed_keys
+                SELECT g.group_key FROM duplicate_groups g
+                JOIN stale_groups sg ON sg.id = g.id
+                WHERE g.match_type = ?
+            """, (MATCH_TYPE_FILENAME,))
+            
+            # Copy the remaining groups under new ids allocated past the current maximum
+            first_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM duplicate_groups").fetchone()[0]
+            conn.execute("CREATE TEMP TABLE carried_groups (old_id INTEGER PRIMARY KEY, new_id INTEGER NOT NULL)")
+            carried_forward = conn.execute("""
+                INSERT INTO carried_groups (old_id, new_id)
+                SELECT g.id, ? + ROW_NUMBER() OVER (ORDER BY g.id)
+                FROM duplicate_groups g
+                WHERE g.scan_session_id = ?
+                  AND g.id NOT IN (SELECT id FROM stale_groups)
+                  AND NOT (g.match_type = ? AND g.group_key IN (SELECT name_key FROM changed_keys))
+            """, (first_id, previous_id, MATCH_TYPE_FILENAME)).rowcount
+            conn.execute("""
+                INSERT INTO duplicate_groups (id, scan_session_id, group_key, match_type, created_at)
+                SELECT c.new_id, ?, g.group_key, g.match_type, g.created_at
+                FROM carried_groups c
+                JOIN duplicate_groups g ON g.id = c.old_id
+                ORDER BY c.new_id
+            """, (scan_session_id,))
+            members_written += conn.execute("""
+                INSERT INTO group_members (
+                    group_id, scan_session_id, role, path, reviewed, action,
+                    match_status, match_distance, size, sample_hash, content_hash
+                )
+                SELECT c.new_id, ?, m.role, m.path, m.reviewed, m.action,
+                       m.match_status, m.match_distance, m.size, m.sample_hash, m.content_hash
+                FROM carried_groups c
+                JOIN group_members m ON m.group_id = c.old_id
+                ORDER BY c.new_id, m.id
+            """, (scan_session_id,)).rowcount
+        
+        # One filename group per changed name that now exists under both roots
+        first_new_group = conn.execute("SELECT COALESCE(MAX(id), 0) FROM duplicate_groups").fetchone()[0]
+        new_groups = conn.execute("""
+            INSERT INTO duplicate_groups (scan_session_id, group_key, match_type, created_at)
+            SELECT ?, ck.name_key, ?, ?
+            FROM changed_keys ck
+            WHERE EXISTS (SELECT 1 FROM remote_files b WHERE b.root = ? AND b.name_key = ck.name_key)
+              AND EXISTS (SELECT 1 FROM remote_files s WHERE s.root = ? AND s.name_key = ck.name_key)
+            ORDER BY ck.name_key
+        """, (scan_session_id, MATCH_TYPE_FILENAME, timestamp, backup_path, sorted_path)).rowcount
+        for role, root in ((ROLE_BACKUP, backup_path), (ROLE_SORTED, sorted_path)):
+            members_written += conn.execute("""
+                INSERT INTO group_members (group_id, scan_session_id, role, path)
+                SELECT g.id, g.scan_session_id, ?, f.path
+                FROM duplicate_groups g
+                JOIN remote_files f ON f.root = ? AND f.name_key = g.group_key
+                WHERE g.scan_session_id = ? AND g.id > ?
+                ORDER BY g.id, f.path
+            """, (role, root, scan_session_id, first_new_group)).rowcount
+        
+        apply_ignored_pairs(conn, scan_session_id)
+        pair_count = refresh_session_counts(conn, scan_session_id)
+        
+        conn.execute("COMMIT")
+        seconds = time.monotonic() - started
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        conn.close()
+    
+    rows_written = carried_forward + new_groups + members_written
+    if progress:
+        progress.set_pairs_found(pair_count)
+    
+    logger.info(f"Incremental scan {scan_session_id}: {carried_forward} groups carried forward, {new_groups} new, {pair_count} pairs")
+    return scan_session_id, {
+        'duplicate_count': pair_count,
+        'group_count': carried_forward + new_groups,
+        'carried_forward': carried_forward,
+        'new_groups': new_groups,
+        'index': root_stats,
+        'ingest': {
+            'rows': rows_written,
+            'seconds': round(seconds, 3),
+            'rows_per_second': round(rows_written / seconds) if seconds > 0 else rows_written
+        }
+    }
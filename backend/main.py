@@ -1,17 +1,32 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.routing import APIRouter
-from fastapi.responses import Response
+from fastapi.responses import Response, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 from backend.config import Config
 from backend.db import init_db
 from backend.ssh_client import SSHClient
-from backend.duplicate_scanner import find_duplicates, save_duplicates_to_db, get_duplicates_from_db, get_scan_sessions
-from backend.thumbnail_service import fetch_and_resize_image
+from backend import ssh_async
+from backend.duplicate_scanner import get_duplicates_from_db, iter_duplicate_pages, parse_pair_cursor, get_scan_sessions, DUPLICATES_PAGE_SIZE
+from backend.scan_jobs import submit_scan_job, submit_thumbnail_job, get_job, list_jobs, cancel_job, recover_interrupted_jobs
+from backend.thumbnail_service import (
+    fetch_and_resize_image, generate_thumbnails, get_cache_stats, get_thumbnail_stats, get_thumbnail_key,
+    get_placeholders, thumbnail_etag, THUMBNAIL_VARIANTS
+)
+from backend.original_service import parse_range, original_etag, media_type, is_servable_path, RangeNotSatisfiable
+from backend.embedded_preview import get_preview_stats
+from backend.thumbnail_engine import get_engine_stats, shutdown_decode_pool
+from backend.thumbnail_cache import cleanup_orphans, get_disk_cache_stats
+from backend.thumbnail_prefetch import prefetch_pairs, get_prefetch_stats
 from backend.path_utils import suggest_paths, validate_path, infer_volume_path, is_subpath
-from backend.review_actions import ignore_duplicate, unignore_duplicate, delete_duplicate, undo_last_action, get_review_stats
+from backend.review_actions import ignore_duplicate, unignore_duplicate, delete_duplicate, undo_last_action, get_review_stats, check_review_stats
+import asyncio
+import base64
+import json
 import logging
+import os
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
@@ -43,7 +58,7 @@ async def status():
 async def connection_status():
     is_connected = SSHClient.is_connected()
     if not is_connected:
-        success, error = SSHClient.connect()
+        success, error = await ssh_async.connect()
         return {
             "connected": success,
             "error": error,
@@ -59,46 +74,92 @@ async def connection_status():
 
 @api_router.post("/connection/test")
 async def test_connection():
-    SSHClient.disconnect()
-    success, error = SSHClient.connect()
+    await ssh_async.call(SSHClient.disconnect)
+    success, error = await ssh_async.connect()
     return {
         "connected": success,
         "error": error
     }
 
+@api_router.get("/connection/pool")
+async def connection_pool_stats():
+    """SSH connections and channels in use against their limits, and connections dropped by health checks."""
+    return SSHClient.get_pool_stats()
+
+# How often dead and long-idle SSH connections are dropped from the pool in the background
+POOL_HEALTH_CHECK_SECONDS = 60
+
+async def check_pool_health():
+    while True:
+        await asyncio.sleep(POOL_HEALTH_CHECK_SECONDS)
+        try:
+            health = await ssh_async.call(SSHClient.check_health)
+            if health["dropped"]:
+                logger.info(f"Dropped {health['dropped']} SSH connections, {health['connections']} remain")
+        except Exception as e:
+            logger.error(f"SSH pool health check failed: {e}")
+
 class ScanRequest(BaseModel):
     backup_path: str
     sorted_path: str
+    incremental: bool = True
+    verify: bool = False
+    similar: bool = False
+    content: bool = False
 
 @api_router.post("/scan/start")
 async def start_scan(request: ScanRequest):
-    """Start a duplicate scan between two folders."""
-    if not SSHClient.is_connected():
-        success, error = SSHClient.connect()
-        if not success:
-            raise HTTPException(status_code=500, detail=f"SSH connection failed: {error}")
-    
+    """Queue a duplicate scan between two folders as a background job."""
     try:
-        logger.info(f"Starting scan: backup={request.backup_path}, sorted={request.sorted_path}")
-        duplicate_pairs = find_duplicates(request.backup_path, request.sorted_path)
-        
-        # Save to database
-        scan_session_id = save_duplicates_to_db(duplicate_pairs)
-        
+        job_id = await run_in_threadpool(submit_scan_job, request.backup_path, request.sorted_path, request.incremental, request.verify, request.similar, request.content)
         return {
             "success": True,
-            "duplicate_count": len(duplicate_pairs),
-            "scan_session_id": scan_session_id
+            "job_id": job_id,
+            "status": "queued"
         }
     except Exception as e:
-        logger.exception("Error during scan")
-        raise HTTPException(status_code=500, detail=f"Scan failed: {str(e)}")
+        logger.exception("Error queueing scan")
+        raise HTTPException(status_code=500, detail=f"Failed to start scan: {str(e)}")
+
+@api_router.get("/scan/jobs")
+async def get_scan_jobs(limit: int = 20):
+    """List recent scan jobs."""
+    return {"jobs": await run_in_threadpool(list_jobs, limit)}
+
+@api_router.get("/scan/jobs/{job_id}")
+async def get_scan_job(job_id: int):
+    """Get the status, progress and result of a scan job."""
+    job = await run_in_threadpool(get_job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@api_router.get("/scan/jobs/{job_id}/progress")
+async def get_scan_job_progress(job_id: int):
+    """Get just the status and progress counters of a scan job."""
+    job = await run_in_threadpool(get_job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {
+        "id": job["id"],
+        "status": job["status"],
+        "progress": job["progress"]
+    }
+
+@api_router.post("/scan/jobs/{job_id}/cancel")
+async def cancel_scan_job(job_id: int):
+    """Request cancellation of a queued or running scan job."""
+    success, error = await run_in_threadpool(cancel_job, job_id)
+    if not success:
+        status_code = 404 if error == "Job not found" else 409
+        raise HTTPException(status_code=status_code, detail=error)
+    return {"success": True, "job_id": job_id}
 
 @api_router.get("/scan/sessions")
 async def get_sessions():
     """Get all scan sessions."""
     try:
-        sessions = get_scan_sessions()
+        sessions = await run_in_threadpool(get_scan_sessions)
         return {
             "sessions": sessions,
             "error": None
@@ -111,13 +172,30 @@ async def get_sessions():
         }
 
 @api_router.get("/scan/duplicates")
-async def get_duplicates(scan_session_id: Optional[str] = None, limit: Optional[int] = None, offset: int = 0, include_reviewed: bool = False):
-    """Get duplicate pairs from a scan session."""
+async def get_duplicates(scan_session_id: Optional[str] = None, limit: int = DUPLICATES_PAGE_SIZE, after: Optional[str] = None,
+                         include_reviewed: bool = False, action: Optional[str] = None, stream: bool = False):
+    """
+    Get duplicate pairs from a scan session, a page at a time. Pass next_cursor back as
+    `after` for the following page. With stream, every pair is sent as NDJSON (one pair
+    per line) as the pages are read, so the first pairs arrive before the rest are loaded.
+    """
+    try:
+        parse_pair_cursor(after)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    if stream:
+        def ndjson():
+            for pairs in iter_duplicate_pages(scan_session_id, include_reviewed, action, limit):
+                yield ''.join(json.dumps(pair) + '\n' for pair in pairs)
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+    
     try:
-        pairs = get_duplicates_from_db(scan_session_id, limit, offset, include_reviewed)
+        pairs, next_cursor = await run_in_threadpool(get_duplicates_from_db, scan_session_id, limit, after, include_reviewed, action)
         return {
             "pairs": pairs,
             "count": len(pairs),
+            "next_cursor": next_cursor,
             "error": None
         }
     except Exception as e:
@@ -125,26 +203,26 @@ async def get_duplicates(scan_session_id: Optional[str] = None, limit: Optional[
         return {
             "pairs": [],
             "count": 0,
+            "next_cursor": None,
             "error": str(e)
         }
 
 @api_router.get("/paths/suggest")
 async def suggest_paths_endpoint(partial: str = ""):
     """Get path suggestions for autocomplete."""
-    if not SSHClient.is_connected():
-        success, error = SSHClient.connect()
-        if not success:
-            return {
-                "suggestions": [],
-                "error": error
-            }
+    success, error = await ssh_async.connect()
+    if not success:
+        return {
+            "suggestions": [],
+            "error": error
+        }
     
     try:
         # Auto-infer volume if needed
         if partial and not partial.startswith('/volume'):
-            partial = infer_volume_path(partial)
+            partial = await ssh_async.call(infer_volume_path, partial)
         
-        suggestions = suggest_paths(partial)
+        suggestions = await ssh_async.call(suggest_paths, partial)
         return {
             "suggestions": suggestions,
             "error": None
@@ -162,21 +240,20 @@ class ValidatePathRequest(BaseModel):
 @api_router.post("/paths/validate")
 async def validate_path_endpoint(request: ValidatePathRequest):
     """Validate that a path exists and is accessible."""
-    if not SSHClient.is_connected():
-        success, error = SSHClient.connect()
-        if not success:
-            return {
-                "valid": False,
-                "error": f"SSH connection failed: {error}"
-            }
+    success, error = await ssh_async.connect()
+    if not success:
+        return {
+            "valid": False,
+            "error": f"SSH connection failed: {error}"
+        }
     
     try:
         path = request.path
         # Auto-infer volume if needed
         if path and not path.startswith('/volume'):
-            path = infer_volume_path(path)
+            path = await ssh_async.call(infer_volume_path, path)
         
-        is_valid, error_msg = validate_path(path)
+        is_valid, error_msg = await ssh_async.call(validate_path, path)
         return {
             "valid": is_valid,
             "normalized_path": path if is_valid else None,
@@ -197,25 +274,24 @@ class ValidatePathsRequest(BaseModel):
 @api_router.post("/paths/validate-pair")
 async def validate_paths_pair(request: ValidatePathsRequest):
     """Validate both paths and check if backup is subfolder of sorted."""
-    if not SSHClient.is_connected():
-        success, error = SSHClient.connect()
-        if not success:
-            return {
-                "valid": False,
-                "errors": [f"SSH connection failed: {error}"],
-                "warnings": []
-            }
+    success, error = await ssh_async.connect()
+    if not success:
+        return {
+            "valid": False,
+            "errors": [f"SSH connection failed: {error}"],
+            "warnings": []
+        }
     
     errors = []
     warnings = []
     
     # Auto-infer volumes
-    backup_path = infer_volume_path(request.backup_path) if request.backup_path else ""
-    sorted_path = infer_volume_path(request.sorted_path) if request.sorted_path else ""
+    backup_path = await ssh_async.call(infer_volume_path, request.backup_path) if request.backup_path else ""
+    sorted_path = await ssh_async.call(infer_volume_path, request.sorted_path) if request.sorted_path else ""
     
     # Validate backup path
     if backup_path:
-        is_valid, error_msg = validate_path(backup_path)
+        is_valid, error_msg = await ssh_async.call(validate_path, backup_path)
         if not is_valid:
             errors.append(f"Backup path: {error_msg}")
     else:
@@ -223,7 +299,7 @@ async def validate_paths_pair(request: ValidatePathsRequest):
     
     # Validate sorted path
     if sorted_path:
-        is_valid, error_msg = validate_path(sorted_path)
+        is_valid, error_msg = await ssh_async.call(validate_path, sorted_path)
         if not is_valid:
             errors.append(f"Sorted path: {error_msg}")
     else:
@@ -241,28 +317,226 @@ async def validate_paths_pair(request: ValidatePathsRequest):
         "warnings": warnings
     }
 
+# Browsers reuse a thumbnail for a day, then revalidate it with its ETag
+THUMB_CACHE_CONTROL = "private, max-age=86400"
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates or f"W/{etag}" in candidates
+
+# Media types of the thumbnail formats
+THUMB_MEDIA_TYPES = {"jpeg": "image/jpeg", "webp": "image/webp"}
+
 @api_router.get("/thumb")
-async def get_thumbnail(path: str):
+async def get_thumbnail(path: str, size: str = "medium", if_none_match: Optional[str] = Header(None),
+                        accept: Optional[str] = Header(None)):
+    """
+    Serve a thumbnail in a size class (tiny, small, medium, large), as WebP to browsers that
+    accept it when WebP thumbnails are enabled. Source file stats come from the scan index
+    when possible, so a thumbnail the browser already has is answered with 304 without
+    contacting the NAS.
+    """
     from urllib.parse import unquote
     path = unquote(path)
     
     if not path:
         raise HTTPException(status_code=400, detail="Path parameter required")
-    
-    if not SSHClient.is_connected():
-        success, error = SSHClient.connect()
-        if not success:
-            raise HTTPException(status_code=500, detail=error)
+    if size not in THUMBNAIL_VARIANTS:
+        raise HTTPException(status_code=400, detail=f"size must be one of: {', '.join(THUMBNAIL_VARIANTS)}")
+    fmt = "webp" if Config.THUMB_WEBP and accept and "image/webp" in accept else "jpeg"
     
     try:
-        thumbnail_bytes = fetch_and_resize_image(path, max_size=Config.THUMB_MAX_SIZE)
+        stats = await ssh_async.call(get_thumbnail_stats, path)
+        if not stats:
+            raise HTTPException(status_code=404, detail="Thumbnail not available")
+        
+        cache_key, _ = await run_in_threadpool(get_thumbnail_key, path, stats)
+        headers = {
+            "ETag": thumbnail_etag(cache_key, size, fmt, Config.THUMB_MAX_SIZE),
+            "Cache-Control": THUMB_CACHE_CONTROL
+        }
+        if Config.THUMB_WEBP:
+            headers["Vary"] = "Accept"
+        if _etag_matches(if_none_match, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+        
+        thumbnail_bytes = await ssh_async.call(fetch_and_resize_image, path, Config.THUMB_MAX_SIZE, stats, size, fmt)
         if not thumbnail_bytes:
             raise HTTPException(status_code=404, detail="Thumbnail not available")
         
-        return Response(content=thumbnail_bytes, media_type="image/jpeg")
+        return Response(content=thumbnail_bytes, media_type=THUMB_MEDIA_TYPES[fmt], headers=headers)
     except HTTPException:
         raise
+    except asyncio.TimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Originals are large and are only opened to inspect a pair, so browsers revalidate them every time
+ORIGINAL_CACHE_CONTROL = "private, no-cache"
+
+@api_router.get("/original")
+async def get_original(path: str, range_header: Optional[str] = Header(None, alias="Range"), if_range: Optional[str] = Header(None),
+                       if_none_match: Optional[str] = Header(None)):
+    """
+    Stream a full-resolution original over SFTP, for checking fine detail before deleting.
+    Supports single byte ranges, so viewers can start rendering and seek without fetching
+    the whole file; memory use per stream is bounded by the SFTP read-ahead window.
+    """
+    from urllib.parse import unquote
+    path = unquote(path)
+    
+    if not path:
+        raise HTTPException(status_code=400, detail="Path parameter required")
+    # Opened by its normalized form, so '..' can't step out of the root it was checked against
+    path = os.path.normpath(path)
+    if not await run_in_threadpool(is_servable_path, path):
+        raise HTTPException(status_code=403, detail="Path is not under a scanned folder")
+    
+    try:
+        remote_file, size, mtime = await ssh_async.sftp_open(path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+    except ConnectionError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    except asyncio.TimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
+        logger.exception("Error opening original")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    etag = original_etag(path, size, mtime)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Cache-Control": ORIGINAL_CACHE_CONTROL
+    }
+    if _etag_matches(if_none_match, etag):
+        await ssh_async.call(remote_file.close)
+        return Response(status_code=304, headers=headers)
+    
+    try:
+        # A range only applies to the version of the file the client already has part of
+        byte_range = parse_range(range_header, size) if not if_range or if_range == etag else None
+    except RangeNotSatisfiable:
+        await ssh_async.call(remote_file.close)
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    
+    status_code = 200
+    start, end = 0, size - 1
+    if byte_range:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    
+    return StreamingResponse(
+        ssh_async.iter_sftp_range(remote_file, start, end),
+        status_code=status_code,
+        media_type=media_type(path),
+        headers=headers
+    )
+
+# Images accepted by one bulk thumbnail request
+MAX_BULK_THUMBNAILS = 2000
+
+class BulkThumbnailRequest(BaseModel):
+    paths: List[str]
+
+@api_router.post("/thumbs/batch")
+async def generate_thumbnails_bulk(request: BulkThumbnailRequest):
+    """
+    Generate thumbnails for many images at once, with a single remote pipeline for the ones
+    not cached yet. The thumbnails are then served from the cache by /api/thumb.
+    """
+    if len(request.paths) > MAX_BULK_THUMBNAILS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_THUMBNAILS} paths per request")
+    
+    success, error = await ssh_async.connect()
+    if not success:
+        raise HTTPException(status_code=500, detail=error)
+    
+    try:
+        # Bulk generation takes as long as it takes; the client chose to wait for it
+        cached = await ssh_async.call(generate_thumbnails, request.paths, Config.THUMB_MAX_SIZE, timeout=None)
+        return {
+            "available": [path for path in request.paths if path in cached],
+            "missing": [path for path in request.paths if path not in cached]
+        }
+    except Exception as e:
+        logger.exception("Error generating thumbnails")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/thumbs/placeholders")
+async def thumbnail_placeholders(request: BulkThumbnailRequest):
+    """
+    Tiny thumbnails of already-cached images as data URIs, to show inline while the full
+    thumbnails load. Never contacts the NAS; images without one are left out.
+    """
+    if len(request.paths) > MAX_BULK_THUMBNAILS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_THUMBNAILS} paths per request")
+    placeholders = await run_in_threadpool(get_placeholders, request.paths)
+    return {
+        "placeholders": {
+            path: "data:image/jpeg;base64," + base64.b64encode(data).decode('ascii')
+            for path, data in placeholders.items()
+        }
+    }
+
+class ThumbnailWarmRequest(BaseModel):
+    scan_session_id: str
+
+@api_router.post("/thumbs/warm")
+async def warm_thumbnails(request: ThumbnailWarmRequest):
+    """Queue a background job that generates thumbnails for a session's unreviewed pairs."""
+    try:
+        job_id = await run_in_threadpool(submit_thumbnail_job, request.scan_session_id)
+    except Exception as e:
+        logger.exception("Error queueing thumbnail job")
+        raise HTTPException(status_code=500, detail=f"Failed to queue thumbnail job: {str(e)}")
+    if job_id is None:
+        raise HTTPException(status_code=404, detail="Scan session not found")
+    return {"success": True, "job_id": job_id, "status": "queued"}
+
+class PrefetchRequest(BaseModel):
+    scan_session_id: str
+    current_id: Optional[int] = None
+    count: Optional[int] = None
+
+@api_router.post("/thumbs/prefetch")
+async def prefetch_thumbnails(request: PrefetchRequest):
+    """
+    Keep thumbnails warm for the pairs after the reviewer's current one. Call again whenever
+    the current pair changes; the queue is re-prioritised and passed pairs are dropped.
+    """
+    try:
+        prefetch = await run_in_threadpool(prefetch_pairs, request.scan_session_id, request.current_id, request.count)
+        return {"prefetch": prefetch, "cache": get_cache_stats()}
+    except Exception as e:
+        logger.exception("Error queueing thumbnail prefetch")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/thumbs/stats")
+async def thumbnail_stats():
+    """Thumbnail cache hit ratio, disk cache against its budget, prefetch queue, embedded preview and engine use."""
+    return {
+        "prefetch": get_prefetch_stats(),
+        "cache": get_cache_stats(),
+        "previews": get_preview_stats(),
+        "engine": get_engine_stats(),
+        "disk": await run_in_threadpool(get_disk_cache_stats)
+    }
+
+@api_router.post("/thumbs/cleanup")
+async def cleanup_thumbnail_cache():
+    """Drop thumbnails of files that are gone or changed, and evict down to the cache budget."""
+    try:
+        result = await run_in_threadpool(cleanup_orphans)
+        return {"success": True, **result, "disk": await run_in_threadpool(get_disk_cache_stats)}
+    except Exception as e:
+        logger.exception("Error cleaning up thumbnail cache")
         raise HTTPException(status_code=500, detail=str(e))
 
 class ReviewActionRequest(BaseModel):
@@ -276,7 +550,7 @@ class ReviewActionRequest(BaseModel):
 async def ignore_review(request: ReviewActionRequest):
     """Mark a duplicate pair as ignored."""
     try:
-        success, error = ignore_duplicate(request.review_id, request.backup_path, request.sorted_path)
+        success, error = await run_in_threadpool(ignore_duplicate, request.review_id, request.backup_path, request.sorted_path)
         if not success:
             raise HTTPException(status_code=500, detail=error)
         
@@ -291,7 +565,7 @@ async def ignore_review(request: ReviewActionRequest):
 async def unignore_review(request: ReviewActionRequest):
     """Unignore a previously ignored duplicate pair."""
     try:
-        success, error = unignore_duplicate(request.review_id, request.backup_path, request.sorted_path)
+        success, error = await run_in_threadpool(unignore_duplicate, request.review_id, request.backup_path, request.sorted_path)
         if not success:
             raise HTTPException(status_code=500, detail=error)
         
@@ -306,8 +580,9 @@ async def unignore_review(request: ReviewActionRequest):
 async def delete_review(request: ReviewActionRequest):
     """Delete a duplicate by moving to recycle bin."""
     try:
-        success, error, undo_info = delete_duplicate(
-            request.review_id, 
+        success, error, undo_info = await ssh_async.call(
+            delete_duplicate,
+            request.review_id,
             request.backup_path, 
             request.session_id,
             request.recycle_bin_path
@@ -329,7 +604,7 @@ class UndoRequest(BaseModel):
 async def undo_review(request: UndoRequest):
     """Undo the last review action."""
     try:
-        success, error, action_type = undo_last_action(request.session_id)
+        success, error, action_type = await ssh_async.call(undo_last_action, request.session_id)
         if not success:
             raise HTTPException(status_code=400, detail=error or "Nothing to undo")
         
@@ -344,17 +619,47 @@ async def undo_review(request: UndoRequest):
 async def review_stats(scan_session_id: str):
     """Get review statistics for a scan session."""
     try:
-        stats = get_review_stats(scan_session_id)
+        stats = await run_in_threadpool(get_review_stats, scan_session_id)
         return stats
     except Exception as e:
         logger.exception("Error getting review stats")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/review/stats/check")
+async def review_stats_check(scan_session_id: Optional[str] = None):
+    """Compare maintained review counters with a recount, for one session or all of them."""
+    try:
+        return await run_in_threadpool(check_review_stats, scan_session_id)
+    except Exception as e:
+        logger.exception("Error checking review stats")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/review/stats/rebuild")
+async def review_stats_rebuild(scan_session_id: Optional[str] = None):
+    """Recount review counters that no longer match the session's members."""
+    try:
+        return await run_in_threadpool(check_review_stats, scan_session_id, rebuild=True)
+    except Exception as e:
+        logger.exception("Error rebuilding review stats")
+        raise HTTPException(status_code=500, detail=str(e))
+
 app.include_router(api_router)
 
 @app.on_event("startup")
 async def startup_event():
     init_db()
+    recover_interrupted_jobs()
+    try:
+        await run_in_threadpool(cleanup_orphans)
+    except Exception as e:
+        logger.error(f"Thumbnail cache cleanup failed: {e}")
+    app.state.pool_health_task = asyncio.create_task(check_pool_health())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    app.state.pool_health_task.cancel()
+    shutdown_decode_pool()
+    ssh_async.shutdown()
 
 @app.get("/")
 async def root():
@@ -0,0 +1,115 @@
+import hashlib
+import logging
+import mimetypes
+import re
+from typing import Iterator, Optional, Tuple
+import paramiko
+from backend.config import Config
+from backend.db import get_connection
+from backend.ssh_client import SSHClient
+from backend.path_utils import is_subpath
+
+logger = logging.getLogger(__name__)
+
+# Bytes per SFTP read request; servers commonly cap reads at 32 KiB
+ORIGINAL_CHUNK_SIZE = 32768
+
+# Read requests kept in flight while streaming, so the transfer isn't one round trip per
+# chunk. Also bounds what is buffered per stream: ORIGINAL_READ_AHEAD * ORIGINAL_CHUNK_SIZE.
+ORIGINAL_READ_AHEAD = 32
+
+# Browsers don't know most RAW extensions; these at least get a sensible type
+_EXTRA_MEDIA_TYPES = {
+    '.heic': 'image/heic',
+    '.heif': 'image/heif',
+    '.webp': 'image/webp',
+    '.dng': 'image/x-adobe-dng',
+    '.cr2': 'image/x-canon-cr2',
+    '.nef': 'image/x-nikon-nef',
+    '.arw': 'image/x-sony-arw',
+}
+
+_RANGE_RE = re.compile(r'^\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*$')
+
+class RangeNotSatisfiable(Exception):
+    """The requested byte range lies outside the file."""
+
+def media_type(remote_path: str) -> str:
+    ext = '.' + remote_path.rsplit('.', 1)[-1].lower() if '.' in remote_path else ''
+    return _EXTRA_MEDIA_TYPES.get(ext) or mimetypes.guess_type(remote_path)[0] or 'application/octet-stream'
+
+def original_etag(remote_path: str, size: int, mtime: float) -> str:
+    return '"' + hashlib.sha256(f"{remote_path}:{int(mtime)}:{size}".encode()).hexdigest()[:32] + '"'
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    The (start, end) inclusive byte range of a single-range `Range: bytes=...` header, or None
+    to send the whole file (no header, or one we don't handle such as multiple ranges).
+    Raises RangeNotSatisfiable if the range starts beyond the end of the file.
+    """
+    if not range_header:
+        return None
+    match = _RANGE_RE.match(range_header)
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise RangeNotSatisfiable()
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable()
+    return start, end
+
+def is_servable_path(remote_path: str) -> bool:
+    """
+    Whether an original may be served: an absolute path under the configured backup or sorted
+    root, or under the roots of a scan session. Anything else the NAS user can read is refused.
+    """
+    if not remote_path.startswith('/'):
+        return False
+    if Config.is_backup_path(remote_path) or Config.is_sorted_path(remote_path):
+        return True
+    cursor = get_connection().cursor()
+    cursor.execute("SELECT DISTINCT backup_path, sorted_path FROM scan_sessions")
+    return any(is_subpath(remote_path, root) for roots in cursor.fetchall() for root in roots)
+
+def open_original(remote_path: str) -> Tuple[paramiko.SFTPFile, int, float]:
+    """
+    Open a remote file for streaming over SFTP. Returns (file, size, mtime).
+    Raises FileNotFoundError if it doesn't exist and ConnectionError if SFTP is unavailable.
+    """
+    sftp = SSHClient.get_sftp()
+    if sftp is None:
+        raise ConnectionError("SFTP is not available")
+    remote_file = sftp.open(remote_path, 'rb')
+    try:
+        attributes = remote_file.stat()
+    except Exception:
+        remote_file.close()
+        raise
+    return remote_file, attributes.st_size, float(attributes.st_mtime)
+
+def _iter_windows(remote_file: paramiko.SFTPFile, start: int, end: int) -> Iterator[bytes]:
+    """Bytes start..end (inclusive), read ORIGINAL_READ_AHEAD pipelined requests at a time."""
+    window_bytes = ORIGINAL_CHUNK_SIZE * ORIGINAL_READ_AHEAD
+    position = start
+    while position <= end:
+        window_end = min(position + window_bytes, end + 1)
+        chunks = [(offset, min(ORIGINAL_CHUNK_SIZE, window_end - offset))
+                  for offset in range(position, window_end, ORIGINAL_CHUNK_SIZE)]
+        for data in remote_file.readv(chunks):
+            if not data:
+                return
+            yield data
+        position = window_end
+
+def read_range(remote_file: paramiko.SFTPFile, start: int, length: int) -> bytes:
+    """Read length bytes at start of an open remote file with pipelined requests; shorter at EOF."""
+    if length <= 0:
+        return b''
+    return b''.join(_iter_windows(remote_file, start, start + length - 1))
@@ -105,15 +105,10 @@ def suggest_volumes() -> List[str]:
     # Common volume paths on Synology
     common_volumes = ['/volume1', '/volume2', '/volume3', '/volume4', '/volume5']
     
-    # Check which volumes exist
-    existing_volumes = []
-    for vol in common_volumes:
-        success, _, _ = SSHClient.run_command(f'test -d "{vol}" && echo "exists" || echo "notfound"')
-        if success:
-            # Check if command output indicates it exists
-            success_check, output, _ = SSHClient.run_command(f'[ -d "{vol}" ] && echo "yes" || echo "no"')
-            if success_check and 'yes' in (output or ''):
-                existing_volumes.append(vol)
+    # Check which volumes exist, all in one round trip
+    results = SSHClient.run_commands([f'[ -d "{vol}" ] && echo "yes" || echo "no"' for vol in common_volumes])
+    existing_volumes = [vol for vol, (success, output, _) in zip(common_volumes, results)
+                        if success and 'yes' in (output or '')]
     
     return existing_volumes if existing_volumes else common_volumes[:2]  # Default to volume1, volume2
 
@@ -0,0 +1,255 @@
+import io
+import sqlite3
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import combinations
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from PIL import Image
+from backend.config import Config
+from backend.db import connect
+from backend.scan_progress import ScanProgress
+from backend.duplicate_scanner import ROLE_BACKUP, ROLE_SORTED, apply_ignored_pairs, refresh_session_counts
+from backend.thumbnail_service import generate_thumbnails
+
+logger = logging.getLogger(__name__)
+
+MATCH_TYPE_SIMILAR = 'similar'
+
+# dHash compares horizontally adjacent pixels of a (HASH_SIZE) x (HASH_SIZE + 1) grayscale image
+HASH_SIZE = 8
+
+# The 64-bit hash is split into this many 16-bit bands. If two hashes are within distance d,
+# at least one band is within d // BANDS of the other's (pigeonhole), so probing each band's
+# index with that radius finds every match without comparing all pairs.
+BANDS = 4
+BAND_BITS = 64 // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+
+# Images decoded and hashed per process-pool task
+HASH_BATCH_SIZE = 256
+
+def dhash_pixels(pixels: np.ndarray) -> np.ndarray:
+    """
+    Vectorised dHash of a batch of grayscale images shaped (n, HASH_SIZE, HASH_SIZE + 1).
+    Returns an array of n unsigned 64-bit hashes.
+    """
+    bits = pixels[:, :, 1:] > pixels[:, :, :-1]
+    packed = np.packbits(bits.reshape(len(pixels), -1), axis=1)
+    return packed.view('>u8').ravel().astype(np.uint64)
+
+def dhash_jpegs(blobs: List[Optional[bytes]]) -> List[Optional[int]]:
+    """
+    Decode a batch of small JPEGs and return their dHashes (None where decoding failed).
+    Runs in a worker process.
+    """
+    pixels = np.zeros((len(blobs), HASH_SIZE, HASH_SIZE + 1), dtype=np.int16)
+    valid = np.zeros(len(blobs), dtype=bool)
+    for i, blob in enumerate(blobs):
+        if not blob:
+            continue
+        try:
+            with Image.open(io.BytesIO(blob)) as img:
+                # JPEG draft mode decodes at reduced scale, far cheaper than a full decode
+                img.draft('L', (HASH_SIZE * 8, HASH_SIZE * 8))
+                small = img.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS)
+                pixels[i] = np.asarray(small, dtype=np.int16)
+                valid[i] = True
+        except Exception:
+            continue
+    hashes = dhash_pixels(pixels)
+    return [int(h) if ok else None for h, ok in zip(hashes, valid)]
+
+def _to_signed(value: int) -> int:
+    """SQLite integers are signed 64-bit."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def _to_unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+def _bands(value: int) -> List[int]:
+    return [(value >> (BAND_BITS * i)) & BAND_MASK for i in range(BANDS)]
+
+def _band_neighbours(band: int, radius: int) -> List[int]:
+    """All band values within `radius` bit flips of `band`."""
+    values = [band]
+    for r in range(1, radius + 1):
+        for bits in combinations(range(BAND_BITS), r):
+            flipped = band
+            for bit in bits:
+                flipped ^= 1 << bit
+            values.append(flipped)
+    return values
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+def _store_hashes(conn: sqlite3.Connection, batch: List[Tuple[str, int, float]], hashes: List[Optional[int]]) -> int:
+    timestamp = datetime.now().isoformat()
+    rows = []
+    for (path, size, mtime), value in zip(batch, hashes):
+        if value is None:
+            continue
+        rows.append((path, size, mtime, _to_signed(value), *_bands(value), timestamp))
+    conn.executemany("""
+        INSERT OR REPLACE INTO perceptual_hashes
+            (path, size, mtime, dhash, band0, band1, band2, band3, computed_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, rows)
+    conn.commit()
+    return len(rows)
+
+def _read_thumbnail(cached_path: Optional[str]) -> Optional[bytes]:
+    if not cached_path:
+        return None
+    try:
+        with open(cached_path, 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+def update_perceptual_hashes(roots: List[str], progress: Optional[ScanProgress] = None) -> int:
+    """
+    Compute dHashes for indexed images under the given roots that have none yet, or whose
+    size/mtime changed. Thumbnails come from thumbnail_service's batch generator (and stay
+    cached for review); decoding and hashing run in vectorised batches across a process pool.
+    Returns the number of hashes computed.
+    """
+    conn = connect()
+    try:
+        placeholders = ','.join('?' * len(roots))
+        pending = conn.execute(f"""
+            SELECT DISTINCT f.path, f.size, f.mtime FROM remote_files f
+            LEFT JOIN perceptual_hashes p ON p.path = f.path
+            WHERE f.root IN ({placeholders})
+              AND (p.path IS NULL OR p.size != f.size OR p.mtime != f.mtime)
+            ORDER BY f.path
+        """, roots).fetchall()
+
+        if not pending:
+            return 0
+        logger.info(f"Computing perceptual hashes for {len(pending)} images")
+
+        computed = 0
+        in_flight = None
+        # Spawned workers don't inherit the server's threads and locks
+        with ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn')) as hashers:
+            for start in range(0, len(pending), HASH_BATCH_SIZE):
+                if progress:
+                    progress.check_cancelled()
+                batch = pending[start:start + HASH_BATCH_SIZE]
+                thumbnails = generate_thumbnails([row[0] for row in batch], max_size=Config.THUMB_MAX_SIZE, progress=progress)
+                blobs = [_read_thumbnail(thumbnails.get(row[0])) for row in batch]
+                future = hashers.submit(dhash_jpegs, blobs)
+                # Store the previous batch while this one hashes and the next one downloads
+                if in_flight:
+                    computed += _store_hashes(conn, in_flight[0], in_flight[1].result())
+                in_flight = (batch, future)
+            if in_flight:
+                computed += _store_hashes(conn, in_flight[0], in_flight[1].result())
+        return computed
+    finally:
+        conn.close()
+
+def find_similar_pairs(backup_root: str, sorted_root: str, max_distance: int) -> List[Tuple[str, str, int]]:
+    """
+    Find (backup_path, sorted_path, distance) pairs whose dHashes are within max_distance bits.
+    Each backup image probes the sorted side's band indexes instead of scanning every hash.
+    """
+    radius = max_distance // BANDS
+    pairs: List[Tuple[str, str, int]] = []
+    conn = connect()
+    try:
+        backup_hashes = conn.execute("""
+            SELECT p.path, p.dhash FROM perceptual_hashes p
+            JOIN remote_files f ON f.root = ? AND f.path = p.path
+            WHERE p.size = f.size AND p.mtime = f.mtime
+        """, (backup_root,)).fetchall()
+
+        for backup_path, signed_hash in backup_hashes:
+            value = _to_unsigned(signed_hash)
+            clauses = []
+            params: List = []
+            for i, band in enumerate(_bands(value)):
+                neighbours = _band_neighbours(band, radius)
+                clauses.append(f"p.band{i} IN ({','.join('?' * len(neighbours))})")
+                params.extend(neighbours)
+            params.append(sorted_root)
+            candidates = conn.execute(f"""
+                SELECT p.path, p.dhash FROM perceptual_hashes p
+                WHERE ({' OR '.join(clauses)})
+                  AND EXISTS (
+                      SELECT 1 FROM remote_files f
+                      WHERE f.root = ? AND f.path = p.path AND f.size = p.size AND f.mtime = p.mtime
+                  )
+            """, params).fetchall()
+
+            for sorted_path, candidate in candidates:
+                distance = hamming_distance(value, _to_unsigned(candidate))
+                if distance <= max_distance:
+                    pairs.append((backup_path, sorted_path, distance))
+        return pairs
+    finally:
+        conn.close()
+
+def add_similar_pairs(scan_session_id: str, backup_root: str, sorted_root: str, progress: Optional[ScanProgress] = None) -> Dict[str, int]:
+    """
+    Hash any new images under both roots, then add a 'similar' group for each backup image
+    not already grouped in the session, holding the sorted images near it. Each sorted member
+    records its distance from the backup image. Previously ignored pairs stay ignored.
+    Returns counts of hashes computed, groups and pairs added.
+    """
+    if progress:
+        progress.set_phase('hashing_images')
+    computed = update_perceptual_hashes([backup_root, sorted_root], progress)
+
+    if progress:
+        progress.check_cancelled()
+        progress.set_phase('matching_similar')
+    similar = find_similar_pairs(backup_root, sorted_root, Config.PHASH_MAX_DISTANCE)
+
+    conn = connect()
+    try:
+        conn.execute("CREATE TEMP TABLE similar_pairs (backup_path TEXT, sorted_path TEXT, distance INTEGER)")
+        conn.executemany("INSERT INTO similar_pairs VALUES (?, ?, ?)", similar)
+        conn.execute("CREATE INDEX temp.idx_similar_pairs ON similar_pairs(backup_path)")
+        # Each backup file is reviewed once per session, in the group it was first found in
+        conn.execute("""
+            DELETE FROM similar_pairs
+            WHERE backup_path IN (
+                SELECT path FROM group_members WHERE scan_session_id = ? AND role = ?
+            )
+        """, (scan_session_id, ROLE_BACKUP))
+
+        first_new_group = conn.execute("SELECT COALESCE(MAX(id), 0) FROM duplicate_groups").fetchone()[0]
+        groups = conn.execute("""
+            INSERT INTO duplicate_groups (scan_session_id, group_key, match_type, created_at)
+            SELECT DISTINCT ?, 'similar:' || backup_path, ?, ?
+            FROM similar_pairs
+            ORDER BY backup_path
+        """, (scan_session_id, MATCH_TYPE_SIMILAR, datetime.now().isoformat())).rowcount
+        conn.execute("""
+            INSERT INTO group_members (group_id, scan_session_id, role, path)
+            SELECT id, scan_session_id, ?, substr(group_key, 9)
+            FROM duplicate_groups
+            WHERE scan_session_id = ? AND id > ?
+        """, (ROLE_BACKUP, scan_session_id, first_new_group))
+        added = conn.execute("""
+            INSERT INTO group_members (group_id, scan_session_id, role, path, match_distance)
+            SELECT g.id, g.scan_session_id, ?, sp.sorted_path, sp.distance
+            FROM duplicate_groups g
+            JOIN similar_pairs sp ON sp.backup_path = substr(g.group_key, 9)
+            WHERE g.scan_session_id = ? AND g.id > ?
+            ORDER BY g.id, sp.distance, sp.sorted_path
+        """, (ROLE_SORTED, scan_session_id, first_new_group)).rowcount
+
+        apply_ignored_pairs(conn, scan_session_id)
+        refresh_session_counts(conn, scan_session_id)
+        conn.commit()
+    finally:
+        conn.close()
+
+    logger.info(f"Added {groups} near-duplicate groups ({added} pairs) to session {scan_session_id} ({computed} hashes computed)")
+    return {'hashes_computed': computed, 'similar_groups': groups, 'similar_pairs': added}
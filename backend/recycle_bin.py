@@ -47,14 +47,14 @@ def move_to_recycle_bin(file_path: str, recycle_bin_path: str) -> Tuple[bool, Op
         
         # Create directory if it doesn't exist
         mkdir_cmd = f'mkdir -p "{recycle_dir}"'
-        success, _, error = SSHClient.run_command(mkdir_cmd)
+        success, _, error = SSHClient.run_command(mkdir_cmd, own_channel=True)
         if not success:
             return False, None, f"Failed to create recycle directory: {error}"
         
         # Move file to recycle bin
         new_location = os.path.join(recycle_dir, file_name)
         mv_cmd = f'mv "{file_path}" "{new_location}"'
-        success, _, error = SSHClient.run_command(mv_cmd)
+        success, _, error = SSHClient.run_command(mv_cmd, own_channel=True)
         
         if not success:
             return False, None, f"Failed to move file: {error}"
@@ -78,13 +78,13 @@ def restore_from_recycle_bin(recycle_location: str, original_path: str) -> Tuple
         # Ensure the original directory exists
         original_dir = os.path.dirname(original_path)
         mkdir_cmd = f'mkdir -p "{original_dir}"'
-        success, _, error = SSHClient.run_command(mkdir_cmd)
+        success, _, error = SSHClient.run_command(mkdir_cmd, own_channel=True)
         if not success:
             return False, f"Failed to create original directory: {error}"
         
         # Move file back to original location
         mv_cmd = f'mv "{recycle_location}" "{original_path}"'
-        success, _, error = SSHClient.run_command(mv_cmd)
+        success, _, error = SSHClient.run_command(mv_cmd, own_channel=True)
         
         if not success:
             return False, f"Failed to restore file: {error}"
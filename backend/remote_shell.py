@@ -0,0 +1,231 @@
+import itertools
+import time
+import threading
+import logging
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Dict, List, Optional, Tuple
+import paramiko
+from backend.ssh_pool import SSHPool
+
+logger = logging.getLogger(__name__)
+
+# How long to wait for a new session to report that it is ready
+START_TIMEOUT_SECONDS = 15
+
+# How long a command may wait behind earlier ones before its caller gives up on it. Its own
+# timeout only starts once it runs.
+QUEUE_TIMEOUT_SECONDS = 60
+
+# Sent to `sh -s` when a session starts. Each request is then one line, `__run <id> '<command>'`.
+# The command runs in a background subshell with stdin from /dev/null, so it can neither read
+# the requests queued behind it nor change the session, and its output goes to files. When it
+# starts, `S <id> <pid>` is sent, so it can be timed from then and killed alone if it hangs.
+# The result comes back as `R <id> <exit status> <stdout bytes> <stderr bytes>` followed by
+# the raw output. The shell's own stderr is discarded, since nothing reads it.
+_SESSION_SETUP = r'''
+exec 2>/dev/null
+d=$(mktemp -d) || exit 1
+trap 'rm -rf "$d"' EXIT
+trap 'exit 1' HUP TERM PIPE
+__run() {
+    ( eval "$2" ) </dev/null >"$d/o" 2>"$d/e" &
+    p=$!
+    printf 'S %s %s\n' "$1" "$p"
+    wait "$p"
+    s=$?
+    printf 'R %s %s %s %s\n' "$1" "$s" "$(wc -c <"$d/o")" "$(wc -c <"$d/e")"
+    cat "$d/o" "$d/e"
+}
+printf 'ready\n'
+'''
+
+class ShellSessionLost(ConnectionError):
+    """The session ended after a command was sent, so whether it ran is unknown."""
+
+def _quote(command: str) -> str:
+    return "'" + command.replace("'", "'\\''") + "'"
+
+class ShellCommand:
+    """A command sent to the session: its result future, and when and as which process it started."""
+
+    def __init__(self, request_id: int):
+        self.request_id = request_id
+        self.future: Future = Future()
+        self.started = threading.Event()
+        self.started_at = 0.0
+        self.pid: Optional[int] = None
+
+class RemoteShell:
+    """
+    One long-lived shell on the NAS that runs small commands sent over a single channel, so
+    each costs a round trip instead of a new channel and shell. Requests carry IDs and may be
+    sent before earlier ones finish; the shell runs them in order. A command that hangs is
+    killed on its own, so the ones queued behind it still run. The session is started on
+    first use and again after it ends. Its channel is held from the connection pool.
+    Commands sent to a session that is lost fail without knowing whether they ran, so
+    commands that change files on the NAS should not be sent here.
+    """
+
+    def __init__(self, pool: SSHPool):
+        self._pool = pool
+        self._channel: Optional[paramiko.Channel] = None
+        self._pending: Dict[int, ShellCommand] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stats = {'sessions': 0, 'commands': 0, 'max_pipelined': 0, 'timeouts': 0, 'queue_timeouts': 0,
+                       'killed': 0, 'lost': 0}
+
+    def _ensure_started(self):
+        with self._start_lock:
+            with self._lock:
+                if self._channel is not None and not self._channel.closed:
+                    return
+            ready = threading.Event()
+            failure: List[Exception] = []
+            threading.Thread(target=self._serve, args=(ready, failure), daemon=True, name='remote-shell').start()
+            if not ready.wait(START_TIMEOUT_SECONDS):
+                raise ConnectionError("Remote shell did not start in time")
+            if failure:
+                raise ConnectionError(f"Could not start remote shell: {failure[0]}")
+
+    def _serve(self, ready: threading.Event, failure: List[Exception]):
+        """Run one session: start the shell, then read results until the channel closes."""
+        channel = None
+        pending: Dict[int, ShellCommand] = {}
+        try:
+            with self._pool.connection() as connection:
+                channel = connection.transport.open_session()
+                channel.exec_command('sh -s')
+                stdout = channel.makefile('rb')
+                channel.sendall(_SESSION_SETUP.encode('utf-8'))
+                if stdout.readline() != b'ready\n':
+                    raise ConnectionError("unexpected response from sh")
+                # Each session has its own pending requests, so a session ending doesn't touch the next one's
+                with self._lock:
+                    self._channel, self._pending = channel, pending
+                    self._stats['sessions'] += 1
+                ready.set()
+                logger.info("Remote shell session started")
+                self._read_results(stdout, pending)
+        except Exception as e:
+            if not ready.is_set():
+                failure.append(e)
+            else:
+                logger.warning(f"Remote shell session ended: {e}")
+        finally:
+            if channel is not None:
+                channel.close()
+            with self._lock:
+                if self._channel is channel:
+                    self._channel = None
+                lost = list(pending.values())
+                pending.clear()
+                self._stats['lost'] += len(lost)
+            for command in lost:
+                command.future.set_exception(ShellSessionLost("Remote shell session was lost"))
+            ready.set()
+
+    def _read_results(self, stdout, pending: Dict[int, ShellCommand]):
+        while True:
+            header = stdout.readline()
+            if not header:
+                return
+            kind, request_id, *fields = header.split()
+            with self._lock:
+                command = pending.get(int(request_id))
+                if kind == b'R':
+                    pending.pop(int(request_id), None)
+            if kind == b'S':
+                if command is not None:
+                    command.pid, command.started_at = int(fields[0]), time.monotonic()
+                    command.started.set()
+                continue
+            status, out_bytes, err_bytes = (int(field) for field in fields)
+            out = stdout.read(out_bytes) if out_bytes else b''
+            err = stdout.read(err_bytes) if err_bytes else b''
+            if command is not None:
+                command.future.set_result((status, out.decode('utf-8', errors='replace'),
+                                           err.decode('utf-8', errors='replace')))
+
+    def submit(self, command: str) -> ShellCommand:
+        """
+        Send a command without waiting for it; its future gives (exit status, stdout, stderr).
+        Raises ConnectionError if the session can't be started or written to, in which case
+        the command was not run.
+        """
+        self._ensure_started()
+        with self._lock:
+            channel, pending = self._channel, self._pending
+            if channel is None or channel.closed:
+                raise ConnectionError("Remote shell is not running")
+            sent = ShellCommand(next(self._ids))
+            pending[sent.request_id] = sent
+            self._stats['commands'] += 1
+            self._stats['max_pipelined'] = max(self._stats['max_pipelined'], len(self._pending))
+        try:
+            with self._send_lock:
+                channel.sendall(f"__run {sent.request_id} {_quote(command)}\n".encode('utf-8', errors='surrogateescape'))
+        except Exception as e:
+            with self._lock:
+                pending.pop(sent.request_id, None)
+            raise ConnectionError(f"Could not send to remote shell: {e}")
+        return sent
+
+    def wait(self, command: ShellCommand, timeout: float = 30) -> Tuple[bool, Optional[str], Optional[str]]:
+        """
+        (success, stdout, stderr) of a submitted command, like SSHClient.run_command's. The
+        timeout counts from when the command started running, not from when it was queued.
+        """
+        try:
+            if not command.started.wait(QUEUE_TIMEOUT_SECONDS) and not command.future.done():
+                with self._lock:
+                    self._stats['queue_timeouts'] += 1
+                return False, None, f"Command was still queued after {QUEUE_TIMEOUT_SECONDS}s"
+            remaining = timeout - (time.monotonic() - command.started_at) if command.started.is_set() else timeout
+            status, out, err = command.future.result(max(remaining, 0))
+        except FutureTimeoutError:
+            with self._lock:
+                self._stats['timeouts'] += 1
+            self._kill(command)
+            return False, None, f"Command timed out after {timeout}s"
+        except ShellSessionLost as e:
+            return False, None, str(e)
+        if status == 0:
+            return True, out, None
+        return False, out, err or "Command failed"
+
+    def _kill(self, command: ShellCommand):
+        """
+        Stop a command that hung, and what it started, over a channel of its own, so the
+        session and the commands queued behind it carry on. If that fails, the session is
+        ended instead, as nothing else would unblock it.
+        """
+        if command.future.done():
+            return
+        try:
+            with self._pool.connection() as connection:
+                _, stdout, _ = connection.client.exec_command(
+                    f"pkill -TERM -P {command.pid}; kill -TERM {command.pid}", timeout=START_TIMEOUT_SECONDS)
+                stdout.channel.recv_exit_status()
+            with self._lock:
+                self._stats['killed'] += 1
+        except Exception as e:
+            logger.warning(f"Could not stop hung remote shell command, restarting the session: {e}")
+            self.close()
+
+    def run(self, command: str, timeout: float = 30) -> Tuple[bool, Optional[str], Optional[str]]:
+        """Run a command in the session and return (success, stdout, stderr)."""
+        return self.wait(self.submit(command), timeout)
+
+    def close(self):
+        """End the session; the next command starts a new one."""
+        with self._lock:
+            channel, self._channel = self._channel, None
+        if channel is not None:
+            channel.close()
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {'running': self._channel is not None, 'pipelined': len(self._pending), **self._stats}
@@ -1,34 +1,38 @@
-import os
-import sqlite3
 from datetime import datetime
-from typing import Optional, Tuple, Dict
+from typing import Optional, Tuple, Dict, List
 import logging
-from backend.config import Config
+from backend.db import get_connection
 from backend.recycle_bin import detect_recycle_bin, move_to_recycle_bin, restore_from_recycle_bin
+from backend.thumbnail_cache import remove_for_paths
+from backend.content_hash import move_hashes
+from backend.duplicate_scanner import ROLE_BACKUP, ROLE_SORTED, REVIEW_STATS_SQL
 
 logger = logging.getLogger(__name__)
 
 def ignore_duplicate(review_id: int, backup_path: str, sorted_path: str) -> Tuple[bool, Optional[str]]:
     """
-    Mark a duplicate pair as ignored. This persists across sessions.
+    Mark a backup member as ignored. Every pair it forms in its group is recorded in
+    ignored_pairs, so it stays ignored in later sessions until a new partner appears.
     """
-    db_path = os.path.join(Config.LOCAL_STATE_DIR, "state.db")
-    conn = sqlite3.connect(db_path)
+    conn = get_connection()
     cursor = conn.cursor()
     
     try:
         # Mark as reviewed with action 'ignored'
         cursor.execute("""
-            UPDATE review_queue 
+            UPDATE group_members 
             SET reviewed = 1, action = 'ignored'
             WHERE id = ?
         """, (review_id,))
         
-        # Add to ignored_pairs table for persistence
+        # Add every pair of the member to ignored_pairs for persistence
         cursor.execute("""
             INSERT OR IGNORE INTO ignored_pairs (backup_path, sorted_path, ignored_at)
-            VALUES (?, ?, ?)
-        """, (backup_path, sorted_path, datetime.now().isoformat()))
+            SELECT b.path, s.path, ?
+            FROM group_members b
+            JOIN group_members s ON s.group_id = b.group_id AND s.role = ?
+            WHERE b.id = ?
+        """, (datetime.now().isoformat(), ROLE_SORTED, review_id))
         
         conn.commit()
         logger.info(f"Ignored duplicate: {backup_path}")
@@ -38,30 +42,31 @@ def ignore_duplicate(review_id: int, backup_path: str, sorted_path: str) -> Tupl
         conn.rollback()
         logger.exception(f"Error ignoring duplicate: {e}")
         return False, str(e)
-    finally:
-        conn.close()
 
 def unignore_duplicate(review_id: int, backup_path: str, sorted_path: str) -> Tuple[bool, Optional[str]]:
     """
-    Unignore a previously ignored duplicate pair, returning it to the review queue.
+    Unignore a previously ignored backup member, returning its pairs to the review queue.
     """
-    db_path = os.path.join(Config.LOCAL_STATE_DIR, "state.db")
-    conn = sqlite3.connect(db_path)
+    conn = get_connection()
     cursor = conn.cursor()
     
     try:
         # Mark as not reviewed
         cursor.execute("""
-            UPDATE review_queue 
+            UPDATE group_members 
             SET reviewed = 0, action = NULL
             WHERE id = ?
         """, (review_id,))
         
-        # Remove from ignored_pairs table
+        # Remove the member's pairs from ignored_pairs table
         cursor.execute("""
             DELETE FROM ignored_pairs 
-            WHERE backup_path = ? AND sorted_path = ?
-        """, (backup_path, sorted_path))
+            WHERE backup_path = ? AND sorted_path IN (
+                SELECT s.path FROM group_members b
+                JOIN group_members s ON s.group_id = b.group_id AND s.role = ?
+                WHERE b.id = ?
+            )
+        """, (backup_path, ROLE_SORTED, review_id))
         
         conn.commit()
         logger.info(f"Unignored duplicate: {backup_path}")
@@ -71,16 +76,14 @@ def unignore_duplicate(review_id: int, backup_path: str, sorted_path: str) -> Tu
         conn.rollback()
         logger.exception(f"Error unignoring duplicate: {e}")
         return False, str(e)
-    finally:
-        conn.close()
 
 def delete_duplicate(review_id: int, backup_path: str, session_id: str, recycle_bin_path: Optional[str] = None) -> Tuple[bool, Optional[str], Optional[Dict]]:
     """
-    Delete a duplicate by moving it to the recycle bin.
+    Delete a backup file by moving it to the recycle bin.
+    Every backup member for that file in the session is marked deleted.
     Returns (success, error_message, undo_info)
     """
-    db_path = os.path.join(Config.LOCAL_STATE_DIR, "state.db")
-    conn = sqlite3.connect(db_path)
+    conn = get_connection()
     cursor = conn.cursor()
     
     try:
@@ -101,12 +104,13 @@ def delete_duplicate(review_id: int, backup_path: str, session_id: str, recycle_
         if not success:
             return False, error, None
         
-        # Update review queue
+        # Update review state of the file's members
         cursor.execute("""
-            UPDATE review_queue 
+            UPDATE group_members 
             SET reviewed = 1, action = 'deleted'
-            WHERE id = ?
-        """, (review_id,))
+            WHERE scan_session_id = (SELECT scan_session_id FROM group_members WHERE id = ?)
+              AND role = ? AND path = ?
+        """, (review_id, ROLE_BACKUP, backup_path))
         
         # Add to undo stack
         cursor.execute("""
@@ -117,10 +121,19 @@ def delete_duplicate(review_id: int, backup_path: str, session_id: str, recycle_
         
         undo_id = cursor.lastrowid
         
+        # Known hashes follow the file, so its content-addressed thumbnail stays usable
+        move_hashes(conn, backup_path, recycle_location)
+        
         conn.commit()
         
         logger.info(f"Deleted duplicate: {backup_path} -> {recycle_location}")
         
+        # Thumbnails keyed by the old path are useless now; content-addressed ones are kept
+        try:
+            remove_for_paths([backup_path])
+        except Exception as e:
+            logger.warning(f"Could not drop cached thumbnails of {backup_path}: {e}")
+        
         return True, None, {
             'undo_id': undo_id,
             'review_id': review_id,
@@ -132,16 +145,13 @@ def delete_duplicate(review_id: int, backup_path: str, session_id: str, recycle_
         conn.rollback()
         logger.exception(f"Error deleting duplicate: {e}")
         return False, str(e), None
-    finally:
-        conn.close()
 
 def undo_last_action(session_id: str) -> Tuple[bool, Optional[str], Optional[str]]:
     """
     Undo the last action in the current session.
     Returns (success, error_message, action_type)
     """
-    db_path = os.path.join(Config.LOCAL_STATE_DIR, "state.db")
-    conn = sqlite3.connect(db_path)
+    conn = get_connection()
     cursor = conn.cursor()
     
     try:
@@ -166,12 +176,16 @@ def undo_last_action(session_id: str) -> Tuple[bool, Optional[str], Optional[str
             if not success:
                 return False, f"Failed to restore file: {error}", None
         
-        # Restore review queue state
+        # Restore review state of the file's members
         cursor.execute("""
-            UPDATE review_queue
+            UPDATE group_members
             SET reviewed = ?, action = ?
-            WHERE id = ?
-        """, (prev_reviewed, prev_action, review_id))
+            WHERE scan_session_id = (SELECT scan_session_id FROM group_members WHERE id = ?)
+              AND role = ? AND path = ? AND action = 'deleted'
+        """, (prev_reviewed, prev_action, review_id, ROLE_BACKUP, backup_path))
+        
+        if recycle_location:
+            move_hashes(conn, recycle_location, original_location)
         
         # Remove from undo stack
         cursor.execute("DELETE FROM undo_stack WHERE id = ?", (undo_id,))
@@ -185,55 +199,71 @@ def undo_last_action(session_id: str) -> Tuple[bool, Optional[str], Optional[str
         conn.rollback()
         logger.exception(f"Error undoing action: {e}")
         return False, str(e), None
-    finally:
-        conn.close()
+
+_STATS_COLUMNS = ('total', 'reviewed', 'deleted', 'ignored', 'reclaimable_bytes', 'reclaimed_bytes')
 
 def get_review_stats(scan_session_id: str) -> Dict:
     """
-    Get statistics for a review session.
+    Get statistics for a review session, counted per backup member.
+    Reads the session's maintained counters rather than counting its members.
+    Bytes cover members whose size is known (verified or content-matched).
     """
-    db_path = os.path.join(Config.LOCAL_STATE_DIR, "state.db")
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    cursor = get_connection().cursor()
+    cursor.execute(f"""
+        SELECT {', '.join(_STATS_COLUMNS)}
+        FROM review_stats
+        WHERE scan_session_id = ?
+    """, (scan_session_id,))
+    total, reviewed, deleted, ignored, reclaimable_bytes, reclaimed_bytes = cursor.fetchone() or (0,) * len(_STATS_COLUMNS)
     
+    return {
+        'total': total,
+        'reviewed': reviewed,
+        'remaining': total - reviewed,
+        'deleted': deleted,
+        'ignored': ignored,
+        'completed': reviewed == total,
+        'reclaimable_bytes': reclaimable_bytes,
+        'reclaimed_bytes': reclaimed_bytes
+    }
+
+def check_review_stats(scan_session_id: Optional[str] = None, rebuild: bool = False) -> Dict:
+    """
+    Compare maintained review counters with a fresh count of group_members, for one
+    session or all of them. With rebuild, counters that drifted are replaced by the count.
+    Returns the number of sessions checked and the ids of those that didn't match.
+    """
+    conn = get_connection()
     try:
-        # Total pairs
-        cursor.execute("""
-            SELECT COUNT(*) FROM review_queue
-            WHERE scan_session_id = ?
-        """, (scan_session_id,))
-        total = cursor.fetchone()[0]
-        
-        # Reviewed pairs
-        cursor.execute("""
-            SELECT COUNT(*) FROM review_queue
-            WHERE scan_session_id = ? AND reviewed = 1
-        """, (scan_session_id,))
-        reviewed = cursor.fetchone()[0]
+        query = REVIEW_STATS_SQL
+        params: List = []
+        if scan_session_id:
+            query += " AND scan_session_id = ?"
+            params.append(scan_session_id)
+        counted = {row[0]: tuple(row[1:]) for row in conn.execute(query + " GROUP BY scan_session_id", params)}
         
-        # Deleted pairs
-        cursor.execute("""
-            SELECT COUNT(*) FROM review_queue
-            WHERE scan_session_id = ? AND action = 'deleted'
-        """, (scan_session_id,))
-        deleted = cursor.fetchone()[0]
+        query = f"SELECT scan_session_id, {', '.join(_STATS_COLUMNS)} FROM review_stats"
+        if scan_session_id:
+            query += " WHERE scan_session_id = ?"
+        stored = {row[0]: tuple(row[1:]) for row in conn.execute(query, params)}
         
-        # Ignored pairs
-        cursor.execute("""
-            SELECT COUNT(*) FROM review_queue
-            WHERE scan_session_id = ? AND action = 'ignored'
-        """, (scan_session_id,))
-        ignored = cursor.fetchone()[0]
+        mismatched = sorted(sid for sid in counted.keys() | stored.keys() if counted.get(sid) != stored.get(sid))
+        if rebuild and mismatched:
+            placeholders = ','.join('?' * len(mismatched))
+            conn.execute(f"DELETE FROM review_stats WHERE scan_session_id IN ({placeholders})", mismatched)
+            conn.execute(f"""
+                INSERT INTO review_stats
+                {REVIEW_STATS_SQL} AND scan_session_id IN ({placeholders})
+                GROUP BY scan_session_id
+            """, mismatched)
+            conn.commit()
+            logger.warning(f"Rebuilt review stats for {len(mismatched)} sessions")
         
         return {
-            'total': total,
-            'reviewed': reviewed,
-            'remaining': total - reviewed,
-            'deleted': deleted,
-            'ignored': ignored,
-            'completed': reviewed == total
+            'checked': len(counted.keys() | stored.keys()),
+            'mismatched': mismatched,
+            'rebuilt': rebuild and bool(mismatched)
         }
-        
-    finally:
-        conn.close()
-
+    except Exception:
+        conn.rollback()
+        raise
@@ -0,0 +1,275 @@
+import json
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from backend.db import get_connection
+from backend.ssh_client import SSHClient
+from backend.config import Config
+from backend.duplicate_scanner import find_duplicates, save_duplicates_to_db, iter_duplicate_pages
+from backend.file_index import incremental_scan, refresh_roots
+from backend.content_hash import verify_session
+from backend.perceptual_hash import add_similar_pairs
+from backend.content_match import add_content_pairs
+from backend.thumbnail_service import generate_thumbnails
+from backend.path_utils import is_subpath
+from backend.scan_progress import ScanProgress, ScanCancelled
+
+logger = logging.getLogger(__name__)
+
+JOB_TYPE_SCAN = 'scan'
+JOB_TYPE_THUMBNAILS = 'thumbnails'
+ACTIVE_STATUSES = ('queued', 'running')
+
+# Images handed to the thumbnail generator at a time by warm-up jobs
+THUMBNAIL_WARM_CHUNK = 1024
+
+# Scans share the SSH connection and hammer the same disks, so they run one at a time.
+# Additional scans wait in the executor queue instead of blocking the API.
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='scan-job')
+
+# Live progress for queued/running jobs, keyed by job id
+_active_jobs: Dict[int, ScanProgress] = {}
+_active_lock = threading.Lock()
+
+def _update_job(job_id: int, status: str, progress: Optional[Dict] = None, result: Optional[Dict] = None, error: Optional[str] = None):
+    conn = get_connection()
+    conn.execute("""
+        UPDATE jobs
+        SET status = ?, progress = ?, result = ?, error = ?, updated_at = ?
+        WHERE id = ?
+    """, (
+        status,
+        json.dumps(progress) if progress is not None else None,
+        json.dumps(result) if result is not None else None,
+        error,
+        datetime.now().isoformat(),
+        job_id
+    ))
+    conn.commit()
+
+def _row_to_job(row: tuple) -> Dict:
+    job_id, job_type, created_at, updated_at, src_path, dst_path, status, error, progress, result = row
+    job = {
+        'id': job_id,
+        'type': job_type,
+        'status': status,
+        'created_at': created_at,
+        'updated_at': updated_at,
+        'backup_path': src_path,
+        'sorted_path': dst_path,
+        'progress': json.loads(progress) if progress else None,
+        'result': json.loads(result) if result else None,
+        'error': error
+    }
+    # Running jobs report live counters rather than the last persisted snapshot
+    with _active_lock:
+        live = _active_jobs.get(job_id)
+    if live and status in ACTIVE_STATUSES:
+        job['progress'] = live.snapshot()
+    return job
+
+_JOB_COLUMNS = "id, type, created_at, updated_at, src_path, dst_path, status, error, progress, result"
+
+def _submit_job(job_type: str, src_path: str, dst_path: str, run, *args) -> int:
+    """Record a job in the jobs table and queue run(job_id, *args, progress) on the background worker."""
+    timestamp = datetime.now().isoformat()
+    progress = ScanProgress()
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO jobs (created_at, type, src_path, dst_path, status, progress, updated_at)
+        VALUES (?, ?, ?, ?, 'queued', ?, ?)
+    """, (timestamp, job_type, src_path, dst_path, json.dumps(progress.snapshot()), timestamp))
+    job_id = cursor.lastrowid
+    conn.commit()
+
+    with _active_lock:
+        _active_jobs[job_id] = progress
+    _executor.submit(run, job_id, *args, progress)
+    return job_id
+
+def submit_scan_job(backup_path: str, sorted_path: str, incremental: bool = True, verify: bool = False, similar: bool = False, content: bool = False) -> int:
+    """
+    Record a scan in the jobs table and queue it on the background worker.
+    Incremental scans work from the persistent file index; otherwise both trees are
+    walked and joined in full. With content, identical files are also paired regardless
+    of name; with similar, near-duplicates found by perceptual hash are added as well.
+    With verify, remaining pairs are then checked by content hash.
+    Returns the job id immediately.
+    """
+    job_id = _submit_job(JOB_TYPE_SCAN, backup_path, sorted_path, _run_scan_job,
+                         backup_path, sorted_path, incremental, verify, similar, content)
+    logger.info(f"Queued scan job {job_id}: backup={backup_path}, sorted={sorted_path}")
+    return job_id
+
+def _run_scan_job(job_id: int, backup_path: str, sorted_path: str, incremental: bool, verify: bool, similar: bool, content: bool, progress: ScanProgress):
+    try:
+        if progress.cancel_requested:
+            raise ScanCancelled()
+
+        progress.set_phase('connecting')
+        _update_job(job_id, 'running', progress=progress.snapshot())
+
+        if not SSHClient.is_connected():
+            success, error = SSHClient.connect()
+            if not success:
+                raise RuntimeError(f"SSH connection failed: {error}")
+
+        if incremental:
+            scan_session_id, summary = incremental_scan(backup_path, sorted_path, progress)
+        else:
+            groups = find_duplicates(backup_path, sorted_path, progress)
+
+            progress.check_cancelled()
+            progress.set_phase('saving')
+            scan_session_id, ingest = save_duplicates_to_db(groups, backup_path, sorted_path)
+            if not scan_session_id:
+                raise RuntimeError("Failed to save duplicates to database")
+            summary = {
+                'duplicate_count': sum(len(g['backup_paths']) * len(g['sorted_paths']) for g in groups),
+                'group_count': len(groups),
+                'ingest': ingest
+            }
+
+        if (content or similar) and not incremental:
+            # Content and near-duplicate matching work from the file index, which full scans don't refresh
+            exclude_from_sorted = backup_path if is_subpath(backup_path, sorted_path) else None
+            progress.set_phase('indexing')
+            refresh_roots([(backup_path, None), (sorted_path, exclude_from_sorted)], progress)
+
+        if content:
+            summary.update(add_content_pairs(scan_session_id, backup_path, sorted_path, progress))
+
+        if similar:
+            summary.update(add_similar_pairs(scan_session_id, backup_path, sorted_path, progress))
+
+        if verify:
+            progress.set_phase('verifying')
+            summary['verification'] = verify_session(scan_session_id, progress)
+
+        progress.set_phase('done')
+        _update_job(job_id, 'completed', progress=progress.snapshot(), result={
+            'scan_session_id': scan_session_id,
+            'incremental': incremental,
+            **summary,
+            'root_timings': progress.snapshot()['roots']
+        })
+        logger.info(f"Scan job {job_id} completed: {summary['duplicate_count']} pairs, session {scan_session_id}")
+
+    except ScanCancelled:
+        progress.set_phase('cancelled')
+        _update_job(job_id, 'cancelled', progress=progress.snapshot())
+        logger.info(f"Scan job {job_id} cancelled")
+    except Exception as e:
+        logger.exception(f"Scan job {job_id} failed")
+        _update_job(job_id, 'failed', progress=progress.snapshot(), error=str(e))
+    finally:
+        with _active_lock:
+            _active_jobs.pop(job_id, None)
+
+def submit_thumbnail_job(scan_session_id: str) -> Optional[int]:
+    """
+    Queue a job that generates thumbnails for every unreviewed pair of a scan session, so
+    review never waits on the NAS. Runs on the same worker as scans.
+    Returns the job id immediately, or None if the session doesn't exist.
+    """
+    row = get_connection().execute(
+        "SELECT backup_path, sorted_path FROM scan_sessions WHERE id = ?", (scan_session_id,)
+    ).fetchone()
+    if not row:
+        return None
+    job_id = _submit_job(JOB_TYPE_THUMBNAILS, row[0], row[1], _run_thumbnail_job, scan_session_id)
+    logger.info(f"Queued thumbnail job {job_id} for session {scan_session_id}")
+    return job_id
+
+def _run_thumbnail_job(job_id: int, scan_session_id: str, progress: ScanProgress):
+    try:
+        progress.check_cancelled()
+        progress.set_phase('thumbnails')
+        _update_job(job_id, 'running', progress=progress.snapshot())
+
+        images = 0
+        chunk: Dict[str, None] = {}
+        for pairs in iter_duplicate_pages(scan_session_id):
+            for pair in pairs:
+                chunk[pair['backup_path']] = None
+                chunk[pair['sorted_path']] = None
+            if len(chunk) >= THUMBNAIL_WARM_CHUNK:
+                generate_thumbnails(list(chunk), max_size=Config.THUMB_MAX_SIZE, progress=progress)
+                images += len(chunk)
+                chunk = {}
+        if chunk:
+            generate_thumbnails(list(chunk), max_size=Config.THUMB_MAX_SIZE, progress=progress)
+            images += len(chunk)
+
+        progress.set_phase('done')
+        snapshot = progress.snapshot()
+        _update_job(job_id, 'completed', progress=snapshot, result={
+            'scan_session_id': scan_session_id,
+            'images': images,
+            'thumbnails_generated': snapshot['thumbnails_generated'],
+            'thumbnails_failed': snapshot['thumbnails_failed']
+        })
+        logger.info(f"Thumbnail job {job_id} completed: {snapshot['thumbnails_generated']} generated for {images} images")
+
+    except ScanCancelled:
+        progress.set_phase('cancelled')
+        _update_job(job_id, 'cancelled', progress=progress.snapshot())
+        logger.info(f"Thumbnail job {job_id} cancelled")
+    except Exception as e:
+        logger.exception(f"Thumbnail job {job_id} failed")
+        _update_job(job_id, 'failed', progress=progress.snapshot(), error=str(e))
+    finally:
+        with _active_lock:
+            _active_jobs.pop(job_id, None)
+
+def get_job(job_id: int) -> Optional[Dict]:
+    """Get a job with its latest progress, or None if it doesn't exist."""
+    conn = get_connection()
+    row = conn.execute(f"SELECT {_JOB_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return _row_to_job(row) if row else None
+
+def list_jobs(limit: int = 20) -> List[Dict]:
+    """List the most recent scan jobs, newest first."""
+    conn = get_connection()
+    rows = conn.execute(f"""
+        SELECT {_JOB_COLUMNS} FROM jobs
+        WHERE type = ?
+        ORDER BY id DESC
+        LIMIT ?
+    """, (JOB_TYPE_SCAN, limit)).fetchall()
+    return [_row_to_job(row) for row in rows]
+
+def cancel_job(job_id: int) -> Tuple[bool, Optional[str]]:
+    """
+    Request cancellation of a queued or running job.
+    The worker stops at its next progress checkpoint.
+    Returns (success, error_message)
+    """
+    with _active_lock:
+        progress = _active_jobs.get(job_id)
+
+    if progress:
+        progress.cancel()
+        logger.info(f"Cancellation requested for scan job {job_id}")
+        return True, None
+
+    job = get_job(job_id)
+    if not job:
+        return False, "Job not found"
+    return False, f"Job is already {job['status']}"
+
+def recover_interrupted_jobs():
+    """Mark jobs left queued/running by a previous process as interrupted."""
+    conn = get_connection()
+    cursor = conn.execute("""
+        UPDATE jobs
+        SET status = 'interrupted', updated_at = ?
+        WHERE status IN ('queued', 'running')
+    """, (datetime.now().isoformat(),))
+    conn.commit()
+    if cursor.rowcount:
+        logger.warning(f"Marked {cursor.rowcount} unfinished jobs as interrupted")
@@ -0,0 +1,80 @@
+import threading
+from typing import Dict, List
+
+class ScanCancelled(Exception):
+    """Raised inside a running scan once cancellation has been requested."""
+
+class ScanProgress:
+    """
+    Thread-safe progress counters for a single scan.
+    The scanner reports into it from the worker thread; the API reads snapshots from it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cancel_event = threading.Event()
+        self.phase = 'queued'
+        self.files_walked = 0
+        self.images_matched = 0
+        self.pairs_found = 0
+        self.pairs_verified = 0
+        self.thumbnails_generated = 0
+        self.thumbnails_failed = 0
+        self.roots: List[Dict] = []
+
+    def set_phase(self, phase: str):
+        with self._lock:
+            self.phase = phase
+
+    def add_files(self, walked: int, matched: int):
+        with self._lock:
+            self.files_walked += walked
+            self.images_matched += matched
+
+    def set_pairs_found(self, count: int):
+        with self._lock:
+            self.pairs_found = count
+
+    def add_pairs_verified(self, count: int):
+        with self._lock:
+            self.pairs_verified += count
+
+    def add_thumbnails(self, generated: int, failed: int):
+        with self._lock:
+            self.thumbnails_generated += generated
+            self.thumbnails_failed += failed
+
+    def record_root(self, path: str, seconds: float, files_walked: int, images_matched: int):
+        """Record how long the walk of one scan root took."""
+        with self._lock:
+            self.roots.append({
+                'path': path,
+                'seconds': round(seconds, 3),
+                'files_walked': files_walked,
+                'images_matched': images_matched,
+            })
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def check_cancelled(self):
+        """Raise ScanCancelled if cancellation has been requested."""
+        if self._cancel_event.is_set():
+            raise ScanCancelled()
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                'phase': self.phase,
+                'files_walked': self.files_walked,
+                'images_matched': self.images_matched,
+                'pairs_found': self.pairs_found,
+                'pairs_verified': self.pairs_verified,
+                'thumbnails_generated': self.thumbnails_generated,
+                'thumbnails_failed': self.thumbnails_failed,
+                'roots': list(self.roots),
+            }
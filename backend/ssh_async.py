@@ -0,0 +1,155 @@
+import asyncio
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, AsyncIterator, Callable, Optional, Tuple
+import paramiko
+from backend.config import Config
+from backend.ssh_client import SSHClient
+from backend.original_service import ORIGINAL_CHUNK_SIZE, ORIGINAL_READ_AHEAD, open_original, read_range
+
+logger = logging.getLogger(__name__)
+
+# Default time limits for awaited NAS work: a single command, a blocking service call (which
+# may run several commands, e.g. generating a thumbnail), and one SFTP read window
+COMMAND_TIMEOUT_SECONDS = 30
+CALL_TIMEOUT_SECONDS = 120
+SFTP_TIMEOUT_SECONDS = 60
+
+# Records a stream reads ahead of its consumer before the remote side is made to wait
+STREAM_BUFFER_RECORDS = 1024
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+def _get_executor() -> ThreadPoolExecutor:
+    """
+    Threads for blocking SSH work, one per channel the connection pool can have open, so
+    queued work waits here rather than tying up the server's general threadpool.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=Config.SSH_POOL_SIZE * Config.SSH_CHANNELS_PER_CONNECTION,
+                thread_name_prefix='ssh')
+        return _executor
+
+def shutdown():
+    """Stop the SSH worker threads once their current work is done."""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+async def call(func: Callable[..., Any], *args, timeout: Optional[float] = CALL_TIMEOUT_SECONDS, **kwargs) -> Any:
+    """
+    Await a blocking function that talks to the NAS, run on an SSH worker thread.
+    Raises asyncio.TimeoutError after `timeout` seconds. On timeout or cancellation the
+    caller moves on at once; work already started finishes in its thread.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(_get_executor(), partial(func, *args, **kwargs))
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        raise asyncio.TimeoutError(f"Timed out after {timeout}s waiting for the NAS") from None
+
+async def connect() -> Tuple[bool, Optional[str]]:
+    if SSHClient.is_connected():
+        return True, None
+    return await call(SSHClient.connect)
+
+async def run(command: str, timeout: float = COMMAND_TIMEOUT_SECONDS) -> Tuple[bool, Optional[str], Optional[str]]:
+    """
+    Run a command like SSHClient.run_command without blocking the event loop. If it takes
+    longer than `timeout` or the caller is cancelled, its channel is closed so it stops too.
+    """
+    channels = []
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(_get_executor(), partial(SSHClient.run_command, command, timeout, channels.append))
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        return False, None, f"Command timed out after {timeout}s"
+    finally:
+        _close_channels(channels)
+
+def _close_channels(channels):
+    for channel in channels:
+        try:
+            channel.close()
+        except Exception:
+            pass
+
+async def stream(command: str, delimiter: bytes = b'\n', stdin_data: Optional[bytes] = None,
+                 idle_timeout: Optional[float] = COMMAND_TIMEOUT_SECONDS) -> AsyncIterator[str]:
+    """
+    Yield a command's stdout records like SSHClient.stream_command. Reading happens on an
+    SSH worker thread at most STREAM_BUFFER_RECORDS ahead of the consumer. Leaving the loop
+    early, or being cancelled, closes the channel and ends the command.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    room = threading.Semaphore(STREAM_BUFFER_RECORDS)
+    stopped = threading.Event()
+    channels = []
+    finished = object()
+
+    def produce():
+        try:
+            for record in SSHClient.stream_command(command, delimiter, idle_timeout=idle_timeout,
+                                                   stdin_data=stdin_data, on_channel=channels.append):
+                room.acquire()
+                if stopped.is_set():
+                    return
+                loop.call_soon_threadsafe(queue.put_nowait, record)
+            item = finished
+        except Exception as e:
+            item = e
+        if not stopped.is_set():
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+
+    loop.run_in_executor(_get_executor(), produce)
+    try:
+        while True:
+            item = await queue.get()
+            if item is finished:
+                return
+            if isinstance(item, Exception):
+                raise item
+            room.release()
+            yield item
+    finally:
+        stopped.set()
+        room.release()
+        _close_channels(channels)
+
+async def sftp_open(remote_path: str, timeout: float = SFTP_TIMEOUT_SECONDS) -> Tuple[paramiko.SFTPFile, int, float]:
+    """Open a remote file as original_service.open_original does. Returns (file, size, mtime)."""
+    return await call(open_original, remote_path, timeout=timeout)
+
+async def sftp_read(remote_file: paramiko.SFTPFile, start: int, length: int,
+                    timeout: float = SFTP_TIMEOUT_SECONDS) -> bytes:
+    """Read length bytes at start of an open remote file with pipelined requests; shorter at EOF."""
+    return await call(read_range, remote_file, start, length, timeout=timeout)
+
+async def iter_sftp_range(remote_file: paramiko.SFTPFile, start: int, end: int) -> AsyncIterator[bytes]:
+    """
+    Yield bytes start..end (inclusive) of an open remote file a read-ahead window at a time,
+    then close it, also when the consumer stops early (e.g. the client disconnects).
+    """
+    window_bytes = ORIGINAL_CHUNK_SIZE * ORIGINAL_READ_AHEAD
+    try:
+        position = start
+        while position <= end:
+            data = await sftp_read(remote_file, position, min(window_bytes, end + 1 - position))
+            if not data:
+                return
+            yield data
+            position += len(data)
+    finally:
+        # Closing waits for the server's reply, so it isn't done on the event loop
+        _get_executor().submit(remote_file.close)
@@ -1,160 +1,228 @@
 import paramiko
-import os
 import logging
-from typing import Optional, Tuple
-from backend.config import Config
+import threading
+from contextlib import contextmanager
+from typing import BinaryIO, Callable, Iterator, List, Optional, Tuple
+from backend.ssh_pool import SSHPool
+from backend.remote_shell import RemoteShell
 
 logger = logging.getLogger(__name__)
 
+def decode_remote(data: bytes) -> str:
+    """
+    Text of NAS output such as file paths. Bytes that aren't UTF-8 (names written by other
+    systems) become surrogates, so encode_remote gives back the exact bytes.
+    """
+    return data.decode('utf-8', errors='surrogateescape')
+
+def encode_remote(text: str) -> bytes:
+    """Bytes to send to the NAS for text from decode_remote, or any command or path."""
+    return text.encode('utf-8', errors='surrogateescape')
+
+def is_valid_utf8(text: str) -> bool:
+    """False for text from decode_remote that held non-UTF-8 bytes, which SQLite can't store."""
+    try:
+        text.encode('utf-8')
+        return True
+    except UnicodeEncodeError:
+        return False
+
+class RemoteCommandError(RuntimeError):
+    """A streamed command exited with an error, so its output may be incomplete."""
+
 class SSHClient:
-    _client: Optional[paramiko.SSHClient] = None
-    _sftp: Optional[paramiko.SFTPClient] = None
+    """
+    Runs commands and SFTP on the NAS over a pool of SSH connections, so concurrent requests
+    and background jobs each get their own channel instead of sharing one transport.
+    """
+    _pool = SSHPool()
+    _shell = RemoteShell(_pool)
     
     @classmethod
     def connect(cls) -> Tuple[bool, Optional[str]]:
-        if cls._client and cls._client.get_transport() and cls._client.get_transport().is_active():
-            return True, None
-        
-        if not Config.NAS_HOST or not Config.NAS_USER:
-            return False, "NAS_HOST and NAS_USER must be configured"
-        
-        try:
-            cls._client = paramiko.SSHClient()
-            cls._client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            
-            kwargs = {
-                'hostname': Config.NAS_HOST,
-                'port': Config.NAS_PORT,
-                'username': Config.NAS_USER,
-                'timeout': 10
-            }
-            
-            if Config.NAS_SSH_KEY_PATH:
-                if not os.path.exists(Config.NAS_SSH_KEY_PATH):
-                    return False, f"SSH key file not found: {Config.NAS_SSH_KEY_PATH}"
-                
-                kwargs['key_filename'] = Config.NAS_SSH_KEY_PATH
-                if Config.NAS_SSH_KEY_PASSPHRASE:
-                    kwargs['passphrase'] = Config.NAS_SSH_KEY_PASSPHRASE
-            elif Config.NAS_PASSWORD:
-                kwargs['password'] = Config.NAS_PASSWORD
-            else:
-                return False, "Either NAS_PASSWORD or NAS_SSH_KEY_PATH must be configured"
-            
-            cls._client.connect(**kwargs)
-            return True, None
-            
-        except paramiko.AuthenticationException:
-            return False, "Authentication failed. Check username and password/key."
-        except paramiko.SSHException as e:
-            return False, f"SSH connection error: {str(e)}"
-        except Exception as e:
-            return False, f"Connection error: {str(e)}"
+        return cls._pool.connect()
     
     @classmethod
     def disconnect(cls):
-        if cls._sftp:
-            try:
-                cls._sftp.close()
-            except:
-                pass
-            cls._sftp = None
-        
-        if cls._client:
-            try:
-                cls._client.close()
-            except:
-                pass
-            cls._client = None
+        cls._shell.close()
+        cls._pool.close_all()
     
     @classmethod
     def is_connected(cls) -> bool:
-        if not cls._client:
-            return False
-        transport = cls._client.get_transport()
-        return transport is not None and transport.is_active()
+        return cls._pool.is_connected()
     
     @classmethod
-    def run_command(cls, command: str) -> Tuple[bool, Optional[str], Optional[str]]:
-        if not cls.is_connected():
-            success, error = cls.connect()
-            if not success:
-                return False, None, error
-        
+    def get_pool_stats(cls) -> dict:
+        return {**cls._pool.get_stats(), 'shell': cls._shell.get_stats()}
+    
+    @classmethod
+    def check_health(cls) -> dict:
+        return cls._pool.check_health()
+    
+    @classmethod
+    def run_command(cls, command: str, timeout: float = 30,
+                    on_channel: Optional[Callable[[paramiko.Channel], None]] = None,
+                    own_channel: bool = False) -> Tuple[bool, Optional[str], Optional[str]]:
+        """
+        Run a command and return (success, stdout, stderr). Commands go through the persistent
+        remote shell, or get a channel of their own if it can't be used. Commands that change
+        files on the NAS should set own_channel: if the shared session is lost, whether its
+        commands ran is unknown, but a command on its own channel always reports its outcome.
+        on_channel, if given, is called with the command's own channel once it is open, so
+        another thread can close it to abort the command.
+        """
+        if on_channel is None and not own_channel:
+            return cls.run_commands([command], timeout)[0]
+        return cls._run_on_channel(command, timeout, on_channel)
+    
+    @classmethod
+    def run_commands(cls, commands: List[str], timeout: float = 30) -> List[Tuple[bool, Optional[str], Optional[str]]]:
+        """
+        Run independent, read-only commands and return their (success, stdout, stderr) in order.
+        They are all sent to the persistent remote shell at once, so n commands cost about one
+        round trip.
+        """
+        sent = []
+        for command in commands:
+            try:
+                sent.append(cls._shell.submit(command))
+            except ConnectionError as e:
+                logger.debug(f"Remote shell unavailable, running command on its own channel: {e}")
+                sent.append(None)
+        return [cls._shell.wait(shell_command, timeout) if shell_command is not None else cls._run_on_channel(command, timeout)
+                for command, shell_command in zip(commands, sent)]
+    
+    @classmethod
+    def _run_on_channel(cls, command: str, timeout: float,
+                        on_channel: Optional[Callable[[paramiko.Channel], None]] = None) -> Tuple[bool, Optional[str], Optional[str]]:
         try:
-            stdin, stdout, stderr = cls._client.exec_command(command, timeout=30)
-            exit_status = stdout.channel.recv_exit_status()
-            stdout_text = stdout.read().decode('utf-8')
-            stderr_text = stderr.read().decode('utf-8')
-            
-            if exit_status == 0:
-                return True, stdout_text, None
-            else:
-                return False, stdout_text, stderr_text or "Command failed"
+            with cls._pool.connection() as connection:
+                stdin, stdout, stderr = connection.client.exec_command(encode_remote(command), timeout=timeout)
+                if on_channel:
+                    on_channel(stdout.channel)
+                exit_status = stdout.channel.recv_exit_status()
+                stdout_text = stdout.read().decode('utf-8')
+                stderr_text = stderr.read().decode('utf-8')
         except Exception as e:
             return False, None, str(e)
+        
+        if exit_status == 0:
+            return True, stdout_text, None
+        else:
+            return False, stdout_text, stderr_text or "Command failed"
     
     @classmethod
-    def get_sftp(cls) -> Optional[paramiko.SFTPClient]:
-        """Get an SFTP client by reusing the main SSH connection."""
-        # Ensure we have an active SSH connection
-        if not cls.is_connected():
-            success, error = cls.connect()
-            if not success:
-                logger.error(f"Could not establish SSH connection: {error}")
-                return None
-        
-        # Try to reuse existing SFTP if it's still valid
-        if cls._sftp:
+    def stream_command(cls, command: str, delimiter: bytes = b'\n', chunk_size: int = 65536,
+                       idle_timeout: Optional[float] = None, stdin_data: Optional[bytes] = None,
+                       on_channel: Optional[Callable[[paramiko.Channel], None]] = None,
+                       check: bool = True) -> Iterator[str]:
+        """
+        Run a command and yield its stdout as records split on `delimiter`, as they arrive,
+        decoded with decode_remote.
+        Unlike run_command there is no overall timeout and output is never buffered in full,
+        so long-running commands like a recursive `find` keep memory flat.
+        If stdin_data is given it is written to the command's stdin (e.g. a file list for xargs).
+        on_channel is as in run_command; closing the channel ends the stream.
+        Once the output ends, raises RemoteCommandError if the command exited non-zero and
+        check is set, so callers don't mistake a truncated walk for a complete one.
+        Raises ConnectionError if no SSH connection can be established, or if the channel
+        closed without an exit status (dropped connection, killed command).
+        """
+        with cls._pool.connection() as connection:
+            channel = connection.transport.open_session()
+            if on_channel:
+                on_channel(channel)
             try:
-                # Test if SFTP is still alive by trying a simple operation
-                cls._sftp.stat('.')
-                logger.debug("Reusing existing SFTP connection")
-                return cls._sftp
-            except:
-                # SFTP is dead, close it
-                logger.debug("Existing SFTP connection is stale, creating new one")
-                try:
-                    cls._sftp.close()
-                except:
-                    pass
-                cls._sftp = None
-        
-        # Create new SFTP from the existing SSH connection
-        # Manually create channel and invoke SFTP subsystem for better Synology compatibility
-        try:
-            logger.debug("Opening new SFTP channel on existing SSH connection")
-            transport = cls._client.get_transport()
-            if not transport or not transport.is_active():
-                raise Exception("Transport is not active")
+                if idle_timeout is not None:
+                    channel.settimeout(idle_timeout)
+                channel.exec_command(encode_remote(command))
             
-            # Create a new channel manually
-            chan = transport.open_session()
-            chan.invoke_subsystem('sftp')
+                if stdin_data is not None:
+                    # Feed stdin from a separate thread so a full stdout window can't deadlock us
+                    def feed_stdin():
+                        try:
+                            channel.sendall(stdin_data)
+                            channel.shutdown_write()
+                        except Exception as e:
+                            logger.debug(f"Could not write command stdin: {e}")
+                    threading.Thread(target=feed_stdin, daemon=True).start()
             
-            # Create SFTP client from the channel
-            cls._sftp = paramiko.SFTPClient(chan)
-            logger.info("SFTP channel opened successfully")
-            return cls._sftp
-        except Exception as e:
-            logger.error(f"Error opening SFTP channel: {e}")
-            # If this fails, the SSH connection itself might be bad
-            # Try to reconnect completely
+                # Pieces of the record still being received; only new data is split
+                partial: List[bytes] = []
+                stderr_tail = b''
+                while True:
+                    chunk = channel.recv(chunk_size)
+                    # Drain stderr as we go so a chatty command can't stall on a full window
+                    while channel.recv_stderr_ready():
+                        stderr_tail = (stderr_tail + channel.recv_stderr(chunk_size))[-4096:]
+                    if not chunk:
+                        break
+                    records = chunk.split(delimiter)
+                    if len(records) == 1:
+                        partial.append(chunk)
+                        continue
+                    partial.append(records[0])
+                    records[0] = b''.join(partial)
+                    partial = [records.pop()]
+                    for record in records:
+                        if record:
+                            yield decode_remote(record)
+            
+                last = b''.join(partial)
+                if last:
+                    yield decode_remote(last)
+            
+                exit_status = channel.recv_exit_status()
+                error_output = stderr_tail.decode('utf-8', errors='ignore').strip() or 'no error output'
+                if exit_status == -1:
+                    raise ConnectionError(f"Streamed command ended without an exit status: {error_output}")
+                if exit_status != 0:
+                    if check:
+                        raise RemoteCommandError(f"Streamed command exited with status {exit_status}: {error_output}")
+                    logger.warning(f"Streamed command exited with status {exit_status}: {error_output}")
+            finally:
+                channel.close()
+    
+    @classmethod
+    @contextmanager
+    def open_binary_stream(cls, command: str, stdin_data: Optional[bytes] = None,
+                           idle_timeout: Optional[float] = None) -> Iterator[BinaryIO]:
+        """
+        Run a command and give a file object over its raw stdout, for binary output such
+        as a tar stream. stdin is fed as in stream_command. stderr is not drained, so the
+        command should discard it. The channel is closed when the context exits.
+        Raises ConnectionError if no SSH connection can be established.
+        """
+        with cls._pool.connection() as connection:
+            channel = connection.transport.open_session()
             try:
-                logger.info("Attempting full SSH reconnection for SFTP")
-                cls.disconnect()
-                success, error = cls.connect()
-                if success:
-                    transport = cls._client.get_transport()
-                    if transport and transport.is_active():
-                        chan = transport.open_session()
-                        chan.invoke_subsystem('sftp')
-                        cls._sftp = paramiko.SFTPClient(chan)
-                        logger.info("SFTP channel opened successfully after reconnection")
-                        return cls._sftp
-                else:
-                    logger.error(f"Reconnection failed: {error}")
-            except Exception as e2:
-                logger.error(f"Error during reconnection: {e2}")
+                if idle_timeout is not None:
+                    channel.settimeout(idle_timeout)
+                channel.exec_command(encode_remote(command))
+            
+                if stdin_data is not None:
+                    def feed_stdin():
+                        try:
+                            channel.sendall(stdin_data)
+                            channel.shutdown_write()
+                        except Exception as e:
+                            logger.debug(f"Could not write command stdin: {e}")
+                    threading.Thread(target=feed_stdin, daemon=True).start()
+            
+                with channel.makefile('rb') as stdout:
+                    yield stdout
+            
+                exit_status = channel.recv_exit_status()
+                if exit_status != 0:
+                    logger.warning(f"Binary stream command exited with status {exit_status}")
+            finally:
+                channel.close()
+    
+    @classmethod
+    def get_sftp(cls) -> Optional[paramiko.SFTPClient]:
+        """An SFTP client on one of the pooled connections, or None if none can be had."""
+        try:
+            return cls._pool.get_sftp()
+        except ConnectionError as e:
+            logger.error(f"Could not open SFTP: {e}")
             return None
-
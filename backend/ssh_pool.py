@@ -0,0 +1,327 @@
+import os
+import time
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+import paramiko
+from backend.config import Config
+
+logger = logging.getLogger(__name__)
+
+# How long a caller waits for a free channel when every connection is at its limit
+ACQUIRE_TIMEOUT_SECONDS = 60
+
+# Delay before retrying after a failed connect, doubling per consecutive failure
+RECONNECT_BACKOFF_SECONDS = 1
+RECONNECT_BACKOFF_MAX_SECONDS = 60
+
+# Connections beyond the first are closed after being unused for this long
+IDLE_CLOSE_SECONDS = 300
+
+class PooledConnection:
+    """One SSH transport, the channels open on it, and its SFTP session if it has one."""
+
+    def __init__(self, client: paramiko.SSHClient):
+        self.client = client
+        self.channels = 0
+        self.sftp: Optional[paramiko.SFTPClient] = None
+        self.opened_at = time.monotonic()
+        self.last_used = self.opened_at
+
+    @property
+    def transport(self) -> Optional[paramiko.Transport]:
+        return self.client.get_transport()
+
+    def is_healthy(self) -> bool:
+        transport = self.transport
+        return transport is not None and transport.is_active()
+
+    @property
+    def busy(self) -> int:
+        """Channels in use by callers; the long-lived SFTP session doesn't count."""
+        return self.channels - (1 if self.sftp is not None else 0)
+
+    def sftp_is_open(self) -> bool:
+        return self.sftp is not None and not self.sftp.get_channel().closed
+
+    def close(self):
+        for closeable in (self.sftp, self.client):
+            if closeable is None:
+                continue
+            try:
+                closeable.close()
+            except Exception:
+                pass
+        self.sftp = None
+
+class SSHPool:
+    """
+    SSH connections to the NAS, opened on demand up to SSH_POOL_SIZE, each carrying at most
+    SSH_CHANNELS_PER_CONNECTION channels at once (sessions and SFTP alike). Callers get the
+    least busy healthy connection; dead ones are dropped and replaced, and after a failed
+    connect new attempts back off exponentially instead of hammering the NAS.
+    """
+
+    def __init__(self):
+        self._connections: List[PooledConnection] = []
+        self._opening = 0
+        self._condition = threading.Condition()
+        self._failures = 0
+        self._retry_at = 0.0
+        self._last_error: Optional[str] = None
+        self._stats = {
+            'opened': 0,
+            'closed': 0,
+            'connect_failures': 0,
+            'acquired': 0,
+            'waits': 0,
+            'wait_ms': 0.0,
+            'timeouts': 0,
+            'health_checks': 0,
+            'dropped': 0,
+        }
+
+    def _create_client(self) -> paramiko.SSHClient:
+        """Open one authenticated connection. Raises ConnectionError with a readable message."""
+        if not Config.NAS_HOST or not Config.NAS_USER:
+            raise ConnectionError("NAS_HOST and NAS_USER must be configured")
+
+        kwargs = {
+            'hostname': Config.NAS_HOST,
+            'port': Config.NAS_PORT,
+            'username': Config.NAS_USER,
+            'timeout': 10
+        }
+        if Config.NAS_SSH_KEY_PATH:
+            if not os.path.exists(Config.NAS_SSH_KEY_PATH):
+                raise ConnectionError(f"SSH key file not found: {Config.NAS_SSH_KEY_PATH}")
+            kwargs['key_filename'] = Config.NAS_SSH_KEY_PATH
+            if Config.NAS_SSH_KEY_PASSPHRASE:
+                kwargs['passphrase'] = Config.NAS_SSH_KEY_PASSPHRASE
+        elif Config.NAS_PASSWORD:
+            kwargs['password'] = Config.NAS_PASSWORD
+        else:
+            raise ConnectionError("Either NAS_PASSWORD or NAS_SSH_KEY_PATH must be configured")
+
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        try:
+            client.connect(**kwargs)
+        except paramiko.AuthenticationException:
+            raise ConnectionError("Authentication failed. Check username and password/key.")
+        except paramiko.SSHException as e:
+            raise ConnectionError(f"SSH connection error: {str(e)}")
+        except Exception as e:
+            raise ConnectionError(f"Connection error: {str(e)}")
+        if Config.SSH_KEEPALIVE_SECONDS > 0:
+            client.get_transport().set_keepalive(Config.SSH_KEEPALIVE_SECONDS)
+        return client
+
+    def _open(self) -> PooledConnection:
+        """Open a new connection, unless still backing off from a failed one."""
+        with self._condition:
+            wait = self._retry_at - time.monotonic()
+            if wait > 0:
+                raise ConnectionError(f"{self._last_error} (retrying in {wait:.0f}s)")
+        try:
+            client = self._create_client()
+        except ConnectionError as e:
+            with self._condition:
+                self._failures += 1
+                self._last_error = str(e)
+                self._retry_at = time.monotonic() + min(
+                    RECONNECT_BACKOFF_SECONDS * 2 ** (self._failures - 1), RECONNECT_BACKOFF_MAX_SECONDS)
+                self._stats['connect_failures'] += 1
+            logger.warning(f"SSH connect failed ({self._failures} in a row): {e}")
+            raise
+        with self._condition:
+            self._failures = 0
+            self._retry_at = 0.0
+            self._last_error = None
+            self._stats['opened'] += 1
+        logger.info(f"Opened SSH connection to {Config.NAS_HOST}")
+        return PooledConnection(client)
+
+    def _prune(self) -> List[PooledConnection]:
+        """Remove dead connections, and idle ones beyond the first. Called holding the lock."""
+        now = time.monotonic()
+        removed = [connection for connection in self._connections if not connection.is_healthy()]
+        alive = [connection for connection in self._connections if connection not in removed]
+        for connection in alive[1:]:
+            if connection.channels == 0 and now - connection.last_used > IDLE_CLOSE_SECONDS:
+                removed.append(connection)
+        if removed:
+            self._connections = [connection for connection in self._connections if connection not in removed]
+            self._stats['closed'] += len(removed)
+        return removed
+
+    def _acquire(self) -> PooledConnection:
+        """
+        Reserve a channel: on an idle connection if there is one, else on a new connection while
+        the pool has room, else on the least busy connection below its channel limit, else wait.
+        """
+        deadline = time.monotonic() + ACQUIRE_TIMEOUT_SECONDS
+        waited_since = None
+        while True:
+            with self._condition:
+                removed = self._prune()
+                usable = [connection for connection in self._connections
+                          if connection.channels < Config.SSH_CHANNELS_PER_CONNECTION]
+                least_busy = min(usable, key=lambda connection: connection.busy, default=None)
+                can_grow = len(self._connections) + self._opening < Config.SSH_POOL_SIZE
+                if least_busy is not None and (least_busy.busy == 0 or not can_grow):
+                    chosen = least_busy
+                elif can_grow:
+                    chosen = None
+                    self._opening += 1
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise ConnectionError("No SSH channel became free in time")
+                    waited_since = waited_since or time.monotonic()
+                    self._condition.wait(remaining)
+                    continue
+                if chosen is not None:
+                    self._reserve(chosen, waited_since)
+            for connection in removed:
+                connection.close()
+            if chosen is not None:
+                return chosen
+
+            try:
+                connection = self._open()
+            except ConnectionError:
+                with self._condition:
+                    self._opening -= 1
+                    self._condition.notify_all()
+                    fallback = min((connection for connection in self._connections
+                                    if connection.channels < Config.SSH_CHANNELS_PER_CONNECTION),
+                                   key=lambda connection: connection.busy, default=None)
+                    if fallback is not None:
+                        self._reserve(fallback, waited_since)
+                        return fallback
+                raise
+            with self._condition:
+                self._opening -= 1
+                self._connections.append(connection)
+                self._reserve(connection, waited_since)
+                self._condition.notify_all()
+            return connection
+
+    def _reserve(self, connection: PooledConnection, waited_since: Optional[float]):
+        connection.channels += 1
+        connection.last_used = time.monotonic()
+        self._stats['acquired'] += 1
+        if waited_since is not None:
+            self._stats['waits'] += 1
+            self._stats['wait_ms'] += (time.monotonic() - waited_since) * 1000
+
+    def _release(self, connection: PooledConnection):
+        with self._condition:
+            connection.channels -= 1
+            connection.last_used = time.monotonic()
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self) -> Iterator[PooledConnection]:
+        """
+        A connection with a channel reserved for the caller until the block exits.
+        Raises ConnectionError if none can be had.
+        """
+        connection = self._acquire()
+        try:
+            yield connection
+        finally:
+            self._release(connection)
+
+    def get_sftp(self) -> paramiko.SFTPClient:
+        """
+        An SFTP session on the least busy connection. Each connection keeps one, which holds
+        one of its channels and is shared by every caller, since requests on it are multiplexed.
+        Raises ConnectionError if none can be had.
+        """
+        connection = self._acquire()
+        with self._condition:
+            if connection.sftp_is_open():
+                connection.channels -= 1
+                self._condition.notify()
+                return connection.sftp
+            if connection.sftp is not None:
+                # The session died under a live transport; its channel slot is free again
+                connection.sftp = None
+                connection.channels -= 1
+        try:
+            # Opened by hand on a plain session for better Synology compatibility
+            channel = connection.transport.open_session()
+            channel.invoke_subsystem('sftp')
+            sftp = paramiko.SFTPClient(channel)
+        except Exception as e:
+            self._release(connection)
+            raise ConnectionError(f"Could not open SFTP session: {e}")
+        with self._condition:
+            if connection.sftp_is_open():
+                # Another caller got there first; keep theirs
+                connection.channels -= 1
+                self._condition.notify()
+                duplicate, sftp = sftp, connection.sftp
+            else:
+                connection.sftp, duplicate = sftp, None
+        if duplicate is not None:
+            duplicate.close()
+        else:
+            logger.info("SFTP session opened")
+        return sftp
+
+    def connect(self) -> Tuple[bool, Optional[str]]:
+        """Make sure at least one healthy connection is open."""
+        try:
+            with self.connection():
+                return True, None
+        except ConnectionError as e:
+            return False, str(e)
+
+    def is_connected(self) -> bool:
+        with self._condition:
+            return any(connection.is_healthy() for connection in self._connections)
+
+    def close_all(self):
+        """Close every connection and forget past failures, so the next use connects right away."""
+        with self._condition:
+            connections, self._connections = self._connections, []
+            self._stats['closed'] += len(connections)
+            self._failures = 0
+            self._retry_at = 0.0
+            self._last_error = None
+            self._condition.notify_all()
+        for connection in connections:
+            connection.close()
+
+    def check_health(self) -> Dict[str, int]:
+        """Drop dead and long-idle connections. Returns how many remain and were dropped."""
+        with self._condition:
+            removed = self._prune()
+            remaining = len(self._connections)
+            self._stats['health_checks'] += 1
+            self._stats['dropped'] += len(removed)
+            self._condition.notify_all()
+        for connection in removed:
+            connection.close()
+        return {'connections': remaining, 'dropped': len(removed)}
+
+    def get_stats(self) -> Dict:
+        """Open connections and channels against their limits, plus counters since startup."""
+        with self._condition:
+            now = time.monotonic()
+            return {
+                'connections': len(self._connections),
+                'max_connections': Config.SSH_POOL_SIZE,
+                'channels_in_use': sum(connection.channels for connection in self._connections),
+                'max_channels_per_connection': Config.SSH_CHANNELS_PER_CONNECTION,
+                'sftp_sessions': sum(1 for connection in self._connections if connection.sftp_is_open()),
+                'consecutive_failures': self._failures,
+                'retry_in_seconds': round(max(self._retry_at - now, 0), 1),
+                'last_error': self._last_error,
+                **{key: round(value, 1) if isinstance(value, float) else value for key, value in self._stats.items()}
+            }
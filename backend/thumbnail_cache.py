@@ -0,0 +1,259 @@
+import os
+import time
+import threading
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from backend.config import Config
+from backend.db import get_connection
+from backend.content_hash import SQL_LOOKUP_BATCH, HASH_KIND_FULL
+
+logger = logging.getLogger(__name__)
+
+# Eviction frees space down to this fraction of the budget, so it doesn't run on every write
+EVICTION_LOW_WATER = 0.9
+
+# Cache hits remembered in memory before their access times are written in one statement
+ACCESS_FLUSH_BATCH = 256
+ACCESS_FLUSH_SECONDS = 30
+
+# Entries evicted per query while freeing space
+EVICTION_BATCH = 500
+
+# Thumbnail bytes on disk as last counted, plus writes since; None until first needed
+_cache_bytes: Optional[int] = None
+_pending_access: Dict[str, float] = {}
+_last_flush = time.monotonic()
+_lock = threading.Lock()
+_eviction_lock = threading.Lock()
+
+_stats = {
+    'evicted': 0,
+    'evicted_bytes': 0,
+    'orphans_removed': 0,
+}
+
+def get_cache_dir() -> str:
+    cache_dir = os.path.join(Config.LOCAL_STATE_DIR, 'thumbnails')
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+# Extension of each thumbnail format in the cache
+FORMAT_EXTENSIONS = {'jpeg': 'jpg', 'webp': 'webp'}
+
+def thumbnail_file_name(cache_key: str, variant: str = 'medium', fmt: str = 'jpeg') -> str:
+    """
+    File name of one rendition of a thumbnail. It is also the rendition's key in
+    cache_metadata. The medium JPEG keeps the plain name it had before there were variants.
+    """
+    if variant == 'medium' and fmt == 'jpeg':
+        return f"{cache_key}.jpg"
+    return f"{cache_key}-{variant}.{FORMAT_EXTENSIONS[fmt]}"
+
+def get_cache_file_path(file_name: str) -> str:
+    return os.path.join(get_cache_dir(), file_name)
+
+def get_thumbnail_path(cache_key: str, variant: str = 'medium', fmt: str = 'jpeg') -> str:
+    return get_cache_file_path(thumbnail_file_name(cache_key, variant, fmt))
+
+def _budget_bytes() -> int:
+    return Config.THUMB_CACHE_MAX_MB * 1024 * 1024
+
+def _remove_files(file_names: List[str]):
+    for file_name in file_names:
+        try:
+            os.remove(get_cache_file_path(file_name))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not remove cached thumbnail {file_name}: {e}")
+
+def record_entries(entries: List[Tuple[str, str, float, int, int, Optional[str]]]):
+    """
+    Record thumbnails just written to the cache, as (file name, source path, source mtime,
+    source size, thumbnail bytes, content hash or None), and evict least recently used ones
+    if over budget. For a content-addressed thumbnail the source is the file it was made from.
+    """
+    global _cache_bytes
+    if not entries:
+        return
+    now = time.time()
+    cached_at = datetime.now().isoformat()
+    conn = get_connection()
+    conn.executemany("""
+        INSERT OR REPLACE INTO cache_metadata (hash_key, path, mtime, size, bytes, cached_at, last_access, content_hash)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, [(key, path, mtime, size, nbytes, cached_at, now, content_hash)
+          for key, path, mtime, size, nbytes, content_hash in entries])
+    conn.commit()
+
+    with _lock:
+        if _cache_bytes is not None:
+            _cache_bytes += sum(entry[4] for entry in entries)
+        over_budget = _cache_bytes is None or _cache_bytes > _budget_bytes()
+    if over_budget:
+        enforce_budget()
+
+def record_entry(file_name: str, path: str, mtime: float, size: int, nbytes: int,
+                 content_hash: Optional[str] = None):
+    record_entries([(file_name, path, mtime, size, nbytes, content_hash)])
+
+def touch(file_name: str):
+    """Note a cache hit. Access times are written in batches, not per hit."""
+    with _lock:
+        _pending_access[file_name] = time.time()
+        due = (len(_pending_access) >= ACCESS_FLUSH_BATCH
+               or time.monotonic() - _last_flush >= ACCESS_FLUSH_SECONDS)
+    if due:
+        flush_access_times()
+
+def flush_access_times():
+    """Write the access times of recent cache hits."""
+    global _last_flush
+    with _lock:
+        pending = list(_pending_access.items())
+        _pending_access.clear()
+        _last_flush = time.monotonic()
+    if not pending:
+        return
+    conn = get_connection()
+    conn.executemany("UPDATE cache_metadata SET last_access = ? WHERE hash_key = ?",
+                     [(accessed, key) for key, accessed in pending])
+    conn.commit()
+
+def enforce_budget() -> Dict[str, int]:
+    """
+    Evict least recently used thumbnails until the cache is under EVICTION_LOW_WATER of
+    THUMB_CACHE_MAX_MB. Returns what was evicted.
+    """
+    global _cache_bytes
+    evicted = evicted_bytes = 0
+    with _eviction_lock:
+        flush_access_times()
+        conn = get_connection()
+        total = conn.execute("SELECT IFNULL(SUM(bytes), 0) FROM cache_metadata").fetchone()[0]
+        budget = _budget_bytes()
+        if total > budget:
+            target = int(budget * EVICTION_LOW_WATER)
+            while total > target:
+                rows = conn.execute("""
+                    SELECT hash_key, bytes FROM cache_metadata
+                    ORDER BY last_access
+                    LIMIT ?
+                """, (EVICTION_BATCH,)).fetchall()
+                if not rows:
+                    break
+                victims = []
+                for key, nbytes in rows:
+                    if total <= target:
+                        break
+                    victims.append(key)
+                    total -= nbytes
+                    evicted_bytes += nbytes
+                conn.executemany("DELETE FROM cache_metadata WHERE hash_key = ?", [(key,) for key in victims])
+                conn.commit()
+                _remove_files(victims)
+                evicted += len(victims)
+            logger.info(f"Evicted {evicted} thumbnails ({evicted_bytes} bytes) to stay within {budget} bytes")
+        with _lock:
+            _cache_bytes = total
+            _stats['evicted'] += evicted
+            _stats['evicted_bytes'] += evicted_bytes
+    return {'evicted': evicted, 'evicted_bytes': evicted_bytes}
+
+def remove_for_paths(paths: List[str]) -> int:
+    """
+    Drop the cached thumbnails of source files that are gone, e.g. moved to the recycle bin.
+    Content-addressed thumbnails stay: other copies of the file, or the file once restored, use them.
+    """
+    conn = get_connection()
+    keys: List[str] = []
+    for start in range(0, len(paths), SQL_LOOKUP_BATCH):
+        batch = paths[start:start + SQL_LOOKUP_BATCH]
+        keys.extend(row[0] for row in conn.execute(
+            f"SELECT hash_key FROM cache_metadata WHERE content_hash IS NULL AND path IN ({','.join('?' * len(batch))})",
+            batch))
+    _delete_entries(conn, keys)
+    return len(keys)
+
+def _delete_entries(conn, keys: List[str]):
+    global _cache_bytes
+    if not keys:
+        return
+    conn.executemany("DELETE FROM cache_metadata WHERE hash_key = ?", [(key,) for key in keys])
+    conn.commit()
+    _remove_files(keys)
+    with _lock:
+        _cache_bytes = None
+        _stats['orphans_removed'] += len(keys)
+
+def cleanup_orphans() -> Dict[str, int]:
+    """
+    Bring the cache and its metadata back in line:
+    - thumbnails on disk without metadata (written before the cache was managed) are adopted,
+      with their file time as last access
+    - metadata whose thumbnail file is gone is dropped
+    - thumbnails of files under an indexed root that are no longer in the index, or have
+      changed since, are removed
+    - content-addressed thumbnails whose content no file is known to have any more are removed
+    Then the budget is enforced. Returns counts of each.
+    """
+    global _cache_bytes
+    conn = get_connection()
+    flush_access_times()
+    known = {row[0] for row in conn.execute("SELECT hash_key FROM cache_metadata")}
+    on_disk: Dict[str, os.stat_result] = {}
+    with os.scandir(get_cache_dir()) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith(tuple(f".{ext}" for ext in FORMAT_EXTENSIONS.values())):
+                on_disk[entry.name] = entry.stat()
+
+    cached_at = datetime.now().isoformat()
+    adopted = [(key, st.st_size, cached_at, st.st_mtime) for key, st in on_disk.items() if key not in known]
+    conn.executemany("""
+        INSERT INTO cache_metadata (hash_key, path, mtime, size, bytes, cached_at, last_access)
+        VALUES (?, NULL, NULL, NULL, ?, ?, ?)
+    """, adopted)
+    missing = [key for key in known if key not in on_disk]
+    conn.executemany("DELETE FROM cache_metadata WHERE hash_key = ?", [(key,) for key in missing])
+    conn.commit()
+    with _lock:
+        _cache_bytes = None
+
+    # Cache keys use stat's whole-second mtime; the index keeps sub-second ones
+    stale = [row[0] for row in conn.execute("""
+        SELECT DISTINCT c.hash_key FROM cache_metadata c
+        JOIN remote_roots r ON substr(c.path, 1, length(r.root) + 1) = r.root || '/'
+        WHERE c.path IS NOT NULL AND c.content_hash IS NULL
+          AND NOT EXISTS (
+              SELECT 1 FROM remote_files f
+              WHERE f.root = r.root AND f.path = c.path
+                AND f.size = c.size AND CAST(f.mtime AS INTEGER) = CAST(c.mtime AS INTEGER)
+          )
+    """)]
+    stale += [row[0] for row in conn.execute("""
+        SELECT hash_key FROM cache_metadata
+        WHERE content_hash IS NOT NULL
+          AND content_hash NOT IN (SELECT hash FROM file_hashes WHERE kind = ?)
+    """, (HASH_KIND_FULL,))]
+    _delete_entries(conn, stale)
+
+    result = {'adopted': len(adopted), 'missing': len(missing), 'stale': len(stale)}
+    result.update(enforce_budget())
+    logger.info(f"Thumbnail cache cleanup: {result}")
+    return result
+
+def get_disk_cache_stats() -> Dict:
+    """Size of the thumbnail disk cache against its budget, and what has been evicted."""
+    flush_access_times()
+    entries, total, oldest = get_connection().execute(
+        "SELECT COUNT(*), IFNULL(SUM(bytes), 0), MIN(last_access) FROM cache_metadata").fetchone()
+    with _lock:
+        stats = dict(_stats)
+    return {
+        'entries': entries,
+        'bytes': total,
+        'budget_bytes': _budget_bytes(),
+        'oldest_access': datetime.fromtimestamp(oldest).isoformat() if oldest else None,
+        **stats
+    }
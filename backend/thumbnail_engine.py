@@ -0,0 +1,229 @@
+import io
+import os
+import time
+import threading
+import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+from PIL import Image, ImageOps
+from backend.config import Config
+from backend.ssh_client import SSHClient
+from backend.original_service import open_original, read_range
+from backend.embedded_preview import render_preview
+
+logger = logging.getLogger(__name__)
+
+# Where thumbnails are decoded: 'remote' runs ffmpeg on the NAS and streams back the
+# results; 'local' reads the source over SFTP and decodes it here with Pillow
+ENGINE_REMOTE = 'remote'
+ENGINE_LOCAL = 'local'
+ENGINE_AUTO = 'auto'
+ENGINES = (ENGINE_REMOTE, ENGINE_LOCAL)
+
+# Formats Pillow decodes out of the box; anything else (HEIC, RAW without a usable preview)
+# is always left to ffmpeg
+LOCAL_ENGINE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.tif', '.webp'}
+
+# Sources larger than this are left to ffmpeg rather than pulled across the network
+LOCAL_MAX_SOURCE_BYTES = 64 * 1024 * 1024
+
+# Files read over SFTP at once, and decodes queued in the process pool. Together they bound
+# how many source files are held in memory: LOCAL_READ_WORKERS + LOCAL_DECODES_IN_FLIGHT.
+LOCAL_READ_WORKERS = 4
+LOCAL_DECODES_IN_FLIGHT = 8
+
+# Weight of the newest batch in each engine's smoothed per-image latency
+LATENCY_SMOOTHING = 0.3
+
+# Per-image latency charged for a batch that produced nothing, e.g. because ffmpeg is missing
+# or broken on the NAS; far slower than any working engine, so auto mode turns to the other one
+FAILED_BATCH_SECONDS_PER_IMAGE = 60.0
+
+# How long a reading of the NAS load average is reused
+NAS_LOAD_TTL_SECONDS = 30
+
+# In auto mode every Nth batch goes to the engine not currently preferred, so that its
+# latency stays current as conditions change
+EXPLORE_EVERY = 20
+
+_decode_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+_latency: Dict[str, Optional[float]] = {ENGINE_REMOTE: None, ENGINE_LOCAL: None}
+_nas_load: Optional[float] = None
+_nas_load_at = 0.0
+_stats = {'batches': 0, 'remote_images': 0, 'local_images': 0, 'remote_failed_batches': 0, 'local_failed_batches': 0,
+          'local_failures': 0, 'local_bytes_read': 0}
+_lock = threading.Lock()
+
+def decodes_locally(remote_path: str) -> bool:
+    """Whether the local engine can thumbnail a file."""
+    return os.path.splitext(remote_path)[1].lower() in LOCAL_ENGINE_EXTENSIONS
+
+def _get_decode_pool() -> ProcessPoolExecutor:
+    global _decode_pool
+    with _pool_lock:
+        if _decode_pool is None:
+            # Spawned workers don't inherit the server's threads and locks
+            _decode_pool = ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn'))
+        return _decode_pool
+
+def shutdown_decode_pool():
+    """Stop the local engine's decoder processes."""
+    global _decode_pool
+    with _pool_lock:
+        pool, _decode_pool = _decode_pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def _discard_broken_pool(pool: ProcessPoolExecutor):
+    global _decode_pool
+    with _pool_lock:
+        if _decode_pool is pool:
+            _decode_pool = None
+
+def decode_and_render(data: bytes, sides: List[int], fmts: List[str]) -> Optional[List[bytes]]:
+    """
+    Runs in a decoder process. draft() lets the JPEG decoder scale by up to 1/8 while
+    decoding, so a large photo is never decoded at full resolution for a small thumbnail.
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        largest = max(sides)
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        return render_preview(image, sides, fmts)
+    except Exception:
+        return None
+
+def _read_source(remote_path: str) -> Optional[bytes]:
+    try:
+        remote_file, size, _ = open_original(remote_path)
+    except Exception as e:
+        logger.debug(f"Could not open {remote_path} for local thumbnailing: {e}")
+        return None
+    try:
+        if size > LOCAL_MAX_SOURCE_BYTES:
+            return None
+        return read_range(remote_file, 0, size)
+    except Exception as e:
+        logger.debug(f"Could not read {remote_path} for local thumbnailing: {e}")
+        return None
+    finally:
+        remote_file.close()
+
+def render_locally(remote_paths: List[str], sides: List[int], fmts: List[str]) -> Dict[str, List[bytes]]:
+    """
+    Thumbnails of files at each (longest side, format), made by reading them over SFTP and
+    decoding them in a local process pool, so the NAS only serves bytes. Reads and decodes
+    overlap. Returns {path: encoded renditions} for the files that could be decoded.
+    """
+    pool = _get_decode_pool()
+    rendered: Dict[str, List[bytes]] = {}
+    in_flight = deque()
+    bytes_read = failures = 0
+
+    def collect(path, future):
+        nonlocal failures
+        try:
+            result = future.result()
+        except BrokenProcessPool:
+            _discard_broken_pool(pool)
+            raise
+        if result:
+            rendered[path] = result
+        else:
+            failures += 1
+
+    try:
+        with ThreadPoolExecutor(max_workers=LOCAL_READ_WORKERS) as readers:
+            for start in range(0, len(remote_paths), LOCAL_READ_WORKERS):
+                window = remote_paths[start:start + LOCAL_READ_WORKERS]
+                for path, data in zip(window, readers.map(_read_source, window)):
+                    if not data:
+                        failures += 1
+                        continue
+                    bytes_read += len(data)
+                    in_flight.append((path, pool.submit(decode_and_render, data, sides, fmts)))
+                    while len(in_flight) > LOCAL_DECODES_IN_FLIGHT:
+                        collect(*in_flight.popleft())
+            while in_flight:
+                collect(*in_flight.popleft())
+    finally:
+        with _lock:
+            _stats['local_failures'] += failures
+            _stats['local_bytes_read'] += bytes_read
+    return rendered
+
+def nas_load() -> Optional[float]:
+    """The NAS's 1-minute load average per CPU, re-read at most every NAS_LOAD_TTL_SECONDS."""
+    global _nas_load, _nas_load_at
+    with _lock:
+        if time.monotonic() - _nas_load_at < NAS_LOAD_TTL_SECONDS:
+            return _nas_load
+        _nas_load_at = time.monotonic()
+    load = None
+    success, output, _ = SSHClient.run_command("cat /proc/loadavg; grep -c ^processor /proc/cpuinfo")
+    if success and output:
+        try:
+            lines = output.split()
+            load = float(lines[0]) / max(int(lines[-1]), 1)
+        except (ValueError, IndexError):
+            pass
+    with _lock:
+        _nas_load = load
+    return load
+
+def record_latency(engine: str, seconds: float, images: int, attempted: int):
+    """
+    Fold a batch's time per generated image into the engine's smoothed latency. A batch of
+    attempted images that produced none counts as FAILED_BATCH_SECONDS_PER_IMAGE.
+    """
+    if attempted <= 0:
+        return
+    with _lock:
+        if images <= 0:
+            per_image = FAILED_BATCH_SECONDS_PER_IMAGE
+            _stats[f'{engine}_failed_batches'] += 1
+        else:
+            per_image = seconds / images
+        previous = _latency[engine]
+        _latency[engine] = per_image if previous is None else (
+            LATENCY_SMOOTHING * per_image + (1 - LATENCY_SMOOTHING) * previous)
+        _stats[f'{engine}_images'] += images
+
+def choose_engine() -> str:
+    """
+    The engine for the next batch. THUMB_ENGINE fixes it per deployment; in 'auto' mode the
+    local engine is used while the NAS is busier than THUMB_NAS_MAX_LOAD per CPU, and otherwise
+    whichever engine has been faster per image, each being tried once before comparing.
+    """
+    if Config.THUMB_ENGINE in ENGINES:
+        return Config.THUMB_ENGINE
+    with _lock:
+        _stats['batches'] += 1
+        explore = _stats['batches'] % EXPLORE_EVERY == 0
+        remote, local = _latency[ENGINE_REMOTE], _latency[ENGINE_LOCAL]
+    load = nas_load()
+    if load is not None and load >= Config.THUMB_NAS_MAX_LOAD:
+        return ENGINE_LOCAL
+    if remote is None:
+        return ENGINE_REMOTE
+    if local is None:
+        return ENGINE_LOCAL
+    preferred, other = (ENGINE_LOCAL, ENGINE_REMOTE) if local < remote else (ENGINE_REMOTE, ENGINE_LOCAL)
+    return other if explore else preferred
+
+def get_engine_stats() -> Dict:
+    """Configured engine, each engine's smoothed per-image latency and use, and the last NAS load seen."""
+    with _lock:
+        return {
+            'mode': Config.THUMB_ENGINE,
+            'remote_ms_per_image': round(_latency[ENGINE_REMOTE] * 1000, 1) if _latency[ENGINE_REMOTE] is not None else None,
+            'local_ms_per_image': round(_latency[ENGINE_LOCAL] * 1000, 1) if _latency[ENGINE_LOCAL] is not None else None,
+            'nas_load_per_cpu': _nas_load,
+            **_stats
+        }
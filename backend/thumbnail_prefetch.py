@@ -0,0 +1,132 @@
+import heapq
+import itertools
+import threading
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+from backend.config import Config
+from backend.duplicate_scanner import get_duplicates_from_db
+from backend.thumbnail_service import generate_thumbnails
+
+logger = logging.getLogger(__name__)
+
+# Threads generating prefetched thumbnails. Each runs one remote batch at a time, so this
+# also bounds how many prefetch pipelines compete with on-demand thumbnails on the NAS.
+PREFETCH_WORKERS = 2
+
+# Most urgent images a worker takes off the queue per remote batch
+PREFETCH_BATCH_SIZE = 8
+
+# Pending images as a heap of (priority, sequence, path); lower priority is more urgent.
+# _windows holds each scan session's latest window of {path: priority}, and _wanted the
+# priority each path currently should have, its most urgent across the windows: heap entries
+# that no longer match it (re-prioritised, or dropped from every window) are skipped when popped.
+_queue: List[Tuple[int, int, str]] = []
+_windows: Dict[str, Dict[str, int]] = {}
+_wanted: Dict[str, int] = {}
+_in_flight: Set[str] = set()
+_sequence = itertools.count()
+_condition = threading.Condition()
+_workers: List[threading.Thread] = []
+
+_stats = {
+    'requested': 0,
+    'prefetched': 0,
+    'failed': 0,
+    'cancelled': 0,
+}
+
+def _ensure_workers():
+    """Start the worker threads on first use. Call with _condition held."""
+    while len(_workers) < PREFETCH_WORKERS:
+        worker = threading.Thread(target=_worker_loop, name=f'thumb-prefetch-{len(_workers)}', daemon=True)
+        _workers.append(worker)
+        worker.start()
+
+def _take_batch() -> List[str]:
+    """Pop the most urgent still-wanted paths. Call with _condition held."""
+    batch: List[str] = []
+    while _queue and len(batch) < PREFETCH_BATCH_SIZE:
+        priority, _, path = heapq.heappop(_queue)
+        if _wanted.get(path) != priority:
+            continue
+        del _wanted[path]
+        for scan_session_id in list(_windows):
+            _windows[scan_session_id].pop(path, None)
+            if not _windows[scan_session_id]:
+                del _windows[scan_session_id]
+        _in_flight.add(path)
+        batch.append(path)
+    return batch
+
+def _worker_loop():
+    while True:
+        with _condition:
+            batch = _take_batch()
+            while not batch:
+                _condition.wait()
+                batch = _take_batch()
+
+        try:
+            generated = generate_thumbnails(batch, max_size=Config.THUMB_MAX_SIZE)
+        except Exception as e:
+            logger.error(f"Thumbnail prefetch failed: {e}")
+            generated = {}
+
+        with _condition:
+            _in_flight.difference_update(batch)
+            _stats['prefetched'] += len(generated)
+            _stats['failed'] += len(batch) - len(generated)
+
+def prefetch_pairs(scan_session_id: str, current_id: Optional[int] = None, count: Optional[int] = None) -> Dict:
+    """
+    Keep thumbnails warm for the next `count` unreviewed pairs of a session, starting at the
+    pair with backup member id `current_id` (or the first unreviewed pair). Images are queued
+    by how soon the reviewer reaches them; calling again as the reviewer moves re-prioritises
+    the queue, and images that left the window (reviewed pairs, pairs already passed) are
+    dropped before they are generated. Each session keeps its own window, so reviewers in
+    different sessions don't cancel each other's; an image in several windows gets its most
+    urgent priority.
+    Returns the prefetch statistics.
+    """
+    count = count or Config.THUMB_PREFETCH_COUNT
+    after = f"{current_id}:0" if current_id else None
+    pairs, _ = get_duplicates_from_db(scan_session_id, count, after)
+
+    window: Dict[str, int] = {}
+    for position, pair in enumerate(pairs):
+        for path in (pair['backup_path'], pair['sorted_path']):
+            window.setdefault(path, position)
+
+    with _condition:
+        previous = _windows.pop(scan_session_id, {})
+        queued = {path: priority for path, priority in window.items() if path not in _in_flight}
+        if queued:
+            _windows[scan_session_id] = queued
+        for path in previous.keys() | queued.keys():
+            priority = min((other[path] for other in _windows.values() if path in other), default=None)
+            if priority is None:
+                if _wanted.pop(path, None) is not None:
+                    _stats['cancelled'] += 1
+            elif _wanted.get(path) != priority:
+                _wanted[path] = priority
+                heapq.heappush(_queue, (priority, next(_sequence), path))
+        _stats['requested'] += len(window)
+        # Drop stale heap entries once they dominate, so the heap stays bounded by the windows
+        if len(_queue) > 4 * max(len(_wanted), PREFETCH_BATCH_SIZE):
+            _queue[:] = [entry for entry in _queue if _wanted.get(entry[2]) == entry[0]]
+            heapq.heapify(_queue)
+        _ensure_workers()
+        _condition.notify_all()
+
+    return get_prefetch_stats()
+
+def get_prefetch_stats() -> Dict:
+    """Queue depth and counters of the prefetcher."""
+    with _condition:
+        return {
+            'queue_depth': len(_wanted),
+            'sessions': len(_windows),
+            'in_flight': len(_in_flight),
+            'workers': PREFETCH_WORKERS,
+            **_stats
+        }
@@ -1,19 +1,162 @@
 import os
 import hashlib
-from typing import Optional
+import time
+import tarfile
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 import logging
-from backend.ssh_client import SSHClient
+import paramiko
+from backend.ssh_client import SSHClient, encode_remote
 from backend.config import Config
+from backend.db import get_connection
+from backend.content_hash import stat_remote_files, SQL_LOOKUP_BATCH, HASH_KIND_FULL
+from backend.scan_progress import ScanProgress
+from backend.embedded_preview import wants_embedded_preview, extract_renditions
+from backend.thumbnail_engine import ENGINE_LOCAL, ENGINE_REMOTE, choose_engine, decodes_locally, record_latency, render_locally
+from backend.thumbnail_cache import (
+    FORMAT_EXTENSIONS, get_thumbnail_path, thumbnail_file_name, record_entries, touch
+)
 
 logger = logging.getLogger(__name__)
 
+# Missing thumbnails generated per SSH command when generating in bulk
+THUMBNAIL_BATCH_SIZE = 256
+
+# Errors that fail a single batch rather than the whole generation run, including a channel
+# dropped mid-batch
+BATCH_ERRORS = (ConnectionError, tarfile.TarError, OSError, paramiko.SSHException)
+
+# Thumbnails per tar archive within a batch; each archive is streamed back as soon as its
+# images are done, so the first thumbnails of a batch arrive without waiting for the rest
+THUMBNAIL_TAR_CHUNK = 16
+
+# Longest side in pixels per size class: a grid/placeholder 'tiny', an overview 'small', and
+# a zoom-to-compare 'large'. 'medium' is the review view, THUMB_MAX_SIZE by default.
+THUMBNAIL_VARIANT_SIZES = {'tiny': 32, 'small': 192, 'large': 1600}
+THUMBNAIL_VARIANTS = ('tiny', 'small', 'medium', 'large')
+
+# Made together from a single decode whenever an image's thumbnail is generated; 'large'
+# is only made when asked for, since most images are never zoomed into
+THUMBNAIL_BASE_VARIANTS = ('tiny', 'small', 'medium')
+
+# ffmpeg encoder options per format
+_ENCODER_OPTIONS = {
+    'jpeg': '-c:v mjpeg -q:v 5 -f mjpeg',
+    'webp': '-c:v libwebp -quality 75 -f webp',
+}
+
+# A thumbnail rendition: (size class, format)
+Rendition = Tuple[str, str]
+
+# Files whose embedded previews are read and resized at once; each is a few SFTP round trips
+PREVIEW_WORKERS = 4
+
+# Cache hits and misses of on-demand thumbnail requests, to judge how well prefetching works
+_cache_stats = {'hits': 0, 'misses': 0}
+_cache_stats_lock = threading.Lock()
+
+def _record_cache_lookup(hit: bool):
+    with _cache_stats_lock:
+        _cache_stats['hits' if hit else 'misses'] += 1
+
+def get_cache_stats() -> Dict:
+    """Hits, misses and hit ratio of on-demand thumbnail requests since startup, and memory cache use."""
+    with _cache_stats_lock:
+        hits, misses = _cache_stats['hits'], _cache_stats['misses']
+    with _memory_cache_lock:
+        memory_entries, memory_bytes = len(_memory_cache), _memory_cache_bytes
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else None,
+        'memory_entries': memory_entries,
+        'memory_bytes': memory_bytes
+    }
+
+# Recently served thumbnails kept in memory in front of the disk cache, bounded by total bytes
+_memory_cache: "OrderedDict[str, bytes]" = OrderedDict()
+_memory_cache_bytes = 0
+_memory_cache_lock = threading.Lock()
+
+# Thumbnails being generated, by cache key, so the prefetcher, bulk jobs and on-demand
+# requests don't make the same one at once. A caller waits this long for another's
+# generation before making the thumbnail itself.
+_in_flight: Dict[str, threading.Event] = {}
+_in_flight_lock = threading.Lock()
+IN_FLIGHT_WAIT_SECONDS = 30
+
+def _memory_cache_get(cache_key: str) -> Optional[bytes]:
+    with _memory_cache_lock:
+        data = _memory_cache.get(cache_key)
+        if data is not None:
+            _memory_cache.move_to_end(cache_key)
+        return data
+
+def _memory_cache_put(cache_key: str, data: bytes):
+    global _memory_cache_bytes
+    limit = Config.THUMB_MEMORY_CACHE_MB * 1024 * 1024
+    if len(data) > limit:
+        return
+    with _memory_cache_lock:
+        previous = _memory_cache.pop(cache_key, None)
+        if previous is not None:
+            _memory_cache_bytes -= len(previous)
+        _memory_cache[cache_key] = data
+        _memory_cache_bytes += len(data)
+        while _memory_cache_bytes > limit:
+            _, evicted = _memory_cache.popitem(last=False)
+            _memory_cache_bytes -= len(evicted)
+
 def get_cache_key(path: str, mtime: float, size: int) -> str:
     key_string = f"{path}:{mtime}:{size}"
     return hashlib.sha256(key_string.encode()).hexdigest()
 
-def get_thumbnail_path(cache_key: str) -> str:
-    os.makedirs(os.path.join(Config.LOCAL_STATE_DIR, 'thumbnails'), exist_ok=True)
-    return os.path.join(Config.LOCAL_STATE_DIR, 'thumbnails', f"{cache_key}.jpg")
+def get_content_cache_key(content_hash: str) -> str:
+    """Cache key of the thumbnail shared by every file with this full-content hash."""
+    return f"{HASH_KIND_FULL}-{content_hash}"
+
+def get_known_content_hashes(stats: Dict[str, Tuple[int, float]]) -> Dict[str, str]:
+    """
+    Full-content hashes from the hashing cache that are still valid for files' (size, mtime).
+    Compares whole-second mtimes, since hashes may have been stored with the index's.
+    """
+    hashes: Dict[str, str] = {}
+    conn = get_connection()
+    paths = list(stats)
+    for start in range(0, len(paths), SQL_LOOKUP_BATCH):
+        batch = paths[start:start + SQL_LOOKUP_BATCH]
+        rows = conn.execute(f"""
+            SELECT path, size, mtime, hash FROM file_hashes
+            WHERE kind = ? AND path IN ({','.join('?' * len(batch))})
+        """, (HASH_KIND_FULL, *batch)).fetchall()
+        for path, size, mtime, content_hash in rows:
+            if stats[path][0] == size and int(stats[path][1]) == int(mtime):
+                hashes[path] = content_hash
+    return hashes
+
+def get_thumbnail_keys(stats: Dict[str, Tuple[int, float]]) -> Dict[str, Tuple[str, Optional[str]]]:
+    """
+    (cache key, content hash or None) per file from its (size, mtime). Files with a known
+    content hash share one thumbnail with their identical copies, wherever they are; the
+    rest are keyed by path and stats.
+    """
+    hashes = get_known_content_hashes(stats)
+    keys: Dict[str, Tuple[str, Optional[str]]] = {}
+    for path, (size, mtime) in stats.items():
+        content_hash = hashes.get(path)
+        if content_hash:
+            keys[path] = (get_content_cache_key(content_hash), content_hash)
+        else:
+            keys[path] = (get_cache_key(path, mtime, size), None)
+    return keys
+
+def get_thumbnail_key(remote_path: str, stats: Tuple[float, int]) -> Tuple[str, Optional[str]]:
+    """(cache key, content hash or None) of one file from its (mtime, size)."""
+    mtime, size = stats
+    return get_thumbnail_keys({remote_path: (size, mtime)})[remote_path]
 
 def get_file_stats(remote_path: str) -> Optional[tuple]:
     success, output, _ = SSHClient.run_command(f'stat -c "%Y %s" "{remote_path}" 2>/dev/null')
@@ -27,27 +170,106 @@ def get_file_stats(remote_path: str) -> Optional[tuple]:
             pass
     return None
 
-def fetch_and_resize_image(remote_path: str, max_size: int = 512) -> Optional[bytes]:
-    logger.info(f"Fetching thumbnail for: {remote_path}")
+def get_indexed_file_stats(remote_path: str) -> Optional[Tuple[float, int]]:
+    """(mtime, size) of a file from the scan index, without a round trip to the NAS."""
+    row = get_connection().execute("""
+        SELECT mtime, size FROM remote_files
+        WHERE root IN (SELECT root FROM remote_roots) AND path = ?
+        LIMIT 1
+    """, (remote_path,)).fetchone()
+    if not row or row[0] is None or row[1] is None:
+        return None
+    # The index keeps sub-second mtimes; cache keys use stat's whole seconds
+    return float(int(row[0])), row[1]
+
+def get_indexed_stats_batch(remote_paths: List[str]) -> Dict[str, Tuple[int, float]]:
+    """(size, mtime) from the scan index for many files, keyed like stat_remote_files."""
+    stats: Dict[str, Tuple[int, float]] = {}
+    conn = get_connection()
+    for start in range(0, len(remote_paths), SQL_LOOKUP_BATCH):
+        batch = remote_paths[start:start + SQL_LOOKUP_BATCH]
+        rows = conn.execute(f"""
+            SELECT path, size, mtime FROM remote_files
+            WHERE root IN (SELECT root FROM remote_roots) AND path IN ({','.join('?' * len(batch))})
+              AND size IS NOT NULL AND mtime IS NOT NULL
+        """, batch).fetchall()
+        for path, size, mtime in rows:
+            stats[path] = (size, float(int(mtime)))
+    return stats
+
+def get_thumbnail_stats(remote_path: str) -> Optional[Tuple[float, int]]:
+    """(mtime, size) for a thumbnail's cache key: from the scan index, else a remote stat."""
+    return get_indexed_file_stats(remote_path) or get_file_stats(remote_path)
+
+def variant_size(variant: str, max_size: Optional[int] = None) -> int:
+    """Longest side in pixels of a size class; max_size overrides THUMB_MAX_SIZE for 'medium'."""
+    if variant == 'medium':
+        return max_size or Config.THUMB_MAX_SIZE
+    return THUMBNAIL_VARIANT_SIZES[variant]
+
+def thumbnail_formats() -> Tuple[str, ...]:
+    """
+    Formats every thumbnail is made in. WebP needs an ffmpeg on the NAS built with libwebp
+    unless every image is thumbnailed locally.
+    """
+    return ('jpeg', 'webp') if Config.THUMB_WEBP else ('jpeg',)
+
+def base_renditions() -> List[Rendition]:
+    return [(variant, fmt) for variant in THUMBNAIL_BASE_VARIANTS for fmt in thumbnail_formats()]
+
+def thumbnail_etag(cache_key: str, variant: str = 'medium', fmt: str = 'jpeg',
+                   max_size: Optional[int] = None) -> str:
+    """Strong ETag of a thumbnail rendition, known from its cache key without reading it."""
+    return f'"{cache_key[:32]}-{variant_size(variant, max_size)}-{FORMAT_EXTENSIONS[fmt]}"'
+
+def fetch_and_resize_image(remote_path: str, max_size: int = 512,
+                           stats: Optional[Tuple[float, int]] = None,
+                           variant: str = 'medium', fmt: str = 'jpeg') -> Optional[bytes]:
+    """
+    Get a thumbnail rendition from the memory cache, the disk cache, or by generating it
+    with the configured thumbnail engine. stats is the file's (mtime, size) if the caller already has it; otherwise it
+    comes from the scan index or a remote stat. Files with a known content hash share the
+    thumbnail of any identical copy. A miss also makes the image's other missing base
+    variants from the same decode.
+    """
+    logger.info(f"Fetching {variant} thumbnail for: {remote_path}")
     
-    stats = get_file_stats(remote_path)
+    stats = stats or get_thumbnail_stats(remote_path)
     if not stats:
         logger.warning(f"Could not get file stats for: {remote_path}")
         return None
     
     mtime, size = stats
-    cache_key = get_cache_key(remote_path, mtime, size)
-    cached_path = get_thumbnail_path(cache_key)
+    cache_key, content_hash = get_thumbnail_key(remote_path, stats)
+    file_name = thumbnail_file_name(cache_key, variant, fmt)
+    cached_path = get_thumbnail_path(cache_key, variant, fmt)
     
-    if os.path.exists(cached_path):
-        logger.debug(f"Using cached thumbnail: {cached_path}")
+    data = _memory_cache_get(file_name)
+    if data is not None:
+        _record_cache_lookup(True)
+        touch(file_name)
+        return data
+    
+    try:
         with open(cached_path, 'rb') as f:
-            return f.read()
+            data = f.read()
+    except FileNotFoundError:
+        data = None
+    if data is not None:
+        logger.debug(f"Using cached thumbnail: {cached_path}")
+        _record_cache_lookup(True)
+        touch(file_name)
+        _memory_cache_put(file_name, data)
+        return data
+    
+    _record_cache_lookup(False)
+    logger.info(f"Cache miss, generating thumbnail: {remote_path}")
     
-    logger.info(f"Cache miss, generating thumbnail on NAS using ffmpeg: {remote_path}")
+    renditions = [(variant, fmt)]
+    if variant in THUMBNAIL_BASE_VARIANTS:
+        renditions += [rendition for rendition in base_renditions()
+                       if rendition != (variant, fmt) and not os.path.exists(get_thumbnail_path(cache_key, *rendition))]
     
-    # Use ffmpeg on the NAS to generate thumbnail remotely, then transfer the small file
-    # This is much more efficient than downloading the full image
     try:
         if not SSHClient.is_connected():
             success, error = SSHClient.connect()
@@ -55,58 +277,313 @@ def fetch_and_resize_image(remote_path: str, max_size: int = 512) -> Optional[by
                 logger.error(f"SSH connection failed: {error}")
                 return None
         
-        logger.debug(f"Running ffmpeg to generate {max_size}px thumbnail")
-        
-        # Use ffmpeg to resize and output to stdout as JPEG
-        # Suppress ffmpeg banner and info with -loglevel error
-        # -i input file
-        # -vf scale to maintain aspect ratio, max dimension is max_size
-        # -frames:v 1 to output only one frame
-        # -c:v mjpeg for JPEG output
-        # -q:v 5 for quality (2-5 is good, 2=best)
-        # -f mjpeg for MJPEG format output
-        ffmpeg_cmd = f'ffmpeg -loglevel error -i "{remote_path}" -vf "scale=\'min({max_size},iw)\':\'min({max_size},ih)\':force_original_aspect_ratio=decrease" -frames:v 1 -c:v mjpeg -q:v 5 -f mjpeg pipe:1'
-        
-        # Execute ffmpeg and capture binary output
-        transport = SSHClient._client.get_transport()
-        channel = transport.open_session()
-        channel.exec_command(ffmpeg_cmd)
-        
-        # Read binary thumbnail data from stdout
-        thumbnail_bytes = b''
-        while True:
-            chunk = channel.recv(8192)
-            if not chunk:
-                break
-            thumbnail_bytes += chunk
-        
-        # Read any error output
-        stderr_bytes = b''
-        while channel.recv_stderr_ready():
-            stderr_bytes += channel.recv_stderr(8192)
-        
-        exit_status = channel.recv_exit_status()
-        channel.close()
-        
-        if exit_status != 0:
-            stderr_text = stderr_bytes.decode('utf-8', errors='ignore') if stderr_bytes else 'No error output'
-            logger.error(f"ffmpeg failed with exit status {exit_status}. Error: {stderr_text}")
-            return None
-        
-        if not thumbnail_bytes:
-            logger.error(f"ffmpeg succeeded but produced no output")
-            return None
-        
-        logger.info(f"Thumbnail generated successfully: {len(thumbnail_bytes)} bytes")
-        
-        # Cache the thumbnail
-        os.makedirs(os.path.dirname(cached_path), exist_ok=True)
-        with open(cached_path, 'wb') as f:
-            f.write(thumbnail_bytes)
-        
-        return thumbnail_bytes
-        
+        _generate([remote_path], {remote_path: (size, mtime)}, {remote_path: (cache_key, content_hash)},
+                  renditions, max_size)
+        with open(cached_path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        logger.error(f"No {variant} {fmt} thumbnail could be made for {remote_path}")
+        return None
     except Exception as e:
-        logger.exception(f"Error generating thumbnail with ffmpeg: {e}")
+        logger.exception(f"Error generating thumbnail: {e}")
+        return None
+    
+    logger.info(f"Thumbnail generated successfully: {len(data)} bytes")
+    _memory_cache_put(file_name, data)
+    return data
+
+def get_placeholders(remote_paths: List[str]) -> Dict[str, bytes]:
+    """
+    Tiny JPEG renditions of images that already have one cached, for inlining as
+    placeholders while the full thumbnail loads. Uses only the scan index and the local
+    cache; images without a cached tiny variant are left out.
+    """
+    stats = get_indexed_stats_batch(list(dict.fromkeys(remote_paths)))
+    placeholders: Dict[str, bytes] = {}
+    for path, (cache_key, _) in get_thumbnail_keys(stats).items():
+        try:
+            with open(get_thumbnail_path(cache_key, 'tiny'), 'rb') as f:
+                placeholders[path] = f.read()
+        except FileNotFoundError:
+            continue
+    return placeholders
+
+
+def _rendition_outputs(renditions: List[Rendition], max_size: Optional[int]) -> str:
+    """ffmpeg filter graph and outputs that make every rendition from one decode, into $1-<variant>.<ext>."""
+    labels = ''.join(f"[v{i}]" for i in range(len(renditions)))
+    graph = [f"[0:v]split={len(renditions)}{labels}"]
+    outputs = []
+    for i, (variant, fmt) in enumerate(renditions):
+        side = variant_size(variant, max_size)
+        graph.append(f"[v{i}]scale=w=min({side}\\,iw):h=min({side}\\,ih):force_original_aspect_ratio=decrease[o{i}]")
+        outputs.append(f"-map \"[o{i}]\" -frames:v 1 {_ENCODER_OPTIONS[fmt]} \"$1-{variant}.{FORMAT_EXTENSIONS[fmt]}\"")
+    return f"-filter_complex \"{';'.join(graph)}\" " + ' '.join(outputs)
+
+def _batch_thumbnail_command(renditions: List[Rendition], max_size: Optional[int]) -> str:
+    """
+    Remote pipeline for generating thumbnails. stdin holds null-delimited (index, path) pairs;
+    xargs hands THUMBNAIL_TAR_CHUNK of them at a time to one shell, which runs ffmpeg once
+    per image to write every rendition into a scratch directory as <index>-<variant>.<ext>,
+    and then writes the chunk to stdout as a tar archive. Failed images are left out.
+    """
+    return (
+        "d=$(mktemp -d) || exit 1; trap 'rm -rf \"$d\"' EXIT; cd \"$d\" || exit 1; "
+        f"xargs -0 -n {2 * THUMBNAIL_TAR_CHUNK} -x sh -c '"
+        "while [ $# -gt 1 ]; do "
+        f"ffmpeg -nostdin -loglevel error -i \"$2\" {_rendition_outputs(renditions, max_size)} "
+        "2>/dev/null || rm -f \"$1\"-*; "
+        "shift 2; done; "
+        "tar -cf - . 2>/dev/null; rm -f ./*-*' _"
+    )
+
+def _write_cache_file(cached_path: str, data: bytes):
+    """
+    Write a thumbnail into the cache atomically, so readers never see a partial file.
+    Each write gets its own temporary file, so concurrent writers of one rendition can't
+    clobber each other; the last to finish wins with a complete file.
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(cached_path),
+                                     prefix=os.path.basename(cached_path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, cached_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+def _parse_member_name(name: str) -> Optional[Tuple[int, Rendition]]:
+    """(batch index, rendition) of a generated file named <index>-<variant>.<ext>."""
+    stem, ext = os.path.splitext(name)
+    index, _, variant = stem.partition('-')
+    fmt = next((fmt for fmt, known in FORMAT_EXTENSIONS.items() if f".{known}" == ext), None)
+    if not index.isdigit() or variant not in THUMBNAIL_VARIANTS or fmt is None:
         return None
+    return int(index), (variant, fmt)
 
+def _generate_batch(batch: List[str], stats: Dict[str, Tuple[int, float]],
+                    keys: Dict[str, Tuple[str, Optional[str]]], renditions: List[Rendition],
+                    max_size: Optional[int]) -> Dict[str, List[Rendition]]:
+    """
+    Generate the given renditions for one batch with a single remote command.
+    Returns {path: renditions written to the cache}.
+    """
+    stdin_data = b''.join(encode_remote(f"{i}\0{path}\0") for i, path in enumerate(batch))
+    generated: Dict[str, List[Rendition]] = {}
+    entries: List[Tuple[str, str, float, int, int, Optional[str]]] = []
+    command = _batch_thumbnail_command(renditions, max_size)
+    try:
+        with SSHClient.open_binary_stream(command, stdin_data=stdin_data) as stream:
+            # One tar archive per chunk, back to back; ignore_zeros reads past each end-of-archive
+            with tarfile.open(fileobj=stream, mode='r|', ignore_zeros=True) as archive:
+                for member in archive:
+                    parsed = _parse_member_name(os.path.basename(member.name))
+                    if not member.isfile() or not member.size or not parsed or parsed[0] >= len(batch):
+                        continue
+                    index, rendition = parsed
+                    path = batch[index]
+                    cache_key, content_hash = keys[path]
+                    _write_cache_file(get_thumbnail_path(cache_key, *rendition), archive.extractfile(member).read())
+                    generated.setdefault(path, []).append(rendition)
+                    size, mtime = stats[path]
+                    entries.append((thumbnail_file_name(cache_key, *rendition), path, mtime, size, member.size, content_hash))
+    finally:
+        # Thumbnails written before a failure are in the cache, so account for them too
+        record_entries(entries)
+    return generated
+
+def _store_rendered(rendered: Dict[str, List[bytes]], stats: Dict[str, Tuple[int, float]],
+                    keys: Dict[str, Tuple[str, Optional[str]]],
+                    renditions: List[Rendition]) -> Dict[str, List[Rendition]]:
+    """Write renditions made in this process into the cache. Returns {path: renditions written}."""
+    generated: Dict[str, List[Rendition]] = {}
+    entries: List[Tuple[str, str, float, int, int, Optional[str]]] = []
+    try:
+        for path, data_list in rendered.items():
+            cache_key, content_hash = keys[path]
+            size, mtime = stats[path]
+            for rendition, data in zip(renditions, data_list):
+                _write_cache_file(get_thumbnail_path(cache_key, *rendition), data)
+                entries.append((thumbnail_file_name(cache_key, *rendition), path, mtime, size, len(data), content_hash))
+            generated[path] = list(renditions)
+    finally:
+        record_entries(entries)
+    return generated
+
+def _generate_from_previews(batch: List[str], stats: Dict[str, Tuple[int, float]],
+                            keys: Dict[str, Tuple[str, Optional[str]]], renditions: List[Rendition],
+                            max_size: Optional[int]) -> Dict[str, List[Rendition]]:
+    """
+    Make renditions locally from the embedded JPEG previews of RAW files (and the EXIF
+    thumbnails of JPEGs, for small enough renditions), reading only a fraction of each file
+    over SFTP instead of having ffmpeg decode it on the NAS.
+    Returns {path: renditions written to the cache} for the files that had a usable preview.
+    """
+    sides = [variant_size(variant, max_size) for variant, _ in renditions]
+    fmts = [fmt for _, fmt in renditions]
+    candidates = [path for path in batch if wants_embedded_preview(path, max(sides))]
+    if not candidates:
+        return {}
+    
+    with ThreadPoolExecutor(max_workers=min(PREVIEW_WORKERS, len(candidates))) as pool:
+        results = list(pool.map(lambda path: extract_renditions(path, sides, fmts), candidates))
+    return _store_rendered({path: rendered for path, rendered in zip(candidates, results) if rendered},
+                           stats, keys, renditions)
+
+def _generate_locally(batch: List[str], stats: Dict[str, Tuple[int, float]],
+                      keys: Dict[str, Tuple[str, Optional[str]]], renditions: List[Rendition],
+                      max_size: Optional[int]) -> Dict[str, List[Rendition]]:
+    """
+    Make renditions with the local engine: sources are read over SFTP and decoded here with
+    Pillow, so the NAS does no decoding. Returns {path: renditions written to the cache}.
+    """
+    sides = [variant_size(variant, max_size) for variant, _ in renditions]
+    fmts = [fmt for _, fmt in renditions]
+    return _store_rendered(render_locally(batch, sides, fmts), stats, keys, renditions)
+
+def _generate(batch: List[str], stats: Dict[str, Tuple[int, float]],
+              keys: Dict[str, Tuple[str, Optional[str]]], renditions: List[Rendition],
+              max_size: Optional[int]) -> Dict[str, List[Rendition]]:
+    """
+    Generate renditions for a batch, sharing work with other threads: images whose cache key
+    another thread is already generating are waited for rather than generated again, and
+    only made here if they still lack a rendition afterwards.
+    Returns {path: renditions written to the cache, or found there after waiting}.
+    """
+    generated: Dict[str, List[Rendition]] = {}
+    pending = batch
+    while pending:
+        claimed, busy = [], []
+        with _in_flight_lock:
+            for path in pending:
+                cache_key = keys[path][0]
+                if cache_key in _in_flight:
+                    busy.append((path, _in_flight[cache_key]))
+                else:
+                    _in_flight[cache_key] = threading.Event()
+                    claimed.append(path)
+        try:
+            if claimed:
+                generated.update(_make_renditions(claimed, stats, keys, renditions, max_size))
+        finally:
+            with _in_flight_lock:
+                for path in claimed:
+                    _in_flight.pop(keys[path][0]).set()
+        
+        pending = []
+        deadline = time.monotonic() + IN_FLIGHT_WAIT_SECONDS
+        for path, event in busy:
+            event.wait(max(deadline - time.monotonic(), 0))
+            if all(os.path.exists(get_thumbnail_path(keys[path][0], *rendition)) for rendition in renditions):
+                generated[path] = list(renditions)
+            elif event.is_set():
+                pending.append(path)
+            else:
+                # Still running elsewhere after the wait; make it here rather than hold up the caller
+                generated.update(_make_renditions([path], stats, keys, renditions, max_size))
+    return generated
+
+def _make_renditions(batch: List[str], stats: Dict[str, Tuple[int, float]],
+                     keys: Dict[str, Tuple[str, Optional[str]]], renditions: List[Rendition],
+                     max_size: Optional[int]) -> Dict[str, List[Rendition]]:
+    """
+    Generate renditions for a batch: from embedded previews where possible, then with the
+    engine chosen for the batch. Files the local engine can't decode go to ffmpeg on the NAS,
+    and if ffmpeg makes nothing the ones it can decode are tried locally after all.
+    """
+    generated = _generate_from_previews(batch, stats, keys, renditions, max_size)
+    remaining = [path for path in batch if path not in generated]
+    if not remaining:
+        return generated
+    
+    tried_locally = choose_engine() == ENGINE_LOCAL
+    if tried_locally:
+        generated.update(_generate_with_local_engine(remaining, stats, keys, renditions, max_size))
+        remaining = [path for path in remaining if path not in generated]
+    if remaining:
+        started = time.monotonic()
+        try:
+            made = _generate_batch(remaining, stats, keys, renditions, max_size)
+        except BATCH_ERRORS as e:
+            logger.warning(f"Remote thumbnail batch failed: {e}")
+            made = {}
+        record_latency(ENGINE_REMOTE, time.monotonic() - started, len(made), len(remaining))
+        generated.update(made)
+        if not made and not tried_locally:
+            generated.update(_generate_with_local_engine(remaining, stats, keys, renditions, max_size))
+    return generated
+
+def _generate_with_local_engine(paths: List[str], stats: Dict[str, Tuple[int, float]],
+                                keys: Dict[str, Tuple[str, Optional[str]]], renditions: List[Rendition],
+                                max_size: Optional[int]) -> Dict[str, List[Rendition]]:
+    """_generate_locally for the paths the local engine can decode, timed for choose_engine."""
+    local = [path for path in paths if decodes_locally(path)]
+    if not local:
+        return {}
+    started = time.monotonic()
+    made = _generate_locally(local, stats, keys, renditions, max_size)
+    record_latency(ENGINE_LOCAL, time.monotonic() - started, len(made), len(local))
+    return made
+
+def generate_thumbnails(remote_paths: List[str], max_size: int = 512,
+                        progress: Optional[ScanProgress] = None) -> Dict[str, str]:
+    """
+    Make sure many remote images have thumbnails in the local cache, in every base size
+    class and format. File stats come from the scan index, like /api/thumb's, and files it
+    doesn't cover are stat'ed a few thousand per SSH round trip. RAW files are thumbnailed
+    from their embedded previews. Other missing renditions are made per THUMBNAIL_BATCH_SIZE
+    images by the engine chosen for the batch: either on the NAS by one long-lived ffmpeg
+    pipeline, which decodes each image once and streams the renditions back as tar archives
+    straight into the cache, or locally from the source bytes. Identical files with a known
+    content hash are generated once.
+    Returns {remote_path: cached medium JPEG path} for every image that has one.
+    """
+    unique_paths = list(dict.fromkeys(remote_paths))
+    stats = get_indexed_stats_batch(unique_paths)
+    unindexed = [path for path in unique_paths if path not in stats]
+    if unindexed:
+        stats.update(stat_remote_files(unindexed))
+    keys = get_thumbnail_keys(stats)
+    renditions = base_renditions()
+    
+    # Images to generate, grouped by which renditions they lack; identical files share a
+    # content-addressed thumbnail, so only one of them is generated
+    todo: Dict[Tuple[Rendition, ...], List[str]] = {}
+    seen_keys = set()
+    for path in stats:
+        cache_key = keys[path][0]
+        lacking = tuple(rendition for rendition in renditions if not os.path.exists(get_thumbnail_path(cache_key, *rendition)))
+        if not lacking:
+            touch(thumbnail_file_name(cache_key))
+        elif cache_key not in seen_keys:
+            seen_keys.add(cache_key)
+            todo.setdefault(lacking, []).append(path)
+    
+    generated_count = 0
+    for lacking, pending in todo.items():
+        for start in range(0, len(pending), THUMBNAIL_BATCH_SIZE):
+            if progress:
+                progress.check_cancelled()
+            batch = pending[start:start + THUMBNAIL_BATCH_SIZE]
+            try:
+                generated = _generate(batch, stats, keys, list(lacking), max_size)
+            except BATCH_ERRORS as e:
+                logger.error(f"Batch thumbnail generation failed: {e}")
+                generated = {}
+            generated_count += len(generated)
+            if progress:
+                progress.add_thumbnails(len(generated), len(batch) - len(generated))
+    
+    cached: Dict[str, str] = {}
+    for path in stats:
+        cached_path = get_thumbnail_path(keys[path][0])
+        if os.path.exists(cached_path):
+            cached[path] = cached_path
+    
+    logger.info(f"Thumbnails for {len(remote_paths)} images: {generated_count} generated, "
+                f"{len(cached)} available, {len(stats) - len(cached)} failed")
+    return cached
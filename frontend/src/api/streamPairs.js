@@ -0,0 +1,40 @@
+// Reads an NDJSON list of duplicate pairs (GET /api/scan/duplicates?stream=true),
+// calling onPairs with batches of parsed pairs as they arrive. The first batch is
+// delivered as soon as it is parsed; later ones are coalesced so that each batch is
+// at least as large as everything delivered before it, which keeps appending them
+// to React state linear in the number of pairs.
+export async function streamPairs(url, onPairs, signal) {
+  const response = await fetch(url, { signal })
+  if (!response.ok) {
+    throw new Error(`Request failed with status ${response.status}`)
+  }
+
+  const reader = response.body.getReader()
+  const decoder = new TextDecoder()
+  let buffered = ''
+  let pending = []
+  let delivered = 0
+
+  const flush = () => {
+    if (!pending.length) return
+    onPairs(pending)
+    delivered += pending.length
+    pending = []
+  }
+
+  while (true) {
+    const { done, value } = await reader.read()
+    if (done) break
+    buffered += decoder.decode(value, { stream: true })
+    const lines = buffered.split('\n')
+    buffered = lines.pop()
+    for (const line of lines) {
+      if (line) pending.push(JSON.parse(line))
+    }
+    if (pending.length >= delivered) flush()
+  }
+
+  buffered += decoder.decode()
+  if (buffered.trim()) pending.push(JSON.parse(buffered))
+  flush()
+}
@@ -92,6 +92,11 @@ function StatsSidebar({ stats, scanSessionId, isScanning, hasSettings }) {
                     <div className="text-xs text-sh-text-muted pt-1">
                       {stats.total || 0} total found
                     </div>
+                    {stats.reclaimable_bytes > 0 && (
+                      <div className="text-xs text-sh-text-muted">
+                        {formatBytes(stats.reclaimable_bytes)} reclaimable
+                      </div>
+                    )}
                   </div>
                 </div>
 
@@ -120,6 +125,11 @@ function StatsSidebar({ stats, scanSessionId, isScanning, hasSettings }) {
                         </svg>
                       }
                     />
+                    {stats.reclaimed_bytes > 0 && (
+                      <div className="text-xs text-sh-text-muted pt-1">
+                        {formatBytes(stats.reclaimed_bytes)} freed
+                      </div>
+                    )}
                   </div>
                 </div>
               </>
@@ -131,6 +141,17 @@ function StatsSidebar({ stats, scanSessionId, isScanning, hasSettings }) {
   )
 }
 
+function formatBytes(bytes) {
+  const units = ['B', 'KB', 'MB', 'GB', 'TB']
+  let value = bytes
+  let unit = 0
+  while (value >= 1024 && unit < units.length - 1) {
+    value /= 1024
+    unit++
+  }
+  return `${value.toFixed(unit === 0 ? 0 : 1)} ${units[unit]}`
+}
+
 function StatItem({ label, value, color, icon }) {
   return (
     <div className="flex items-center justify-between bg-sh-bg-secondary/50 rounded-lg p-3 hover:bg-sh-surface/50 transition-colors duration-200">
@@ -0,0 +1,30 @@
+import { useState } from 'react'
+
+// Thumbnail of a NAS image in a size class (tiny, small, medium, large). While it loads, the
+// inlined tiny placeholder, if one is given, is shown blurred in its place.
+function Thumbnail({ path, size = 'medium', placeholder, alt, className = '' }) {
+  const src = `/api/thumb?path=${encodeURIComponent(path)}&size=${size}`
+  const [loadedSrc, setLoadedSrc] = useState(null)
+  const loaded = loadedSrc === src
+
+  return (
+    <div className="relative w-full h-full flex items-center justify-center">
+      {placeholder && !loaded && (
+        <img
+          src={placeholder}
+          alt=""
+          aria-hidden="true"
+          className="absolute inset-0 w-full h-full object-contain blur-md"
+        />
+      )}
+      <img
+        src={src}
+        alt={alt}
+        onLoad={() => setLoadedSrc(src)}
+        className={`${className} transition-opacity duration-200 ${loaded ? 'opacity-100' : 'opacity-0'}`}
+      />
+    </div>
+  )
+}
+
+export default Thumbnail
@@ -1,7 +1,18 @@
-import { useState, useEffect, useCallback } from 'react'
+import { useState, useEffect, useCallback, useRef } from 'react'
+import { streamPairs } from '../api/streamPairs'
 import SettingsSidebar from '../components/SettingsSidebar'
 import HelpSidebar from '../components/HelpSidebar'
 import StatsSidebar from '../components/StatsSidebar'
+import Thumbnail from '../components/Thumbnail'
+
+const MATCH_LABELS = {
+  identical: { label: 'Identical content', className: 'bg-sh-primary/10 text-sh-primary' },
+  same_size_different_content: { label: 'Same size, different content', className: 'bg-sh-warning/10 text-sh-warning' },
+  different: { label: 'Different files', className: 'bg-sh-error/10 text-sh-error' },
+}
+
+// Upcoming pairs whose tiny placeholder thumbnails are loaded ahead
+const PLACEHOLDER_AHEAD = 10
 
 function InboxScreen() {
   const [activeTab, setActiveTab] = useState('duplicates')
@@ -13,10 +24,13 @@ function InboxScreen() {
   const [stats, setStats] = useState(null)
   const [actionInProgress, setActionInProgress] = useState(false)
   const [scanning, setScanning] = useState(false)
+  const [scanJob, setScanJob] = useState(null)
   const [settingsOpen, setSettingsOpen] = useState(false)
   const [scanSessionId, setScanSessionId] = useState(null)
   const [selectedImage, setSelectedImage] = useState(null)
   const [showHelp, setShowHelp] = useState(false)
+  const [placeholders, setPlaceholders] = useState({})
+  const duplicatesStreamRef = useRef(null)
   
   const [settings, setSettings] = useState({
     backupPath: '',
@@ -51,41 +65,61 @@ function InboxScreen() {
   const loadDuplicates = async (sessionId) => {
     if (!sessionId) return
     
+    // A newer load replaces any stream still in progress
+    duplicatesStreamRef.current?.abort()
+    const controller = new AbortController()
+    duplicatesStreamRef.current = controller
+    
     setLoading(true)
     setError(null)
     setSelectedImage(null)
-    try {
-      const response = await fetch(`/api/scan/duplicates?scan_session_id=${encodeURIComponent(sessionId)}`)
-      const data = await response.json()
-      if (data.error) {
-        setError(data.error)
-        setDuplicatePairs([])
-      } else {
-        const pairs = (data.pairs || []).filter(p => !p.reviewed)
-        setDuplicatePairs(pairs)
+    
+    // Pairs stream in page by page; the current list stays on screen until the first page arrives
+    let received = false
+    let firstPageArrived
+    const firstPage = new Promise(resolve => { firstPageArrived = resolve })
+    const url = `/api/scan/duplicates?scan_session_id=${encodeURIComponent(sessionId)}&stream=true`
+    const streamed = streamPairs(url, (pairs) => {
+      if (controller.signal.aborted) return
+      const isFirst = !received
+      received = true
+      setDuplicatePairs(prev => isFirst ? pairs : prev.concat(pairs))
+      if (isFirst) {
         setCurrentIndex(0)
+        setLoading(false)
+        firstPageArrived()
       }
-      
-      await loadStats(sessionId)
-      await loadIgnored(sessionId)
-    } catch (err) {
-      setError('Failed to load duplicates: ' + err.message)
-      setDuplicatePairs([])
-    } finally {
-      setLoading(false)
-    }
+    }, controller.signal)
+      .then(() => {
+        if (!received && !controller.signal.aborted) {
+          setDuplicatePairs([])
+          setCurrentIndex(0)
+        }
+      })
+      .catch(err => {
+        if (err.name === 'AbortError') return
+        setError('Failed to load duplicates: ' + err.message)
+        setDuplicatePairs([])
+      })
+      .finally(() => {
+        if (duplicatesStreamRef.current === controller) setLoading(false)
+      })
+    
+    await Promise.race([firstPage, streamed])
+    await loadStats(sessionId)
+    await loadIgnored(sessionId)
   }
 
   const loadIgnored = async (sessionId) => {
     if (!sessionId) return
     
     try {
-      const response = await fetch(`/api/scan/duplicates?scan_session_id=${encodeURIComponent(sessionId)}&include_reviewed=true`)
-      const data = await response.json()
-      if (!data.error) {
-        const ignored = (data.pairs || []).filter(p => p.reviewed && p.action === 'ignored')
-        setIgnoredPairs(ignored)
-      }
+      const ignored = []
+      await streamPairs(
+        `/api/scan/duplicates?scan_session_id=${encodeURIComponent(sessionId)}&include_reviewed=true&action=ignored&stream=true`,
+        pairs => { for (const pair of pairs) ignored.push(pair) }
+      )
+      setIgnoredPairs(ignored)
     } catch (err) {
       console.error('Failed to load ignored pairs:', err)
     }
@@ -124,18 +158,43 @@ function InboxScreen() {
       
       const data = await response.json()
       
-      if (data.success) {
-        const sessionId = data.scan_session_id
+      if (!data.success) {
+        setError(data.detail || 'Scan failed')
+        return
+      }
+      
+      // The scan runs as a background job; poll it until it finishes
+      let job = null
+      while (true) {
+        await new Promise(resolve => setTimeout(resolve, 1000))
+        const jobResponse = await fetch(`/api/scan/jobs/${data.job_id}`)
+        job = await jobResponse.json()
+        setScanJob(job)
+        if (job.status !== 'queued' && job.status !== 'running') break
+      }
+      
+      if (job.status === 'completed') {
+        const sessionId = job.result.scan_session_id
         setScanSessionId(sessionId)
         localStorage.setItem('lastScanSessionId', sessionId)
         await loadDuplicates(sessionId)
-      } else {
-        setError(data.error || 'Scan failed')
+      } else if (job.status === 'failed') {
+        setError(job.error || 'Scan failed')
       }
     } catch (err) {
       setError('Failed to start scan: ' + err.message)
     } finally {
       setScanning(false)
+      setScanJob(null)
+    }
+  }
+  
+  const handleCancelScan = async () => {
+    if (!scanJob) return
+    try {
+      await fetch(`/api/scan/jobs/${scanJob.id}/cancel`, { method: 'POST' })
+    } catch (err) {
+      console.error('Failed to cancel scan:', err)
     }
   }
   
@@ -159,7 +218,8 @@ function InboxScreen() {
         throw new Error('Failed to ignore duplicate')
       }
       
-      const newPairs = duplicatePairs.filter((_, idx) => idx !== currentIndex)
+      // Ignoring applies to the backup file, so all of its pairs leave the queue
+      const newPairs = duplicatePairs.filter(p => p.id !== currentPair.id)
       setDuplicatePairs(newPairs)
       setSelectedImage(null)
       
@@ -197,7 +257,7 @@ function InboxScreen() {
         throw new Error(data.detail || 'Failed to delete duplicate')
       }
       
-      const newPairs = duplicatePairs.filter((_, idx) => idx !== currentIndex)
+      const newPairs = duplicatePairs.filter(p => p.backup_path !== currentPair.backup_path)
       setDuplicatePairs(newPairs)
       setSelectedImage(null)
       
@@ -273,6 +333,35 @@ function InboxScreen() {
   const currentIgnoredPair = ignoredPairs[currentIndex]
   const totalIgnored = ignoredPairs.length
 
+  // Let the server warm thumbnails for the pairs after the current one
+  const currentPairId = activeTab === 'duplicates' ? currentPair?.id : undefined
+  useEffect(() => {
+    if (!scanSessionId || currentPairId === undefined) return
+    fetch('/api/thumbs/prefetch', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ scan_session_id: scanSessionId, current_id: currentPairId })
+    }).catch(err => console.error('Failed to prefetch thumbnails:', err))
+  }, [scanSessionId, currentPairId])
+
+  // Inline tiny thumbnails of the upcoming pairs, shown blurred while the full ones load
+  useEffect(() => {
+    if (currentPairId === undefined) return
+    const paths = duplicatePairs
+      .slice(currentIndex, currentIndex + PLACEHOLDER_AHEAD)
+      .flatMap(pair => [pair.backup_path, pair.sorted_path])
+      .filter(path => path && !(path in placeholders))
+    if (!paths.length) return
+    fetch('/api/thumbs/placeholders', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ paths })
+    })
+      .then(response => response.json())
+      .then(data => setPlaceholders(prev => ({ ...prev, ...data.placeholders })))
+      .catch(err => console.error('Failed to load thumbnail placeholders:', err))
+  }, [currentPairId])
+
   const handlePrevious = useCallback(() => {
     if (activeTab === 'duplicates' && duplicatePairs.length > 0) {
       setCurrentIndex(prev => (prev > 0 ? prev - 1 : duplicatePairs.length - 1))
@@ -472,9 +561,22 @@ function InboxScreen() {
             <p className="text-sh-text-secondary text-lg mb-8">
               Comparing files between backup and sorted directories.
             </p>
+            {scanJob?.progress && (
+              <div className="text-sh-text-secondary text-sm mb-6 space-y-1">
+                <div>Phase: {scanJob.progress.phase.replace('_', ' ')}</div>
+                <div>
+                  {scanJob.progress.files_walked.toLocaleString()} files walked · {scanJob.progress.images_matched.toLocaleString()} images · {scanJob.progress.pairs_found.toLocaleString()} pairs
+                </div>
+              </div>
+            )}
             <div className="sh-card bg-sh-info/10 border-sh-info p-4 text-sh-info text-sm">
               This may take a while for large directories
             </div>
+            {scanJob && (
+              <button onClick={handleCancelScan} className="sh-button-secondary mt-6">
+                Cancel Scan
+              </button>
+            )}
           </div>
         </div>
       </>
@@ -600,7 +702,14 @@ function InboxScreen() {
           ) : (
         <>
           <div className="flex justify-between items-center mb-6">
-            <h3 className="text-2xl font-bold text-sh-text">Review Duplicates</h3>
+            <h3 className="flex items-center gap-3 text-2xl font-bold text-sh-text">
+              Review Duplicates
+              {currentPair?.match_status && MATCH_LABELS[currentPair.match_status] && (
+                <span className={`text-xs font-semibold px-2 py-1 rounded ${MATCH_LABELS[currentPair.match_status].className}`}>
+                  {MATCH_LABELS[currentPair.match_status].label}
+                </span>
+              )}
+            </h3>
             <div className="text-xl font-bold text-sh-primary">
               {currentIndex + 1} / {totalPairs}
             </div>
@@ -626,8 +735,9 @@ function InboxScreen() {
               </h4>
               <div className="w-full h-96 bg-sh-bg-tertiary flex items-center justify-center rounded-lg mb-4 border-2 border-sh-border overflow-hidden">
                 {currentPair?.backup_path ? (
-                  <img
-                    src={`/api/thumb?path=${encodeURIComponent(currentPair.backup_path)}`}
+                  <Thumbnail
+                    path={currentPair.backup_path}
+                    placeholder={placeholders[currentPair.backup_path]}
                     alt="Backup"
                     className="max-w-full max-h-full object-contain"
                   />
@@ -638,6 +748,16 @@ function InboxScreen() {
               <div className="text-sm font-mono text-sh-text-secondary break-all p-3 bg-sh-bg-tertiary rounded-lg border border-sh-border">
                 {currentPair?.backup_path || 'N/A'}
               </div>
+              {currentPair?.backup_path && (
+                <a
+                  href={`/api/original?path=${encodeURIComponent(currentPair.backup_path)}`}
+                  target="_blank"
+                  rel="noopener noreferrer"
+                  className="inline-block mt-2 text-sm text-sh-primary hover:underline"
+                >
+                  View original
+                </a>
+              )}
             </div>
 
             <div className={`sh-card p-6 transition-all duration-200 ${
@@ -658,8 +778,9 @@ function InboxScreen() {
               </h4>
               <div className="w-full h-96 bg-sh-bg-tertiary flex items-center justify-center rounded-lg mb-4 border-2 border-sh-border overflow-hidden">
                 {currentPair?.sorted_path ? (
-                  <img
-                    src={`/api/thumb?path=${encodeURIComponent(currentPair.sorted_path)}`}
+                  <Thumbnail
+                    path={currentPair.sorted_path}
+                    placeholder={placeholders[currentPair.sorted_path]}
                     alt="Kept"
                     className="max-w-full max-h-full object-contain"
                   />
@@ -670,6 +791,16 @@ function InboxScreen() {
               <div className="text-sm font-mono text-sh-text-secondary break-all p-3 bg-sh-bg-tertiary rounded-lg border border-sh-border">
                 {currentPair?.sorted_path || 'N/A'}
               </div>
+              {currentPair?.sorted_path && (
+                <a
+                  href={`/api/original?path=${encodeURIComponent(currentPair.sorted_path)}`}
+                  target="_blank"
+                  rel="noopener noreferrer"
+                  className="inline-block mt-2 text-sm text-sh-primary hover:underline"
+                >
+                  View original
+                </a>
+              )}
             </div>
           </div>
 
@@ -771,8 +902,9 @@ function InboxScreen() {
               </h4>
               <div className="w-full h-96 bg-sh-bg-tertiary flex items-center justify-center rounded-lg mb-4 border-2 border-sh-border overflow-hidden">
                 {currentIgnoredPair?.backup_path ? (
-                  <img
-                    src={`/api/thumb?path=${encodeURIComponent(currentIgnoredPair.backup_path)}`}
+                  <Thumbnail
+                    path={currentIgnoredPair.backup_path}
+                    placeholder={placeholders[currentIgnoredPair.backup_path]}
                     alt="Backup"
                     className="max-w-full max-h-full object-contain"
                   />
@@ -803,8 +935,9 @@ function InboxScreen() {
               </h4>
               <div className="w-full h-96 bg-sh-bg-tertiary flex items-center justify-center rounded-lg mb-4 border-2 border-sh-border overflow-hidden">
                 {currentIgnoredPair?.sorted_path ? (
-                  <img
-                    src={`/api/thumb?path=${encodeURIComponent(currentIgnoredPair.sorted_path)}`}
+                  <Thumbnail
+                    path={currentIgnoredPair.sorted_path}
+                    placeholder={placeholders[currentIgnoredPair.sorted_path]}
                     alt="Kept"
                     className="max-w-full max-h-full object-contain"
                   />
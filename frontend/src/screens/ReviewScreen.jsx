@@ -1,5 +1,7 @@
 import { useState, useEffect, useRef, useCallback } from 'react'
 import { useLocation, useNavigate } from 'react-router-dom'
+import { streamPairs } from '../api/streamPairs'
+import Thumbnail from '../components/Thumbnail'
 
 function ReviewScreen() {
   const location = useLocation()
@@ -15,6 +17,7 @@ function ReviewScreen() {
   const [stats, setStats] = useState(null)
   const [actionInProgress, setActionInProgress] = useState(false)
   const containerRef = useRef(null)
+  const duplicatesStreamRef = useRef(null)
 
   useEffect(() => {
     if (!scanSessionId) {
@@ -26,38 +29,59 @@ function ReviewScreen() {
   }, [scanSessionId, navigate])
 
   const loadDuplicates = async () => {
+    // A newer load replaces any stream still in progress
+    duplicatesStreamRef.current?.abort()
+    const controller = new AbortController()
+    duplicatesStreamRef.current = controller
+    
     setLoading(true)
     setError(null)
-    try {
-      const response = await fetch(`/api/scan/duplicates?scan_session_id=${encodeURIComponent(scanSessionId)}`)
-      const data = await response.json()
-      if (data.error) {
-        setError(data.error)
-        setDuplicatePairs([])
-        setAllPairs([])
-      } else {
-        const pairs = (data.pairs || []).map(pair => ({
-          backup_path: pair.backup_path,
-          sorted_path: pair.sorted_path,
-          id: pair.id,
-          reviewed: pair.reviewed,
-          action: pair.action
-        }))
-        setAllPairs(pairs)
-        const unreviewed = pairs.filter(p => !p.reviewed)
-        setDuplicatePairs(unreviewed)
+    
+    // Show the first page as soon as it arrives; the rest is appended as it streams in
+    let received = false
+    let firstPageArrived
+    const firstPage = new Promise(resolve => { firstPageArrived = resolve })
+    const url = `/api/scan/duplicates?scan_session_id=${encodeURIComponent(scanSessionId)}&stream=true`
+    const streamed = streamPairs(url, (batch) => {
+      if (controller.signal.aborted) return
+      const pairs = batch.map(pair => ({
+        backup_path: pair.backup_path,
+        sorted_path: pair.sorted_path,
+        id: pair.id,
+        reviewed: pair.reviewed,
+        action: pair.action
+      }))
+      const isFirst = !received
+      received = true
+      setAllPairs(prev => isFirst ? pairs : prev.concat(pairs))
+      setDuplicatePairs(prev => isFirst ? pairs : prev.concat(pairs))
+      if (isFirst) {
         setCurrentIndex(0)
+        setLoading(false)
+        firstPageArrived()
       }
-      
-      await loadStats()
-    } catch (err) {
-      setError('Failed to load duplicates: ' + err.message)
-      setDuplicatePairs([])
-      setAllPairs([])
-    } finally {
-      setLoading(false)
-    }
+    }, controller.signal)
+      .then(() => {
+        if (!received && !controller.signal.aborted) {
+          setDuplicatePairs([])
+          setAllPairs([])
+          setCurrentIndex(0)
+        }
+      })
+      .catch(err => {
+        if (err.name === 'AbortError') return
+        setError('Failed to load duplicates: ' + err.message)
+        setDuplicatePairs([])
+        setAllPairs([])
+      })
+      .finally(() => {
+        if (duplicatesStreamRef.current === controller) setLoading(false)
+      })
+    
+    await Promise.race([firstPage, streamed])
+    await loadStats()
   }
+
   
   const loadStats = async () => {
     try {
@@ -89,7 +113,8 @@ function ReviewScreen() {
         throw new Error('Failed to ignore duplicate')
       }
       
-      const newPairs = duplicatePairs.filter((_, idx) => idx !== currentIndex)
+      // Ignoring applies to the backup file, so all of its pairs leave the queue
+      const newPairs = duplicatePairs.filter(p => p.id !== currentPair.id)
       setDuplicatePairs(newPairs)
       
       if (currentIndex >= newPairs.length && newPairs.length > 0) {
@@ -126,7 +151,7 @@ function ReviewScreen() {
         throw new Error(data.detail || 'Failed to delete duplicate')
       }
       
-      const newPairs = duplicatePairs.filter((_, idx) => idx !== currentIndex)
+      const newPairs = duplicatePairs.filter(p => p.backup_path !== currentPair.backup_path)
       setDuplicatePairs(newPairs)
       
       if (currentIndex >= newPairs.length && newPairs.length > 0) {
@@ -338,8 +363,8 @@ function ReviewScreen() {
               </h3>
               <div className="w-full aspect-[4/3] bg-sh-bg flex items-center justify-center rounded-lg mb-4 border-2 border-sh-border overflow-hidden shadow-sh">
                 {currentPair?.backup_path ? (
-                  <img
-                    src={`/api/thumb?path=${encodeURIComponent(currentPair.backup_path)}`}
+                  <Thumbnail
+                    path={currentPair.backup_path}
                     alt="Backup"
                     className="max-w-full max-h-full object-contain"
                   />
@@ -350,6 +375,16 @@ function ReviewScreen() {
               <div className="text-xs font-mono text-sh-text-secondary break-all p-3 bg-sh-bg-tertiary rounded-lg border border-sh-border">
                 {currentPair?.backup_path || 'N/A'}
               </div>
+              {currentPair?.backup_path && (
+                <a
+                  href={`/api/original?path=${encodeURIComponent(currentPair.backup_path)}`}
+                  target="_blank"
+                  rel="noopener noreferrer"
+                  className="inline-block mt-2 text-sm text-sh-primary hover:underline"
+                >
+                  View original
+                </a>
+              )}
             </div>
 
             <div className="sh-card p-6 border-l-4 border-sh-info bg-sh-info/5">
@@ -363,8 +398,8 @@ function ReviewScreen() {
               </h3>
               <div className="w-full aspect-[4/3] bg-sh-bg flex items-center justify-center rounded-lg mb-4 border-2 border-sh-border overflow-hidden shadow-sh">
                 {currentPair?.sorted_path ? (
-                  <img
-                    src={`/api/thumb?path=${encodeURIComponent(currentPair.sorted_path)}`}
+                  <Thumbnail
+                    path={currentPair.sorted_path}
                     alt="Kept"
                     className="max-w-full max-h-full object-contain"
                   />
@@ -375,6 +410,16 @@ function ReviewScreen() {
               <div className="text-xs font-mono text-sh-text-secondary break-all p-3 bg-sh-bg-tertiary rounded-lg border border-sh-border">
                 {currentPair?.sorted_path || 'N/A'}
               </div>
+              {currentPair?.sorted_path && (
+                <a
+                  href={`/api/original?path=${encodeURIComponent(currentPair.sorted_path)}`}
+                  target="_blank"
+                  rel="noopener noreferrer"
+                  className="inline-block mt-2 text-sm text-sh-primary hover:underline"
+                >
+                  View original
+                </a>
+              )}
             </div>
           </div>
 